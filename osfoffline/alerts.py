@@ -84,6 +84,14 @@ def create_alert_tuple(file_name, action):
     return alert_tuple
 
 
+def progress(file_name, action, percent):
+    """Show how far a transfer got in the tray menu. Never raises a balloon alert."""
+    if tray_alert_signal is None:
+        return
+    text = create_alert_tuple(file_name, action)[0]
+    tray_alert_signal.emit('{} ({}%)'.format(text, percent))
+
+
 def up_to_date():
     global tray_alert_signal
     tray_alert_signal.emit("Up to Date")
@@ -7,7 +7,7 @@ from watchdog.observers import Observer
 
 
 from osfoffline.database_manager import models
-from osfoffline.database_manager.db import session
+from osfoffline.database_manager.db import session, Session
 from osfoffline.filesystem_manager import osf_event_handler
 from osfoffline.filesystem_manager.sync_local_filesystem_and_db import LocalDBSync
 from osfoffline.polling_osf_manager import polling
@@ -68,6 +68,9 @@ class BackgroundWorker(threading.Thread):
             logger.exception(e)
         finally:
             self.stop()
+            # the sessions (and connections) of this thread are not used by anything else
+            self.event_handler.close()
+            Session.remove()
         logging.debug('Background event loop exited')
 
     def get_current_user(self):
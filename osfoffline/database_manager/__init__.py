@@ -1,3 +1,3 @@
-from osfoffline.database_manager.models import User, Node, File
+from osfoffline.database_manager.models import User, Node, File, PendingOperation
 
-CORE_OSFO_MODELS = [User, Node, File]
+CORE_OSFO_MODELS = [User, Node, File, PendingOperation]
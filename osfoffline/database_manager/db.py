@@ -1,10 +1,12 @@
 import contextlib
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
 from osfoffline.database_manager import CORE_OSFO_MODELS
+from osfoffline.database_manager.migrations import migrate, migrate_data
 from osfoffline.database_manager.models import Base
-from osfoffline.settings import PROJECT_DB_FILE
+from osfoffline.settings import PROJECT_DB_FILE, DB_CACHE_SIZE, DB_MMAP_SIZE, DB_POOL_SIZE
 
 
 URL = 'sqlite:///{}'.format(PROJECT_DB_FILE)
@@ -12,16 +14,48 @@ URL = 'sqlite:///{}'.format(PROJECT_DB_FILE)
 # sqlite+pysqlcipher://:passphrase/file_path
 # URL = 'sqlite+pysqlcipher://:PASSWORD/{DB_FILE_PATH}'.format(DB_FILE_PATH=DB_FILE_PATH)
 
-engine = create_engine(
-    URL,
-    # poolclass=SingletonThreadPool,
-    connect_args={'check_same_thread': False},
-)
+
+def create_db_engine(url):
+    """
+    Engine that hands each transaction of a session a connection of its own and keeps up to DB_POOL_SIZE of them
+    open afterwards, so the next transaction reuses a connection that is already configured and still holds its
+    page cache and memory map. Every session (of the Qt ui thread, the poller and the folder watcher) therefore
+    works on a connection no other session uses at the same time; further connections are opened as needed and
+    closed when returned. check_same_thread is disabled only so a pooled connection may be used by a different
+    thread than the one that opened it.
+    """
+    engine = create_engine(
+        url,
+        poolclass=QueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=-1,
+        connect_args={'check_same_thread': False},
+    )
+    event.listen(engine, 'connect', configure_connection)
+    return engine
+
+
+def configure_connection(dbapi_connection, connection_record):
+    # with a write ahead log readers are not blocked by a writer and commits only append to the log.
+    # synchronous=NORMAL is still safe against corruption in WAL mode, the last commits may be lost on power failure.
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    # a negative cache size is in KiB rather than pages
+    cursor.execute('PRAGMA cache_size=-{}'.format(DB_CACHE_SIZE // 1024))
+    cursor.execute('PRAGMA mmap_size={}'.format(DB_MMAP_SIZE))
+    cursor.close()
+
+
+engine = create_db_engine(URL)
 Base.metadata.create_all(engine)
+migrate(engine)
 session_factory = sessionmaker(bind=engine)
 Session = scoped_session(session_factory)
 
-session = Session()
+# proxy to the session of the calling thread
+session = Session
+migrate_data(session)
 
 def drop_db():
     with contextlib.closing(engine.connect()) as con:
@@ -0,0 +1,73 @@
+"""
+Bring databases created by older versions of OSF Offline up to date with the current models.
+
+Base.metadata.create_all only creates missing tables, so anything added to an existing table has to be
+applied here. Every step must be safe to run on each start of the application.
+"""
+import logging
+
+from sqlalchemy import inspect
+
+from osfoffline.database_manager.models import Base, Node, File
+
+
+logger = logging.getLogger(__name__)
+
+
+def add_missing_columns(engine):
+    """Add columns that exist on the models but not yet in the user's database.
+
+    New columns must be nullable (or have a server default) for this to work with SQLite.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as con:
+        for table in Base.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                logger.info('Adding column {}.{} to the database'.format(table.name, column.name))
+                con.execute('ALTER TABLE "{}" ADD COLUMN "{}" {}'.format(
+                    table.name,
+                    column.name,
+                    column.type.compile(dialect=engine.dialect)
+                ))
+
+
+def add_missing_indexes(engine):
+    """Create indexes that exist on the models but not yet in the user's database"""
+    inspector = inspect(engine)
+    created = False
+    for table in Base.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            logger.info('Adding index {} to the database'.format(index.name))
+            index.create(engine)
+            created = True
+    if created:
+        # let the query planner know about the new indexes
+        with engine.begin() as con:
+            con.execute('ANALYZE')
+
+
+def fill_materialized_paths(session):
+    """Store the paths of items saved before paths were materialized"""
+    items = session.query(Node).filter(Node.materialized_path.is_(None)).all()
+    items += session.query(File).filter(File.materialized_path.is_(None)).all()
+    for item in items:
+        if item.materialized_path is None:  # may have been filled in along with its parent
+            item.update_path()
+    if items:
+        logger.info('Stored the paths of {} items'.format(len(items)))
+        session.commit()
+
+
+def migrate(engine):
+    add_missing_columns(engine)
+    add_missing_indexes(engine)
+
+
+def migrate_data(session):
+    fill_materialized_paths(session)
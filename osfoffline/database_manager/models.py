@@ -4,7 +4,7 @@ import datetime
 import os
 
 from osfoffline.database_manager.json_type import JSONEncodedDict
-from sqlalchemy import ForeignKey, Enum
+from sqlalchemy import ForeignKey, Enum, Index, and_, event
 from sqlalchemy.orm import relationship, backref, validates
 from sqlalchemy import Column, Integer, Boolean, String, DateTime
 from sqlalchemy.ext.declarative import declarative_base
@@ -14,6 +14,19 @@ from osfoffline.utils.path import make_folder_name
 Base = declarative_base()
 
 
+def path_key(path):
+    """Normalized form of a local path used to look items up: no trailing separator, case folded on Windows"""
+    if path is None:
+        return None
+    return os.path.normcase(path.rstrip(os.path.sep))
+
+
+def below_path(model, path):
+    """Criterion matching every Node or File stored below path, answered from the path_key index"""
+    prefix = path_key(path) + os.path.sep
+    return and_(model.path_key >= prefix, model.path_key < prefix[:-1] + chr(ord(os.path.sep) + 1))
+
+
 class User(Base):
     __tablename__ = 'user'
 
@@ -56,6 +69,10 @@ class User(Base):
 # todo: make locally_created, locally_deleted enum's in a EVENTS fields rather than custom variables
 class Node(Base):
     __tablename__ = "node"
+    __table_args__ = (
+        Index('ix_node_user_id', 'user_id'),
+        Index('ix_node_parent_id', 'parent_id'),
+    )
 
     PROJECT = 'project'
     COMPONENT = 'component'
@@ -66,6 +83,12 @@ class Node(Base):
     category = Column(Enum(PROJECT, COMPONENT))
     date_modified = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
     osf_id = Column(String, unique=True, nullable=True, default=None)  # multiple things allowed to be null
+    # remote date_modified (utc) of the node the last time its files were polled and every resulting event ran
+    # successfully. It only covers the node itself, components are modified independently of their parent.
+    sync_watermark = Column(DateTime, nullable=True, default=None)
+    # local path of the node folder, see path
+    materialized_path = Column(String, nullable=True, default=None)
+    path_key = Column(String, nullable=True, default=None, index=True)
 
     locally_created = Column(Boolean, default=False)
     locally_deleted = Column(Boolean, default=False)
@@ -95,14 +118,48 @@ class Node(Base):
 
     @hybrid_property
     def path(self):
-        """Recursively walk up the path of the node. Top level node joins with the osf folder path of the user
+        """Local folder of the node. It is stored in materialized_path, which is updated whenever anything it is
+        built from changes, so reading it never walks up the tree.
         """
-        # +os.path.sep+ instead of os.path.join: http://stackoverflow.com/a/14504695
+        if self.materialized_path is None:
+            return self.build_path()
+        return self.materialized_path
 
-        if self.parent:
-            return os.path.join(self.parent.path, 'Components', make_folder_name(self.title, node_id=self.osf_id))
-        else:
-            return os.path.join(self.user.osf_local_folder_path, make_folder_name(self.title, node_id=self.osf_id))
+    @path.expression
+    def path(cls):
+        return cls.materialized_path
+
+    def build_path(self, **changed):
+        """Walk up the tree to work out the path. Top level node joins with the osf folder path of the user.
+        Values in changed are used instead of the attributes of the same name, they are about to be set.
+        """
+        # +os.path.sep+ instead of os.path.join: http://stackoverflow.com/a/14504695
+        title = changed.get('title', self.title)
+        osf_id = changed.get('osf_id', self.osf_id)
+        parent = changed.get('parent', self.parent)
+        if title is None:
+            return None
+        if parent is not None:
+            parent_path = parent.path
+            if parent_path is None:
+                return None
+            return os.path.join(parent_path, 'Components', make_folder_name(title, node_id=osf_id))
+
+        user = changed.get('user', self.user)
+        osf_folder = changed.get('osf_folder', user.osf_local_folder_path if user else None)
+        if not osf_folder:
+            return None
+        return os.path.join(osf_folder, make_folder_name(title, node_id=osf_id))
+
+    def update_path(self, **changed):
+        """Store the path of this node and everything below it"""
+        self.materialized_path = self.build_path(**changed)
+        self.path_key = path_key(self.materialized_path)
+        for node in self.child_nodes:
+            node.update_path(parent=self)
+        for file_folder in self.files:
+            if file_folder.parent is None:
+                file_folder.update_path(node=self)
 
     def locally_create_children(self):
         self.locally_created = True
@@ -142,6 +199,13 @@ class Node(Base):
 
 class File(Base):
     __tablename__ = "file"
+    # osf_id and osf_path can not be unique yet (see below), so these are plain indexes
+    __table_args__ = (
+        Index('ix_file_osf_id', 'osf_id'),
+        Index('ix_file_user_id', 'user_id'),
+        Index('ix_file_node_id_osf_path', 'node_id', 'osf_path'),
+        Index('ix_file_parent_id_name', 'parent_id', 'name'),
+    )
 
     FOLDER = 'folder'
     FILE = 'file'
@@ -152,6 +216,15 @@ class File(Base):
     name = Column(String)
 
     hash = Column(String)
+    # hash of the content the local and remote copies last agreed on
+    synced_hash = Column(String, nullable=True, default=None)
+    # local path of the file or folder, see path
+    materialized_path = Column(String, nullable=True, default=None)
+    path_key = Column(String, nullable=True, default=None, index=True)
+    # os.stat of the local file when it was last looked at, see update_stat
+    cached_size = Column(Integer, nullable=True, default=None)
+    mtime_ns = Column(Integer, nullable=True, default=None)
+    inode = Column(Integer, nullable=True, default=None)
     type = Column(Enum(FOLDER, FILE), nullable=False)
     date_modified = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
     # todo: osf_id and osf_path are duplicates right now. One needs to be removed.
@@ -208,13 +281,35 @@ class File(Base):
 
     @hybrid_property
     def path(self):
-        """Recursively walk up the path of the file/folder. Top level file/folder joins with the path of the containing node.
+        """Local path of the file/folder. It is stored in materialized_path, which is updated whenever anything it
+        is built from changes, so reading it never walks up the tree.
+        """
+        if self.materialized_path is None:
+            return self.build_path()
+        return self.materialized_path
+
+    @path.expression
+    def path(cls):
+        return cls.materialized_path
+
+    def build_path(self, **changed):
+        """Walk up the tree to work out the path. Top level file/folder joins with the path of the containing node.
+        Values in changed are used instead of the attributes of the same name, they are about to be set.
         """
         # +os.path.sep+ instead of os.path.join: http://stackoverflow.com/a/14504695
-        if self.parent:
-            return os.path.join(self.parent.path, self.name)
-        else:
-            return os.path.join(self.node.path, self.name)
+        name = changed.get('name', self.name)
+        parent = changed.get('parent', self.parent)
+        container = parent if parent is not None else changed.get('node', self.node)
+        if name is None or container is None or container.path is None:
+            return None
+        return os.path.join(container.path, name)
+
+    def update_path(self, **changed):
+        """Store the path of this file/folder and everything below it"""
+        self.materialized_path = self.build_path(**changed)
+        self.path_key = path_key(self.materialized_path)
+        for file_folder in self.files:
+            file_folder.update_path(parent=self)
 
     def update_hash(self, block_size=2 ** 20):
         if self.is_file:
@@ -229,10 +324,29 @@ class File(Base):
 
     @hybrid_property
     def size(self):
+        """Size of the local file as of the last update_stat, the file is only stat'ed if that never happened"""
+        if self.cached_size is None:
+            self.update_stat()
+        return self.cached_size
+
+    def update_stat(self):
+        """Store a fresh os.stat of the local file. Returns the stat result, None if the file does not exist."""
         try:
-            return os.stat(self.path).st_size
+            stat = os.stat(self.path)
         except FileNotFoundError:  # file was deleted locally
-            return 0
+            self.cached_size, self.mtime_ns, self.inode = 0, None, None
+            return None
+        self.cached_size, self.mtime_ns, self.inode = stat.st_size, stat.st_mtime_ns, stat.st_ino
+        return stat
+
+    def forget_stat(self):
+        """The local file is about to be changed, stat it again when it is next needed"""
+        self.cached_size = self.mtime_ns = self.inode = None
+
+    def stat_matches(self, stat):
+        """True if stat describes the same, unchanged file as the stored stat"""
+        return (self.mtime_ns is not None and self.cached_size == stat.st_size and
+                self.mtime_ns == stat.st_mtime_ns and self.inode == stat.st_ino)
 
     def locally_create_children(self):
         self.locally_created = True
@@ -280,3 +394,116 @@ class File(Base):
         return "<File ({}), type={}, name={}, path={}, parent_id={}>".format(
             self.id, self.type, self.name, self.path, self.parent
         )
+
+
+class PendingOperation(Base):
+    """
+    Journal of local changes that still have to be pushed to the OSF.
+
+    OSFEventHandler adds an entry next to every locally_* flag it sets, replacing the entry of an earlier change
+    with the same operation on the same file or folder, so repeated saves of a file leave a single entry. The
+    poller reads a user's entries in order from the (user_id, id) index and removes them once the node they belong
+    to has been synced. It uses them to tell which nodes have local changes, without scanning every file row: their
+    projects are polled right away and the nodes are not skipped as unchanged. Pushing the changes is left to the
+    reconciliation of those nodes, which compares every file of a node, so it costs in proportion to the size of
+    the node rather than to the number of changes. Entries keep the ids of their file and node, which may have been
+    deleted since.
+    """
+    __tablename__ = 'pending_operation'
+    __table_args__ = (
+        Index('ix_pending_operation_user_id_id', 'user_id', 'id'),
+        Index('ix_pending_operation_file_id_operation', 'file_id', 'operation'),
+        # ids are never reused, the poller tells entries recorded after it read the journal by their id
+        {'sqlite_autoincrement': True},
+    )
+
+    CREATED = 'created'
+    DELETED = 'deleted'
+    RENAMED = 'renamed'
+    MOVED = 'moved'
+    MODIFIED = 'modified'
+
+    id = Column(Integer, primary_key=True)
+    operation = Column(Enum(CREATED, DELETED, RENAMED, MOVED, MODIFIED), nullable=False)
+    # local path of the item when the change was recorded
+    path = Column(String)
+    created = Column(DateTime, default=datetime.datetime.utcnow)
+
+    user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
+    node_id = Column(Integer, ForeignKey('node.id'), nullable=False)
+    file_id = Column(Integer, ForeignKey('file.id'), nullable=True)
+
+    user = relationship(User)
+    node = relationship(Node)
+    file = relationship(File)
+
+    @classmethod
+    def for_file_folder(cls, operation, file_folder):
+        return cls(
+            operation=operation,
+            path=file_folder.path,
+            user=file_folder.user,
+            node=file_folder.node,
+            file=file_folder
+        )
+
+    def __repr__(self):
+        return "<PendingOperation ({}), operation={}, path={}, node_id={}, file_id={}>".format(
+            self.id, self.operation, self.path, self.node_id, self.file_id
+        )
+
+
+# Keep the materialized paths up to date. The listeners run before the new value is set, so it is passed on.
+
+@event.listens_for(User.osf_local_folder_path, 'set')
+def _osf_folder_set(user, value, oldvalue, initiator):
+    for node in user.nodes:
+        if node.parent is None:
+            node.update_path(osf_folder=value)
+
+
+@event.listens_for(User.nodes, 'append')
+def _node_added_to_user(user, node, initiator):
+    if node.parent is None:
+        node.update_path(user=user)
+
+
+@event.listens_for(Node.title, 'set')
+def _node_title_set(node, value, oldvalue, initiator):
+    node.update_path(title=value)
+
+
+@event.listens_for(Node.osf_id, 'set')
+def _node_osf_id_set(node, value, oldvalue, initiator):
+    node.update_path(osf_id=value)
+
+
+@event.listens_for(Node.child_nodes, 'append')
+def _child_node_added(parent, node, initiator):
+    node.update_path(parent=parent)
+
+
+@event.listens_for(Node.child_nodes, 'remove')
+def _child_node_removed(parent, node, initiator):
+    node.update_path(parent=None)
+
+
+@event.listens_for(Node.files, 'append')
+def _file_folder_added_to_node(node, file_folder, initiator):
+    if file_folder.parent is None:
+        file_folder.update_path(node=node)
+
+
+@event.listens_for(File.name, 'set')
+def _file_folder_name_set(file_folder, value, oldvalue, initiator):
+    file_folder.update_path(name=value)
+
+
+@event.listens_for(File.files, 'append')
+def _file_folder_added_to_folder(parent, file_folder, initiator):
+    file_folder.update_path(parent=parent)
+
+
+@event.listens_for(File.files, 'remove')
+def _file_folder_removed_from_folder(parent, file_folder, initiator):
+    file_folder.update_path(parent=None)
@@ -0,0 +1,63 @@
+"""
+Load a user's whole local tree of nodes, files and folders in a constant number of queries.
+
+Walking the tree through the relationships (child_nodes, files, parent, node) lazy loads every level with its own
+query. load_local_tree instead selects all nodes and all files of the user at once, groups them by parent in memory
+and hands the groups to the relationships as their loaded value, so walking the tree afterwards hits the database
+only for rows that changed since.
+"""
+from collections import defaultdict
+
+from sqlalchemy.orm.attributes import set_committed_value
+
+from osfoffline.database_manager.models import Node, File
+
+
+class LocalTree(object):
+    """Adjacency lists of a user's nodes and files, keyed by the id of the containing node or folder"""
+
+    def __init__(self, nodes, files):
+        self.nodes = {node.id: node for node in nodes}
+        self.files = {file_folder.id: file_folder for file_folder in files}
+        self.child_nodes = defaultdict(list)
+        self.node_files = defaultdict(list)
+        self.folder_files = defaultdict(list)
+
+        for node in nodes:
+            if node.parent_id is not None:
+                self.child_nodes[node.parent_id].append(node)
+        for file_folder in files:
+            self.node_files[file_folder.node_id].append(file_folder)
+            if file_folder.parent_id is not None:
+                self.folder_files[file_folder.parent_id].append(file_folder)
+
+    @property
+    def top_level_nodes(self):
+        return [node for node in self.nodes.values() if node.parent_id is None]
+
+    def attach(self, user):
+        """Set the relationships of every loaded object from the adjacency lists, without marking them changed"""
+        set_committed_value(user, 'nodes', list(self.nodes.values()))
+        for node in self.nodes.values():
+            set_committed_value(node, 'user', user)
+            set_committed_value(node, 'parent', self.nodes.get(node.parent_id))
+            set_committed_value(node, 'child_nodes', self.child_nodes[node.id])
+            set_committed_value(node, 'files', self.node_files[node.id])
+        for file_folder in self.files.values():
+            set_committed_value(file_folder, 'user', user)
+            set_committed_value(file_folder, 'node', self.nodes.get(file_folder.node_id))
+            set_committed_value(file_folder, 'parent', self.files.get(file_folder.parent_id))
+            set_committed_value(file_folder, 'files', self.folder_files[file_folder.id])
+
+
+def load_local_tree(session, user):
+    """
+    Load every node and file of user with one query each and attach them to each other.
+
+    Must be called with no pending changes to these objects, their relationships are overwritten.
+    """
+    nodes = session.query(Node).filter(Node.user_id == user.id).order_by(Node.id).all()
+    files = session.query(File).filter(File.user_id == user.id).order_by(File.id).all()
+    tree = LocalTree(nodes, files)
+    tree.attach(user)
+    return tree
@@ -2,7 +2,7 @@ from contextlib import contextmanager
 import shutil
 import logging
 from osfoffline.database_manager.db import session
-from osfoffline.settings import PROJECT_DB_DIR
+from osfoffline.settings import PROJECT_DB_DIR, DB_BATCH_SIZE
 
 
 def save(session, *items_to_save):
@@ -16,6 +16,76 @@ def save(session, *items_to_save):
         raise
 
 
+class UnitOfWork(object):
+    """
+    Collects changes to the session and commits them in batches instead of once per item.
+
+    Changes are recorded with save and delete. checkpoint commits once batch_size changes are pending, so calling
+    it at natural boundaries (e.g. after a whole folder) keeps related changes in the same transaction. If a commit
+    fails the whole batch is rolled back and the error is raised.
+
+    Nothing is written before the commit (the session does not autoflush), so the database is only locked for
+    writing while the batch is committed and other sessions can commit their own changes while it is collected.
+
+    batch numbers the batch changes are currently collected in. It advances after every commit and rollback, so
+    work derived from the changes of a batch can be tagged with it and dropped if that batch is rolled back.
+    on_commit and on_rollback are called without arguments after every successful commit and every rollback, while
+    batch is still the number of the batch that ended, so state that must only become durable together with the
+    batch can follow it.
+    """
+
+    def __init__(self, session, batch_size=DB_BATCH_SIZE, on_commit=None, on_rollback=None):
+        assert batch_size >= 1
+        self.session = session
+        self.session.autoflush = False
+        self.batch_size = batch_size
+        self.pending = 0
+        self.batch = 0
+        self.on_commit = on_commit
+        self.on_rollback = on_rollback
+
+    def save(self, *items_to_save):
+        for item in items_to_save:
+            self.session.add(item)
+        self.pending += 1
+
+    def delete(self, item):
+        self.session.delete(item)
+        self.pending += 1
+
+    def checkpoint(self):
+        if self.pending >= self.batch_size:
+            self.commit()
+
+    def commit(self):
+        try:
+            self.session.commit()
+        except Exception:
+            logging.exception('Error saving a batch of {} changes to the database'.format(self.pending))
+            self.rollback()
+            raise
+        self.pending = 0
+        if self.on_commit:
+            self.on_commit()
+        self.batch += 1
+
+    def rollback(self):
+        self.session.rollback()
+        self.pending = 0
+        if self.on_rollback:
+            self.on_rollback()
+        self.batch += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+
 @contextmanager
 def session_scope():
     """Provide a transactional scope around a series of operations."""
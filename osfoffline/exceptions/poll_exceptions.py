@@ -4,3 +4,7 @@ __author__ = 'himanshu'
 # Poll
 class Poll(Exception):
     pass
+
+
+class DownloadFailed(Poll):
+    pass
@@ -7,13 +7,15 @@ import logging
 import os
 
 from sqlalchemy.exc import SQLAlchemyError
-from watchdog.events import FileSystemEventHandler, DirModifiedEvent, DirCreatedEvent, FileCreatedEvent
+from watchdog.events import FileSystemEventHandler, DirModifiedEvent, DirCreatedEvent, FileCreatedEvent, FileModifiedEvent
 
-from osfoffline.database_manager.models import Node, File, User
-from osfoffline.database_manager.db import session
+from osfoffline.database_manager.models import Node, File, User, PendingOperation, path_key
+from osfoffline.database_manager.db import session_factory
 from osfoffline.database_manager.utils import save
 from osfoffline.utils.path import ProperPath
 from osfoffline.exceptions.item_exceptions import ItemNotInDB
+from osfoffline.settings import DOWNLOAD_PART_SUFFIX
+from osfoffline.filesystem_manager import self_writes
 import osfoffline.alerts as AlertHandler
 
 EVENT_TYPE_MOVED = 'moved'
@@ -31,7 +33,10 @@ class OSFEventHandler(FileSystemEventHandler):
         super().__init__()
         self._loop = loop or asyncio.get_event_loop()
         self.osf_folder = ProperPath(osf_folder, True)
-        self.user = session.query(User).filter(User.logged_in).one()
+        # a session of its own, the handlers run on the poller's loop and thread but every change made here is
+        # committed right away. Sharing the poller's session would commit its half collected batch along with it.
+        self.session = session_factory()
+        self.user = self.session.query(User).filter(User.logged_in).one()
 
     @asyncio.coroutine
     def on_any_event(self, event):
@@ -83,8 +88,9 @@ class OSFEventHandler(FileSystemEventHandler):
                 if item.name != dest_path.name:
                     item.name = dest_path.name
                     item.locally_renamed = True
+                    self._record(PendingOperation.RENAMED, item)
                     try:
-                        save(session, item)
+                        save(self.session, item)
                     except SQLAlchemyError:
                         logging.exception('Exception caught: Could not save data for {}'.format(item))
                         AlertHandler.warn('Error renaming file. {} will stop syncing.'.format(item.name))
@@ -95,8 +101,8 @@ class OSFEventHandler(FileSystemEventHandler):
                     # check if file already exists in this moved location. If so, delete it from db.
                     try:
                         item_to_replace = self._get_item_by_path(dest_path)
-                        session.delete(item_to_replace)
-                        save(session)
+                        self.session.delete(item_to_replace)
+                        save(self.session)
                     except ItemNotInDB:
                         logging.info('file does not already exist in moved destination: {}'.format(dest_path.full_path))
                     except SQLAlchemyError:
@@ -127,8 +133,9 @@ class OSFEventHandler(FileSystemEventHandler):
 
                         # flags
                         item.locally_moved = True
+                        self._record(PendingOperation.MOVED, item)
                         try:
-                            save(session, item)
+                            save(self.session, item)
                         except SQLAlchemyError:
                             logging.exception('Exception caught: Could not save data for {}'.format(item))
                             AlertHandler.warn('Error moving file. {} will stop syncing.'.format(item.name))
@@ -161,11 +168,13 @@ class OSFEventHandler(FileSystemEventHandler):
         if new_item.is_file:
             try:
                 new_item.update_hash()
+                new_item.update_stat()
             except FileNotFoundError:
                 # if file doesnt exist just as we create it, then file is likely temp file. thus don't put it in db.
                 return
+        self._record(PendingOperation.CREATED, new_item)
         try:
-            save(session, new_item, containing_item)
+            save(self.session, new_item, containing_item)
         except SQLAlchemyError:
             logging.exception('Exception caught: Could not save data for {} in {}'.format(new_item, containing_item))
             AlertHandler.warn('Error creating {}: {} will not be synced.'.format('file' if new_item.is_file else 'folder', new_item.name))
@@ -222,14 +231,16 @@ class OSFEventHandler(FileSystemEventHandler):
             # update hash
             try:
                 item.update_hash()
+                item.update_stat()
             except OSError:
                 logging.exception('File inaccessible during update_hash')
                 AlertHandler.warn('Error updating {}. {} inaccessible, will stop syncing.'.format('Folder' if event.is_directory else 'File', item.name))
                 return
+            self._record(PendingOperation.MODIFIED, item)
 
             # save
             try:
-                save(session, item)
+                save(self.session, item)
             except SQLAlchemyError:
                 logging.exception('Exception caught: Could not save data for {}'.format(item))
                 AlertHandler.warn('Error updating {}. {} will stop syncing.'.format('folder' if event.is_directory else 'file', item.name))
@@ -265,24 +276,38 @@ class OSFEventHandler(FileSystemEventHandler):
                     item.locally_deleted = True
                     # nodes cannot be deleted online. THUS, delete it inside database. It will be recreated locally.
                     if isinstance(item, Node):
-                        session.delete(item)
+                        self.session.delete(item)
                         try:
-                            save(session)
+                            save(self.session)
                         except SQLAlchemyError as e:
                             logging.exception('Exception caught: Error deleting node {} from database.'.format(item.name))
                         return
+                    self._record(PendingOperation.DELETED, item)
                     try:
-                        save(session, item)
+                        save(self.session, item)
                     except SQLAlchemyError as e:
                         logging.exception('Exception caught: Error deleting {} {} from database.'.format('folder' if event.is_directory else 'file', item.name))
                     else:
                         logging.info('{} set to be deleted'.format(src_path.full_path))
 
+    def close(self):
+        self.session.close()
+
     def dispatch(self, event):
         # basically, ignore all events that occur for 'Components' file or folder
         if self._event_is_for_components_file_folder(event):
             return
 
+        # downloads are staged in .part files, only the final move into place is a change to the file itself
+        if event.src_path.endswith(DOWNLOAD_PART_SUFFIX):
+            if event.event_type != EVENT_TYPE_MOVED:
+                return
+            event = FileModifiedEvent(event.dest_path)
+
+        # changes made by the poller are already in the db
+        if self_writes.is_echo(event):
+            return
+
         _method_map = {
             EVENT_TYPE_MODIFIED: self.on_modified,
             EVENT_TYPE_MOVED: self.on_moved,
@@ -299,6 +324,20 @@ class OSFEventHandler(FileSystemEventHandler):
                 handler(event)
             )
 
+    def _record(self, operation, file_folder):
+        """
+        Journal a local change, committed together with the item, so the poller finds its node without a tree walk.
+        An earlier entry for the same change is replaced rather than kept next to it. The new entry is journaled
+        after the position the poller has read up to, so a change made after the poller read the earlier one is
+        not discarded along with it.
+        """
+        if file_folder.id is not None:
+            self.session.query(PendingOperation).filter(
+                PendingOperation.file_id == file_folder.id,
+                PendingOperation.operation == operation
+            ).delete(synchronize_session=False)
+        self.session.add(PendingOperation.for_file_folder(operation, file_folder))
+
     def _already_exists(self, path):
         try:
             self._get_item_by_path(path)
@@ -314,14 +353,14 @@ class OSFEventHandler(FileSystemEventHandler):
 
         return self._get_item_by_path(containing_folder_path)
 
-    # todo: figure out how you can improve this
     def _get_item_by_path(self, path):
-        for node in session.query(Node):
-            if ProperPath(node.path, True) == path:
+        key = path_key(path.full_path)
+        if path.is_dir:
+            node = self.session.query(Node).filter(Node.path_key == key).first()
+            if node is not None:
                 return node
-        for file_folder in session.query(File):
-            file_path = ProperPath(file_folder.path, file_folder.is_folder)
-            if file_path == path:
+        for file_folder in self.session.query(File).filter(File.path_key == key):
+            if file_folder.is_folder == path.is_dir:
                 return file_folder
         raise ItemNotInDB('item has path: {}'.format(path.full_path))
 
@@ -0,0 +1,94 @@
+"""
+Registry of file system changes made by the poller itself.
+
+Every change the poller makes locally (downloading, renaming, deleting, ...) is reported back by the watchdog
+observer. Polling events wrap their file system calls in ``with self_writes.writing(path, operation):`` and
+OSFEventHandler drops events matching a write that is still in progress or finished less than SELF_WRITE_EXPIRY
+seconds ago, instead of hashing, querying and saving the item all over again.
+Removing or renaming a folder also covers the events for its contents. Creations and modifications only cover their
+own path: a file the user puts into a folder the poller just created is a change of its own.
+"""
+import contextlib
+import logging
+import os
+import threading
+import time
+
+from osfoffline.settings import SELF_WRITE_EXPIRY
+
+
+logger = logging.getLogger(__name__)
+
+MOVED = 'moved'
+DELETED = 'deleted'
+CREATED = 'created'
+MODIFIED = 'modified'
+# operations on a folder that are reported for its contents as well
+SUBTREE_OPERATIONS = (MOVED, DELETED)
+
+
+def _is_same(path, other_path):
+    return path.rstrip(os.path.sep) == other_path.rstrip(os.path.sep)
+
+
+def _is_same_or_below(path, parent):
+    parent = parent.rstrip(os.path.sep)
+    return path.rstrip(os.path.sep) == parent or path.startswith(parent + os.path.sep)
+
+
+class SelfWriteRegistry(object):
+    def __init__(self, expiry=SELF_WRITE_EXPIRY, clock=time.monotonic):
+        self.expiry = expiry
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._expected = []
+
+    def begin(self, path, operation):
+        """Record that this client is doing operation on path. Returns the entry to pass to finish."""
+        entry = [path, operation, None]
+        with self._lock:
+            self._expected.append(entry)
+        return entry
+
+    def finish(self, entry):
+        """Keep expecting events for entry for another expiry seconds, they arrive some time after the write"""
+        with self._lock:
+            entry[2] = self._clock() + self.expiry
+
+    def is_echo(self, path, operation):
+        """True if an event for operation on path was most likely caused by this client"""
+        now = self._clock()
+        with self._lock:
+            self._expected = [entry for entry in self._expected if entry[2] is None or entry[2] > now]
+            for expected_path, expected_operation, _ in self._expected:
+                if expected_operation != operation:
+                    continue
+                if operation in SUBTREE_OPERATIONS:
+                    if _is_same_or_below(path, expected_path):
+                        return True
+                elif _is_same(path, expected_path):
+                    return True
+        return False
+
+    def clear(self):
+        with self._lock:
+            self._expected = []
+
+
+registry = SelfWriteRegistry()
+
+
+@contextlib.contextmanager
+def writing(path, operation):
+    entry = registry.begin(path, operation)
+    try:
+        yield
+    finally:
+        registry.finish(entry)
+
+
+def is_echo(event):
+    if registry.is_echo(event.src_path, event.event_type):
+        logger.debug('Ignoring {} caused by this client'.format(event))
+        return True
+    return False
@@ -128,6 +128,12 @@ class LocalDBSync(object):
                 m.update(buf)
         return m.hexdigest()
 
+    def _is_modified(self, local, db):
+        # an unchanged size, modification time and inode means the file was not touched, skip reading it
+        if db.stat_matches(os.stat(local.full_path)):
+            return False
+        return self._make_hash(local) != db.hash
+
     def _determine_event_type(self, local, db):
         if not local and not db:
             raise LocalDBBothNone
@@ -146,7 +152,7 @@ class LocalDBSync(object):
         if local and db:
             if self._get_proper_path(local) != self._get_proper_path(db):
                 raise IncorrectLocalDBMatch
-            if isinstance(db, File) and db.is_file and self._make_hash(local) != db.hash:
+            if isinstance(db, File) and db.is_file and self._is_modified(local, db):
                 event = FileModifiedEvent(self._get_proper_path(local).full_path)  # create changed event
                 # folder modified event cannot happen. It will be a create and delete event.
         elif local is None:
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+In-process registry of counters and timings.
+
+Any component can publish to it, e.g. ``metrics.increment('requests.nodes')`` or
+``metrics.record_time('events.queue_wait', seconds)``. The poller takes a snapshot at the start and end of
+every poll cycle and writes the difference to a rolling json report in the log directory.
+"""
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._timings = {}
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def record_time(self, name, seconds):
+        with self._lock:
+            count, total = self._timings.get(name, (0, 0.0))
+            self._timings[name] = (count + 1, total + seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'timings': dict(self._timings),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._timings.clear()
+
+
+registry = MetricsRegistry()
+
+
+def increment(name, value=1):
+    registry.increment(name, value)
+
+
+def record_time(name, seconds):
+    registry.record_time(name, seconds)
+
+
+@contextlib.contextmanager
+def timer(name):
+    start = time.time()
+    try:
+        yield
+    finally:
+        record_time(name, time.time() - start)
+
+
+def snapshot():
+    return registry.snapshot()
+
+
+def difference(before, after):
+    """What was published between two snapshots, with the average of every timing"""
+    counters = {
+        name: value - before['counters'].get(name, 0)
+        for name, value in after['counters'].items()
+        if value != before['counters'].get(name, 0)
+    }
+    timings = {}
+    for name, (count, total) in after['timings'].items():
+        before_count, before_total = before['timings'].get(name, (0, 0.0))
+        if count == before_count:
+            continue
+        timings[name] = {
+            'count': count - before_count,
+            'total': total - before_total,
+            'average': (total - before_total) / (count - before_count),
+        }
+    return {'counters': counters, 'timings': timings}
+
+
+def append_report(path, report, keep):
+    """Append report to the json list stored at path, only keeping the last ``keep`` reports"""
+    reports = []
+    try:
+        with open(path) as fp:
+            reports = json.load(fp)
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError):
+        logger.exception('Unreadable metrics report {}, starting a new one'.format(path))
+
+    reports = (reports if isinstance(reports, list) else [])[-(keep - 1):] if keep > 1 else []
+    reports.append(report)
+
+    temp_path = '{}.tmp'.format(path)
+    with open(temp_path, 'w') as fp:
+        json.dump(reports, fp, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
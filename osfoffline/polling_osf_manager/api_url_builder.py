@@ -10,6 +10,9 @@ FILES = 'files'
 APPLICATIONS = 'applications'
 CHILDREN = 'children'
 RESOURCES = 'resources'
+DOWNLOADS = 'downloads'
+UPLOADS = 'uploads'
+OTHER = 'other'
 
 
 def _ensure_trailing_slash(url):
@@ -57,3 +60,21 @@ def api_url_for(endpoint_type, related_type=None, **kwargs):
             files_base.path.segments.append(str(kwargs['file_id']))
         return _ensure_trailing_slash(files_base.url)
     return _ensure_trailing_slash(base.url)
+
+
+def endpoint_type(url, method='GET', params=None):
+    """Classify a request url as one of USERS, NODES, CHILDREN, FILES, DOWNLOADS, UPLOADS or OTHER"""
+    segments = [segment for segment in furl(url).path.segments if segment]
+    if len(segments) >= 2 and segments[:2] == ['v1', RESOURCES]:
+        if method.upper() == 'GET':
+            return DOWNLOADS
+        # creating a folder sends no file contents
+        if method.upper() == 'PUT' and (params or {}).get('kind') != 'folder':
+            return UPLOADS
+        return FILES
+    if len(segments) >= 2 and segments[0] == 'v2':
+        if segments[1] == NODES and len(segments) >= 4 and segments[3] in (CHILDREN, FILES):
+            return segments[3]
+        if segments[1] in (USERS, NODES, FILES):
+            return segments[1]
+    return OTHER
@@ -0,0 +1,133 @@
+"""
+Token bucket bandwidth limits for file transfers.
+
+Uploads and downloads each have their own budget in bytes per second (None for unlimited) and can be limited
+differently during parts of the day, e.g. ``[('08:00', '18:00', 512 * 1024, 2 * 1024 * 1024)]``. The shared
+``limiter`` can be reconfigured at any time, from any thread; running transfers pick up the new limits with their
+next chunk.
+"""
+import asyncio
+import datetime
+import logging
+import threading
+import time
+
+from osfoffline.settings import BANDWIDTH_UPLOAD_LIMIT, BANDWIDTH_DOWNLOAD_LIMIT, BANDWIDTH_SCHEDULE
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """
+    Allows rate bytes per second on average with bursts of up to one second's worth.
+
+    Transfers take tokens for every chunk they move and sleep off any debt before moving the next one.
+    """
+
+    def __init__(self, rate=None, clock=time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.rate = rate
+        self._tokens = rate or 0
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        if self.rate is not None:
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill()
+            self.rate = rate
+            if rate is None:
+                self._tokens = 0
+            else:
+                self._tokens = min(self._tokens, rate)
+
+    def reserve(self, byte_count):
+        """Take byte_count tokens, returning how many seconds to wait before they may be used"""
+        with self._lock:
+            self._refill()
+            if self.rate is None:
+                return 0.0
+            self._tokens -= byte_count
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    @asyncio.coroutine
+    def throttle(self, byte_count):
+        delay = self.reserve(byte_count)
+        if delay > 0:
+            yield from asyncio.sleep(delay)
+
+
+def parse_schedule(schedule):
+    """Convert ('HH:MM', 'HH:MM', upload, download) entries into (time, time, upload, download)"""
+    parsed = []
+    for start, end, upload, download in schedule:
+        parsed.append((
+            datetime.datetime.strptime(start, '%H:%M').time(),
+            datetime.datetime.strptime(end, '%H:%M').time(),
+            upload,
+            download,
+        ))
+    return parsed
+
+
+def in_window(start, end, moment):
+    if start <= end:
+        return start <= moment < end
+    # window wraps around midnight
+    return moment >= start or moment < end
+
+
+class BandwidthLimiter(object):
+    """
+    Upload and download token buckets whose rates follow the configured limits and time of day schedule.
+
+    The first schedule entry containing the current time wins, outside all entries the default limits apply.
+    """
+
+    def __init__(self, upload=None, download=None, schedule=(), clock=time.monotonic, now=datetime.datetime.now):
+        self._now = now
+        self.upload = TokenBucket(clock=clock)
+        self.download = TokenBucket(clock=clock)
+        self.configure(upload, download, schedule)
+
+    def configure(self, upload=None, download=None, schedule=()):
+        """Replace all limits. Limits are in bytes per second, None means unlimited."""
+        self.default_limits = (upload, download)
+        self.schedule = parse_schedule(schedule)
+        self.apply()
+        logger.info('Bandwidth limits set to upload={}, download={}, schedule={}'.format(upload, download, schedule))
+
+    def limits(self, at=None):
+        moment = (at or self._now()).time()
+        for start, end, upload, download in self.schedule:
+            if in_window(start, end, moment):
+                return upload, download
+        return self.default_limits
+
+    def apply(self):
+        upload, download = self.limits()
+        if self.upload.rate != upload:
+            self.upload.set_rate(upload)
+        if self.download.rate != download:
+            self.download.set_rate(download)
+
+    @asyncio.coroutine
+    def throttle_upload(self, byte_count):
+        if self.schedule:
+            self.apply()
+        yield from self.upload.throttle(byte_count)
+
+    @asyncio.coroutine
+    def throttle_download(self, byte_count):
+        if self.schedule:
+            self.apply()
+        yield from self.download.throttle(byte_count)
+
+
+limiter = BandwidthLimiter(BANDWIDTH_UPLOAD_LIMIT, BANDWIDTH_DOWNLOAD_LIMIT, BANDWIDTH_SCHEDULE)
@@ -0,0 +1,282 @@
+"""
+Queue of PollingEvents shared between the poller, which produces events while walking the OSF, and a pool of
+workers that run them.
+
+Events are handed out by priority rather than in the order they were queued: cheap metadata operations first,
+then small files and finally large downloads. Waiting in the queue raises an event's priority so big transfers
+are not starved.
+
+Events that touch unrelated paths run in parallel. An event never starts while an event enqueued before it
+that touches the same path, one of its parents or one of its children is still pending, so everything that
+happens to a single subtree keeps the order it was enqueued in, whatever the priorities.
+
+Events can be tagged with the database batch (see UnitOfWork.batch) whose changes produced them. If that batch is
+rolled back the events that did not start yet are dropped, they would act on changes that were never made.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+
+from osfoffline import metrics
+from osfoffline.settings import (EVENT_QUEUE_SIZE, EVENT_QUEUE_MAX_SIZE, EVENT_QUEUE_SLOW_EVENT_SECONDS,
+                                 EVENT_PRIORITIES, EVENT_SIZE_BUCKETS, EVENT_PRIORITY_AGING_SECONDS)
+
+
+def paths_overlap(path, other_path):
+    """Whether two paths are the same or one of them lies inside the other"""
+    return _normalized_paths_overlap(os.path.normpath(path), os.path.normpath(other_path))
+
+
+def _normalized_paths_overlap(path, other_path):
+    if path == other_path:
+        return True
+    return path.startswith(os.path.join(other_path, '')) or other_path.startswith(os.path.join(path, ''))
+
+
+def _parent_paths(path):
+    """The folders containing a normalized path, innermost first"""
+    parents = []
+    parent = os.path.dirname(path)
+    while parent != path:
+        parents.append(parent)
+        path, parent = parent, os.path.dirname(parent)
+    return tuple(parents)
+
+
+def event_priority(event, priorities=EVENT_PRIORITIES, size_buckets=EVENT_SIZE_BUCKETS):
+    """Base priority of an event from its type and, for file transfers, the size of the file. Lower runs first."""
+    priority = priorities.get(event.__class__.__name__, max(priorities.values()) if priorities else 0)
+    if event.size is not None:
+        for max_size, extra_priority in size_buckets:
+            if max_size is None or event.size <= max_size:
+                priority += extra_priority
+                break
+    return priority
+
+
+class QueuedEvent(object):
+    def __init__(self, sequence, event, priority, batch=None):
+        self.sequence = sequence
+        self.event = event
+        self.priority = priority
+        self.batch = batch
+        self.discarded = False
+        self.enqueued_at = time.time()
+        self.started_at = None
+        # normalized once, the paths are compared every time the queue looks for the next event
+        self.paths = tuple(os.path.normpath(path) for path in event.paths)
+        self.parent_paths = tuple(_parent_paths(path) for path in self.paths)
+
+    def order_key(self, aging_seconds):
+        """
+        Sort key of the event among the queued ones. The effective priority of a waiting event is its priority less
+        one for every aging_seconds it has waited. All waiting events age at the same rate, so their order by
+        effective priority is fixed once they are queued and is the order of priority * aging_seconds + enqueued_at.
+        """
+        if not aging_seconds:
+            return self.priority, self.sequence
+        return self.priority * aging_seconds + self.enqueued_at, self.sequence
+
+    def conflicts_with(self, other):
+        return any(
+            _normalized_paths_overlap(path, other_path) for path in self.paths for other_path in other.paths
+        )
+
+    def __repr__(self):
+        return '<QueuedEvent ({}) {}>'.format(self.sequence, self.event)
+
+
+class EventQueue(object):
+    """
+    Bounded priority queue of PollingEvents with per-path serialization.
+
+    The bound adapts to the workers: for every event that has been running longer than slow_event_seconds
+    another ``size`` slots are made available, up to ``max_size``. A single slow download therefore does not stop
+    the poller from queueing work for the idle workers.
+
+    Queued events are kept in a heap by order_key and indexed by path, so finding the next event that may run
+    does not compare every pair of queued events.
+    """
+
+    def __init__(self, loop, size=EVENT_QUEUE_SIZE, max_size=EVENT_QUEUE_MAX_SIZE,
+                 slow_event_seconds=EVENT_QUEUE_SLOW_EVENT_SECONDS, priorities=EVENT_PRIORITIES,
+                 size_buckets=EVENT_SIZE_BUCKETS, aging_seconds=EVENT_PRIORITY_AGING_SECONDS):
+        assert 0 < size <= max_size
+        self._loop = loop
+        self.size = size
+        self.max_size = max_size
+        self.slow_event_seconds = slow_event_seconds
+        self.priorities = priorities
+        self.size_buckets = size_buckets
+        self.aging_seconds = aging_seconds
+
+        self._sequence = itertools.count()
+        self._queued = {}  # sequence -> QueuedEvent, for events waiting for a worker
+        self._order = []  # heap of the order_key of queued events, keys of events no longer queued are skipped
+        # path -> heap of the sequences of queued events on that path, or on that path or beneath it. Sequences are
+        # removed from the top as soon as their event leaves the queue, so the top is always the oldest queued one.
+        self._on_path = {}
+        self._beneath_path = {}
+        self._taken = {}  # sequence -> QueuedEvent, for events handed to a worker and not yet done
+        self._waiters = []
+
+    @property
+    def maxsize(self):
+        now = time.time()
+        slow = sum(
+            1 for entry in self._taken.values()
+            if entry.started_at is not None and now - entry.started_at > self.slow_event_seconds
+        )
+        return min(self.size * (1 + slow), self.max_size)
+
+    def qsize(self):
+        return len(self._queued)
+
+    def full(self):
+        return self.qsize() >= self.maxsize
+
+    def unfinished(self):
+        return len(self._queued) + len(self._taken)
+
+    @asyncio.coroutine
+    def put(self, event, batch=None):
+        while self.full():
+            # the bound grows as events become slow, so look again once in a while even if nothing happened
+            yield from self._wait_for_change(timeout=self.slow_event_seconds)
+        priority = event_priority(event, self.priorities, self.size_buckets)
+        self._add(QueuedEvent(next(self._sequence), event, priority, batch))
+        metrics.increment('events.enqueued.{}'.format(event.__class__.__name__))
+        self._notify()
+
+    @asyncio.coroutine
+    def get(self):
+        """
+        Take the most urgent event off the queue. Call wait_turn before running it and task_done afterwards.
+
+        Events that still have to wait for an earlier queued event on an overlapping path are passed over, a worker
+        holding one of them would otherwise wait on an event no other worker can take.
+        """
+        while not self._queued:
+            yield from self._wait_for_change()
+        entry = self._next_entry()
+        self._remove(entry)
+        self._taken[entry.sequence] = entry
+        self._notify()
+        return entry
+
+    def _next_entry(self):
+        passed_over = []
+        try:
+            while True:
+                key = heapq.heappop(self._order)
+                entry = self._queued.get(key[-1])
+                if entry is None:
+                    continue
+                # the oldest queued event is never waiting for another queued one, so this ends
+                if not self._waits_for_queued(entry):
+                    return entry
+                passed_over.append(key)
+        finally:
+            for key in passed_over:
+                heapq.heappush(self._order, key)
+
+    @asyncio.coroutine
+    def wait_turn(self, entry):
+        """Wait until no earlier event that overlaps with entry is still pending"""
+        assert entry.sequence in self._taken
+        while self._blocked(entry):
+            yield from self._wait_for_change()
+        entry.started_at = time.time()
+        metrics.record_time('events.queue_wait', entry.started_at - entry.enqueued_at)
+
+    def task_done(self, entry):
+        del self._taken[entry.sequence]
+        self._notify()
+
+    def requeue(self, entry):
+        """
+        Put back an event whose worker was stopped before it finished, keeping its place in the ordering. Events of
+        a discarded batch are dropped instead.
+        """
+        del self._taken[entry.sequence]
+        if not entry.discarded:
+            entry.started_at = None
+            self._add(entry)
+        self._notify()
+
+    def discard_batch(self, batch):
+        """
+        Drop the queued events of a rolled back batch. Events of the batch that were already handed to a worker are
+        not run again if they are requeued, what they already did is reconciled by the next poll.
+        """
+        discarded = [entry for entry in self._queued.values() if entry.batch == batch]
+        for entry in discarded:
+            self._remove(entry)
+        metrics.increment('events.discarded', len(discarded))
+        for entry in self._taken.values():
+            if entry.batch == batch:
+                entry.discarded = True
+        self._notify()
+
+    @asyncio.coroutine
+    def join(self):
+        while self.unfinished():
+            yield from self._wait_for_change()
+
+    def _blocked(self, entry):
+        return self._waits_for_queued(entry) or any(
+            other.sequence < entry.sequence and other.conflicts_with(entry) for other in self._taken.values()
+        )
+
+    def _waits_for_queued(self, entry):
+        """Whether an event queued before entry is on one of its paths, one of their parents or beneath them"""
+        for path, parent_paths in zip(entry.paths, entry.parent_paths):
+            if self._earlier(self._beneath_path, path, entry.sequence):
+                return True
+            if any(self._earlier(self._on_path, parent, entry.sequence) for parent in parent_paths):
+                return True
+        return False
+
+    def _earlier(self, index, path, sequence):
+        queued = index.get(path)
+        return bool(queued) and queued[0] < sequence
+
+    def _add(self, entry):
+        self._queued[entry.sequence] = entry
+        heapq.heappush(self._order, entry.order_key(self.aging_seconds))
+        for path, parent_paths in zip(entry.paths, entry.parent_paths):
+            heapq.heappush(self._on_path.setdefault(path, []), entry.sequence)
+            for beneath in (path,) + parent_paths:
+                heapq.heappush(self._beneath_path.setdefault(beneath, []), entry.sequence)
+
+    def _remove(self, entry):
+        del self._queued[entry.sequence]
+        for path, parent_paths in zip(entry.paths, entry.parent_paths):
+            self._prune(self._on_path, path)
+            for beneath in (path,) + parent_paths:
+                self._prune(self._beneath_path, beneath)
+        if not self._queued:
+            self._order = []
+
+    def _prune(self, index, path):
+        queued = index[path]
+        while queued and queued[0] not in self._queued:
+            heapq.heappop(queued)
+        if not queued:
+            del index[path]
+
+    @asyncio.coroutine
+    def _wait_for_change(self, timeout=None):
+        waiter = asyncio.Future(loop=self._loop)
+        self._waiters.append(waiter)
+        try:
+            yield from asyncio.wait([waiter], timeout=timeout, loop=self._loop)
+        finally:
+            self._waiters.remove(waiter)
+
+    def _notify(self):
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
@@ -0,0 +1,69 @@
+"""
+Persistent cache of OSF listing responses used to make conditional GET requests.
+
+Each entry is keyed by the requested url and holds the ETag and/or Last-Modified validators the server sent
+along with the already parsed json body. When the server answers a revalidation with 304 Not Modified the
+cached body is used instead of downloading and parsing the listing again.
+"""
+import dbm
+import logging
+import shelve
+
+from osfoffline.settings import PROJECT_LISTING_CACHE_FILE
+
+
+logger = logging.getLogger(__name__)
+
+
+class CachedListing(object):
+    def __init__(self, etag, last_modified, body):
+        assert etag or last_modified
+        assert isinstance(body, dict)
+        self.etag = etag
+        self.last_modified = last_modified
+        self.body = body
+
+    @property
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ListingCache(object):
+    def __init__(self, path=PROJECT_LISTING_CACHE_FILE):
+        try:
+            self._store = shelve.open(path)
+        except dbm.error:
+            # A corrupt cache is not worth failing over, it only costs us bandwidth.
+            logger.exception('Unable to open listing cache {}, recreating it'.format(path))
+            self._store = shelve.open(path, flag='n')
+
+    def get(self, url):
+        try:
+            return self._store.get(url)
+        except Exception:
+            logger.exception('Unreadable listing cache entry for {}'.format(url))
+            return None
+
+    def store(self, url, etag, last_modified, body):
+        """Cache the body for url. Responses without any validator can not be revalidated and are dropped."""
+        if not etag and not last_modified:
+            self.discard(url)
+            return
+        self._store[url] = CachedListing(etag, last_modified, body)
+
+    def discard(self, url):
+        try:
+            del self._store[url]
+        except KeyError:
+            pass
+
+    def clear(self):
+        self._store.clear()
+
+    def close(self):
+        self._store.close()
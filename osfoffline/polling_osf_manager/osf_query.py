@@ -2,27 +2,69 @@ import asyncio
 import json
 import concurrent
 import logging
+import os
+import ssl
+import time
 
 import aiohttp
+from furl import furl
 
 from osfoffline.polling_osf_manager.remote_objects \
     import (dict_to_remote_object, RemoteFolder, RemoteFile, RemoteNode)
 from osfoffline.database_manager.models import File
-from osfoffline.polling_osf_manager.api_url_builder import api_url_for, NODES, RESOURCES, FILES
+from osfoffline.polling_osf_manager.transfer import file_sender
+from osfoffline.polling_osf_manager import bandwidth
+from osfoffline.polling_osf_manager.api_url_builder import (api_url_for, endpoint_type, NODES, RESOURCES, FILES,
+                                                            DOWNLOADS, UPLOADS)
 import osfoffline.alerts as AlertHandler
+from osfoffline import metrics
+from osfoffline.settings import (METADATA_REQUEST_LIMIT, METADATA_REQUEST_TIMEOUT, TRANSFER_REQUEST_LIMIT,
+                                 TRANSFER_REQUEST_TIMEOUT, CONNECTION_LIMIT_PER_HOST, CONNECTION_KEEPALIVE_TIMEOUT,
+                                 CONNECTION_TIMEOUT, DNS_CACHE_SECONDS)
 
 OK = 200
 CREATED = 201
 ACCEPTED = 202
+PARTIAL_CONTENT = 206
+RANGE_NOT_SATISFIABLE = 416
+NOT_MODIFIED = 304
+
+# json api documents compress very well. aiohttp decompresses them as they are read from the connection.
+METADATA_ACCEPT_ENCODING = 'gzip, deflate'
+COMPRESSED_ENCODINGS = ('gzip', 'deflate')
+
+
+def create_connector(loop):
+    """
+    Connection pool shared by all requests of an OSFQuery. Connections are kept alive between requests (so TLS
+    handshakes are only paid for new connections), limited per host, resolved addresses are cached and a single
+    ssl context is shared by every connection.
+    """
+    return aiohttp.TCPConnector(
+        loop=loop,
+        limit=CONNECTION_LIMIT_PER_HOST,
+        keepalive_timeout=CONNECTION_KEEPALIVE_TIMEOUT,
+        conn_timeout=CONNECTION_TIMEOUT,
+        use_dns_cache=True,
+        ssl_context=ssl.create_default_context()
+    )
 
 
 class OSFQuery(object):
-    def __init__(self, loop, oauth_token, limit=5):
+    def __init__(self, loop, oauth_token, limit=METADATA_REQUEST_LIMIT, listing_cache=None,
+                 transfer_limit=TRANSFER_REQUEST_LIMIT):
         self.headers = {
             'Authorization': 'Bearer {}'.format(oauth_token),
         }
-        self.throttler = asyncio.Semaphore(limit)
-        self.request_session = aiohttp.ClientSession(loop=loop, headers=self.headers)
+        self._loop = loop
+        # file contents and api metadata are limited separately so large transfers never hold up listings
+        self.throttler = asyncio.Semaphore(limit, loop=loop)
+        self.transfer_throttler = asyncio.Semaphore(transfer_limit, loop=loop)
+        self.connector = create_connector(loop)
+        self._dns_cached_at = time.time()
+        self.request_session = aiohttp.ClientSession(connector=self.connector, loop=loop, headers=self.headers)
+        # optional ListingCache. Without it every listing page is downloaded in full.
+        self.listing_cache = listing_cache
 
     @asyncio.coroutine
     def _get_all_paginated_members(self, remote_url):
@@ -32,19 +74,88 @@ class OSFQuery(object):
         if remote_url is None:
             return remote_children
 
-        resp = yield from self.make_request(remote_url, get_json=True)
-
+        resp = yield from self._get_listing_page(remote_url)
         remote_children.extend(resp['data'])
-        while resp['links']['next']:
-            resp = yield from self.make_request(resp['links']['next'], get_json=True)
 
-            remote_children.extend(resp['data'])
+        page_urls = self._remaining_page_urls(resp)
+        if page_urls is None:
+            # not enough information to know the remaining pages up front, follow the next links one at a time
+            while resp['links']['next']:
+                resp = yield from self._get_listing_page(resp['links']['next'])
+
+                remote_children.extend(resp['data'])
+        elif page_urls:
+            # fetch every remaining page at once, the metadata throttler still bounds how many are in flight
+            tasks = [asyncio.ensure_future(self._get_listing_page(url), loop=self._loop) for url in page_urls]
+            try:
+                pages = yield from asyncio.gather(*tasks, loop=self._loop)
+            except Exception:
+                for task in tasks:
+                    task.cancel()
+                raise
+            for page in pages:
+                remote_children.extend(page['data'])
 
         for child in remote_children:
             assert isinstance(child, dict)
 
         return remote_children
 
+    def _remaining_page_urls(self, first_page):
+        """
+        Compute the urls of all pages after first_page from the pagination metadata.
+        Returns None if the response does not say how many items there are or how pages are addressed.
+        """
+        next_url = first_page['links'].get('next')
+        if not next_url:
+            return []
+
+        meta = first_page.get('meta') or first_page['links'].get('meta') or {}
+        total, per_page = meta.get('total'), meta.get('per_page')
+        next_page = furl(next_url)
+        if not total or not per_page or 'page' not in next_page.args:
+            return None
+
+        try:
+            first_remaining = int(next_page.args['page'])
+        except ValueError:
+            return None
+        page_count = (total + per_page - 1) // per_page
+        if page_count < first_remaining:
+            return None
+
+        urls = []
+        for page in range(first_remaining, page_count + 1):
+            next_page.args['page'] = page
+            urls.append(next_page.url)
+        return urls
+
+    @asyncio.coroutine
+    def _get_listing_page(self, url):
+        """
+        Get a single json listing page. When a listing cache is configured the request is made conditional on the
+        validators of the cached copy, and the cached body is returned if the server reports it is not modified.
+        """
+        if self.listing_cache is None:
+            return (yield from self.make_request(url, get_json=True))
+
+        cached = self.listing_cache.get(url)
+        headers = cached.conditional_headers if cached else None
+        response = yield from self.make_request(url, headers=headers)
+
+        if response.status == NOT_MODIFIED and cached:
+            yield from response.release()
+            return cached.body
+
+        json_response = yield from self._read_json(response, url)
+        self.listing_cache.store(
+            url,
+            response.headers.get('ETag'),
+            response.headers.get('Last-Modified'),
+            json_response
+        )
+        return json_response
+
     @asyncio.coroutine
     def get_top_level_nodes(self, url):
         assert isinstance(url, str)
@@ -115,10 +226,12 @@ class OSFQuery(object):
         return dict_to_remote_object(resp_json['data'])
 
     @asyncio.coroutine
-    def upload_file(self, local_file):
+    def upload_file(self, local_file, progress=None):
         """
         THROWS FileNotFoundError !!!!!!
+        The file is streamed in chunks and always closed when the upload is done or fails.
         :param local_file:
+        :param progress: optional TransferProgress informed of every chunk sent
         :return:
         """
         assert isinstance(local_file, File)
@@ -133,7 +246,23 @@ class OSFQuery(object):
         files_url = api_url_for(RESOURCES, node_id=local_file.node.osf_id, provider=local_file.provider,
                                 file_id=parent_osf_id)
         file = open(local_file.path, 'rb')
-        resp_json = yield from self.make_request(files_url, method="PUT", params=params, data=file, get_json=True)
+        try:
+            size = os.fstat(file.fileno()).st_size
+            if progress:
+                progress.total = size
+            resp_json = yield from self.make_request(
+                files_url,
+                method="PUT",
+                params=params,
+                data=file_sender(file, size, progress=progress, throttle=bandwidth.limiter.throttle_upload),
+                headers={'Content-Length': str(size)},
+                get_json=True
+            )
+        finally:
+            # the sender closes the file once it is exhausted, this covers requests that never started sending
+            file.close()
+        if progress:
+            progress.finish()
         AlertHandler.info(local_file.name, AlertHandler.UPLOAD)
 
         return RemoteFile(resp_json['data'])
@@ -164,7 +293,7 @@ class OSFQuery(object):
         }
 
         resp = yield from self.make_request(url, method="POST", data=json.dumps(data))
-        resp.close()
+        yield from resp.release()
 
         remote.name = local.name
         return remote
@@ -202,7 +331,7 @@ class OSFQuery(object):
         }
 
         resp = yield from self.make_request(url, method="POST", data=json.dumps(data))
-        resp.close()
+        yield from resp.release()
 
         local_file_folder.locally_moved = False
 
@@ -239,25 +368,57 @@ class OSFQuery(object):
         assert isinstance(remote_file_folder, RemoteFile) or isinstance(remote_file_folder, RemoteFolder)
         url = remote_file_folder.delete_url
         resp = yield from self.make_request(url, method='DELETE')
-        resp.close()
+        yield from resp.release()
 
     @asyncio.coroutine
-    def make_request(self, url, method=None, params=None, expects=None, get_json=False, timeout=180, data=None):
-        yield from self.throttler.acquire()
+    def transfer_slot(self):
+        """
+        Wait for a transfer slot to hold for longer than a single request, e.g. until the whole body of a download
+        has been read: ``with (yield from osf_query.transfer_slot()):``. Requests made while holding it must pass
+        ``slot_held=True``.
+        """
+        with metrics.timer('requests.wait.transfer'):
+            return (yield from self.transfer_throttler)
 
+    @asyncio.coroutine
+    def make_request(self, url, method=None, params=None, expects=None, get_json=False, timeout=None, data=None,
+                     headers=None, slot_held=False):
+        """
+        Requests for file contents wait for a transfer slot, all others for a metadata slot. The slot is released
+        once the response headers arrived, unless the caller holds it (see transfer_slot). Unless given, the
+        timeout is METADATA_REQUEST_TIMEOUT or TRANSFER_REQUEST_TIMEOUT accordingly and does not include the time
+        spent waiting for a slot. Metadata responses are requested compressed.
+        """
         if method is None:
             method = 'GET'
+        request_type = endpoint_type(url, method, params)
+        if request_type in (DOWNLOADS, UPLOADS):
+            throttler, default_timeout, pool = self.transfer_throttler, TRANSFER_REQUEST_TIMEOUT, 'transfer'
+        else:
+            throttler, default_timeout, pool = self.throttler, METADATA_REQUEST_TIMEOUT, 'metadata'
+            headers = dict(headers or {})
+            headers.setdefault('Accept-Encoding', METADATA_ACCEPT_ENCODING)
+        if timeout is None:
+            timeout = default_timeout
+
+        if not slot_held:
+            with metrics.timer('requests.wait.{}'.format(pool)):
+                yield from throttler.acquire()
+        metrics.increment('requests.{}'.format(request_type))
+        self._expire_dns_cache()
 
         request = self.request_session.request(
             url=url,
             method=method.upper(),
             params=params,
-            data=data
+            data=data,
+            headers=headers
         )
         try:
             response = yield from asyncio.wait_for(request, timeout)
         finally:
-            self.throttler.release()
+            if not slot_held:
+                throttler.release()
 
         if expects:
             if response.status not in expects:
@@ -266,13 +427,35 @@ class OSFQuery(object):
             content = yield from response.read()
             error_message = '[status code: {}]:: {} @url {}'.format(response.status, content, url)
             logging.error(error_message)
-            self.close()
+            # the body has been read, so the connection goes back to the pool for the next request
             raise aiohttp.errors.HttpBadRequest(error_message)
 
         if get_json:
-            json_response = yield from response.json()
+            json_response = yield from self._read_json(response, url, method, params)
             return json_response
         return response
 
+    def _expire_dns_cache(self):
+        if time.time() - self._dns_cached_at > DNS_CACHE_SECONDS:
+            self.connector.clear_dns_cache()
+            self._dns_cached_at = time.time()
+
+    @asyncio.coroutine
+    def _read_json(self, response, url, method='GET', params=None):
+        body = yield from response.read()
+        request_type = endpoint_type(url, method, params)
+        metrics.increment('bytes.{}'.format(request_type), len(body))
+
+        # body is already decompressed, the size on the wire is only known from the headers
+        encoding = response.headers.get('CONTENT-ENCODING', '').lower()
+        wire_length = response.headers.get('CONTENT-LENGTH')
+        if encoding in COMPRESSED_ENCODINGS and wire_length and wire_length.isdigit():
+            metrics.increment('bytes.compressed.{}'.format(request_type), int(wire_length))
+            metrics.increment('bytes.uncompressed.{}'.format(request_type), len(body))
+
+        return json.loads(body.decode('utf-8'))
+
     def close(self):
         self.request_session.close()
+        if self.listing_cache is not None:
+            self.listing_cache.close()
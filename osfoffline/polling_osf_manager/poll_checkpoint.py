@@ -0,0 +1,100 @@
+"""
+Progress of the current poll cycle, kept on disk so a poll restarted after a failure can resume.
+
+Subtrees (nodes and folders) are marked as reconciled once they were completely checked. The marks only become
+durable when the database changes made while checking them are committed, see UnitOfWork.on_commit. A restarted
+poll skips every reconciled subtree of the same cycle and continues with the rest. Once a cycle finishes the
+checkpoint is cleared, and a checkpoint older than max_age is ignored so a stale one never hides changes.
+"""
+import json
+import logging
+import os
+import time
+
+from osfoffline.settings import POLL_CHECKPOINT_FILE, POLL_CHECKPOINT_MAX_AGE
+
+
+logger = logging.getLogger(__name__)
+
+
+def node_key(local_node):
+    return 'node:{}'.format(local_node.osf_id)
+
+
+def file_folder_key(local_file_folder):
+    return 'file:{}:{}'.format(local_file_folder.node.osf_id, local_file_folder.osf_id)
+
+
+class PollCheckpoint(object):
+    def __init__(self, path=POLL_CHECKPOINT_FILE, max_age=POLL_CHECKPOINT_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self.started = None
+        self.cursor = {}
+        self._completed = set()
+        self._pending = set()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as fp:
+                data = json.load(fp)
+            self.started = data['started']
+            self.cursor = data.get('cursor', {})
+            self._completed = set(data['completed'])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError):
+            logger.exception('Unreadable poll checkpoint {}, ignoring it'.format(self.path))
+
+    def begin_cycle(self):
+        """Start a poll cycle, resuming the interrupted one if there is a recent enough checkpoint"""
+        if self.started is not None and time.time() - self.started < self.max_age:
+            logger.info('Resuming poll interrupted at {}, skipping {} checked subtrees'.format(
+                self.cursor, len(self._completed)))
+        else:
+            self.clear()
+            self.started = time.time()
+        self._pending.clear()
+
+    def is_completed(self, key):
+        return key in self._completed
+
+    def mark_completed(self, key):
+        self._pending.add(key)
+
+    def set_cursor(self, **cursor):
+        """Where the poll currently is, e.g. project, node and folder paths. Saved along with the marks."""
+        self.cursor = cursor
+
+    def save(self):
+        """Make everything marked since the last save durable"""
+        if self.started is None:
+            return
+        self._completed.update(self._pending)
+        self._pending.clear()
+        temp_path = '{}.tmp'.format(self.path)
+        try:
+            with open(temp_path, 'w') as fp:
+                json.dump({
+                    'started': self.started,
+                    'cursor': self.cursor,
+                    'completed': sorted(self._completed),
+                }, fp)
+            os.replace(temp_path, self.path)
+        except OSError:
+            logger.exception('Unable to save poll checkpoint')
+
+    def discard_pending(self):
+        self._pending.clear()
+
+    def clear(self):
+        """The cycle finished, the next one starts from the top"""
+        self.started = None
+        self.cursor = {}
+        self._completed.clear()
+        self._pending.clear()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
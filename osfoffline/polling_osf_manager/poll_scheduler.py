@@ -0,0 +1,83 @@
+"""
+Decides when each synced top level project is polled next.
+
+Every project has its own interval. It is halved, down to min_delay, whenever a poll finds the project changed
+on the OSF and doubled, up to max_delay, whenever it did not. Busy projects are therefore checked every few
+minutes while dormant ones are left alone for up to max_delay. Each interval is randomly stretched or shrunk by
+up to ``jitter`` so that many clients started at the same time do not keep polling the API in lockstep.
+"""
+import datetime
+import random
+import time
+
+from osfoffline.settings import POLL_DELAY, POLL_MIN_DELAY, POLL_JITTER
+
+
+class ProjectSchedule(object):
+    def __init__(self, interval):
+        self.interval = interval
+        self.next_due = None  # None means due right away
+        self.last_polled = None
+        self.last_modified = None
+
+
+class PollScheduler(object):
+    def __init__(self, min_delay=POLL_MIN_DELAY, max_delay=POLL_DELAY, jitter=POLL_JITTER, clock=time.time):
+        # settings may ask for a max delay below the min delay (e.g. when developing with a tiny POLL_DELAY)
+        self.min_delay = min(min_delay, max_delay)
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self._clock = clock
+        self._projects = {}
+
+    def _get(self, project_id):
+        if project_id not in self._projects:
+            self._projects[project_id] = ProjectSchedule(self.min_delay)
+        return self._projects[project_id]
+
+    def is_due(self, project_id):
+        next_due = self._get(project_id).next_due
+        return next_due is None or next_due <= self._clock()
+
+    def has_changed(self, project_id, last_modified):
+        """Whether the project's remote modification date moved since the last recorded poll"""
+        return self._get(project_id).last_modified != last_modified
+
+    def record_poll(self, project_id, last_modified):
+        """Record a successful poll of a project and schedule the next one."""
+        schedule = self._get(project_id)
+        if schedule.last_polled is not None:
+            if self.has_changed(project_id, last_modified):
+                schedule.interval = max(self.min_delay, schedule.interval / 2)
+            else:
+                schedule.interval = min(self.max_delay, schedule.interval * 2)
+
+        now = self._clock()
+        schedule.last_polled = now
+        schedule.last_modified = last_modified
+        schedule.next_due = now + schedule.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def forget(self, project_ids_to_keep):
+        """Drop the schedule of every project that is no longer synced"""
+        for project_id in list(self._projects):
+            if project_id not in project_ids_to_keep:
+                del self._projects[project_id]
+
+    def next_due(self, project_id):
+        """Datetime at which the project is due to be polled, None if it is due right away"""
+        next_due = self._get(project_id).next_due
+        return datetime.datetime.fromtimestamp(next_due) if next_due is not None else None
+
+    @property
+    def schedule(self):
+        """Next due datetime of every known project, keyed by project id"""
+        return {project_id: self.next_due(project_id) for project_id in self._projects}
+
+    def seconds_until_next_due(self, project_ids):
+        """Seconds until the first of the given projects is due, never more than min_delay"""
+        now = self._clock()
+        waits = [self.min_delay]
+        for project_id in project_ids:
+            next_due = self._get(project_id).next_due
+            waits.append(0 if next_due is None else max(0, next_due - now))
+        return min(waits)
@@ -1,70 +1,135 @@
 import asyncio
+import datetime
 import itertools
 import logging
 import os
 import time
+import weakref
 
 import aiohttp
 import iso8601
 from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
 
 import osfoffline.alerts as AlertHandler
-from osfoffline.database_manager.models import User, Node, File, Base
+from osfoffline import metrics
+from osfoffline.database_manager.models import User, Node, File, Base, PendingOperation
 from osfoffline.database_manager.db import session
-from osfoffline.database_manager.utils import save
+from osfoffline.database_manager.utils import UnitOfWork
+from osfoffline.database_manager.tree_loader import load_local_tree
 from osfoffline.exceptions.item_exceptions import InvalidItemType
 from osfoffline.polling_osf_manager.api_url_builder import api_url_for, USERS, NODES
+from osfoffline.polling_osf_manager.event_queue import EventQueue
+from osfoffline.polling_osf_manager.listing_cache import ListingCache
 from osfoffline.polling_osf_manager.osf_query import OSFQuery
+from osfoffline.polling_osf_manager.poll_checkpoint import PollCheckpoint, node_key, file_folder_key
+from osfoffline.polling_osf_manager.poll_scheduler import PollScheduler
+from osfoffline.polling_osf_manager.transfer import TransferProgress
 from osfoffline.polling_osf_manager.remote_objects import RemoteObject, RemoteNode, RemoteFile, RemoteFileFolder
 from osfoffline.polling_osf_manager.polling_events import (CreateFile, CreateFolder, RenameFile, RenameFolder,
                                                            DeleteFile, DeleteFolder, UpdateFile)
-from osfoffline.settings import POLL_DELAY
+from osfoffline.settings import (POLL_TRAVERSAL_FAN_OUT, POLL_EVENT_WORKERS, PROJECT_LISTING_CACHE_FILE,
+                                 POLL_REPORT_FILE, POLL_REPORT_HISTORY, POLL_CHECKPOINT_FILE,
+                                 POLL_LOCAL_CHANGES_INTERVAL, POLL_RESTART_DELAY, DB_BATCH_SIZE)
 
 
 logger = logging.getLogger(__name__)
 
+
+def to_naive_utc(aware_datetime):
+    """Convert a timezone aware datetime to the naive utc datetime we store in the database"""
+    return aware_datetime.astimezone(iso8601.iso8601.Utc()).replace(tzinfo=None)
+
+
 try:
     asyncio.ensure_future
 except AttributeError:
     asyncio.ensure_future = asyncio.async
 
 
-class JoinableQueue(getattr(asyncio, 'JoinableQueue', asyncio.Queue)):
-
-    def _put(self, item):
-        self._queue.append(item)
-        self._unfinished_tasks += 1
-        self._finished.clear()
-
-
 class Poll(object):
-    def __init__(self, user, loop):
+    def __init__(self, user, loop, fan_out=POLL_TRAVERSAL_FAN_OUT, workers=POLL_EVENT_WORKERS,
+                 restart_delay=POLL_RESTART_DELAY):
         assert isinstance(user, User)
+        assert fan_out >= 1
+        assert workers >= 1
         self._keep_running = True
 
         self.user = user
+        self.fan_out = fan_out
+        # subtrees checked by tasks of their own, besides the one of the poll itself. Shared by every level of the
+        # tree, so at most fan_out checks run at once however deep the tree is.
+        self._traversal_slots = asyncio.Semaphore(fan_out - 1, loop=loop)
+        self.workers = workers
+        self.restart_delay = restart_delay
+        # outlives restarts of the poll job, so a failed poll does not reset every project's interval
+        self.scheduler = PollScheduler()
+        # wall time of every project checked during the current poll cycle
+        self._project_times = {}
+        # subtrees already reconciled in this cycle, durable together with the database changes made for them
+        self.checkpoint = PollCheckpoint('{}-{}'.format(POLL_CHECKPOINT_FILE, self.user.osf_id))
+        # local-only database changes are committed in batches, anything mirrored on the OSF right away
+        # the local tree is loaded once per cycle and has to stay loaded until the cycle ends, so this thread's
+        # session does not expire everything on each commit. check_osf expires it when a cycle starts.
+        session().expire_on_commit = False
+        self.unit_of_work = UnitOfWork(
+            session,
+            on_commit=self.checkpoint.save,
+            on_rollback=self.discard_batch
+        )
+        self.queue = None
+        # TransferProgress of every upload currently running, keyed by local path
+        self.active_transfers = {}
+        # (id, node_id) of the pending operations read at the start of the cycle, and the id of the last one read
+        self._pending_operations = []
+        self._journal_position = 0
+        # ids of the local nodes the pending operations read at the start of the cycle were recorded for
+        self._pending_node_ids = set()
+        # ids of local nodes that have unsynced local changes somewhere beneath them. Refreshed every poll.
+        self._locally_changed_node_ids = set()
+        # ids of local nodes whose subtree was synced completely in the current cycle
+        self._synced_node_ids = set()
+        # local node -> remote last_modified of every node checked completely in the current cycle. Its watermark
+        # only moves once the events queued for it have run, see record_synced_nodes.
+        self._checked_nodes = {}
+        # the local node each queued event syncs, and the nodes that had an event fail in the current cycle
+        self._event_nodes = weakref.WeakKeyDictionary()
+        self._failed_nodes = set()
+        # nothing watched the local files while the app was closed, so until a cycle has finished after startup the
+        # files of every node are checked whatever their watermark, and every local file is stat'ed
+        self._startup_cycle = True
 
         self._loop = loop
         self.poll_job = None
-        self.process_job = None
-        self.osf_query = OSFQuery(loop=self._loop, oauth_token=self.user.oauth_token)
+        self.process_jobs = []
+        self.restart_job = None
+        self.osf_query = OSFQuery(
+            loop=self._loop,
+            oauth_token=self.user.oauth_token,
+            # one cache per user, listings differ depending on who is asking
+            listing_cache=ListingCache('{}-{}'.format(PROJECT_LISTING_CACHE_FILE, self.user.osf_id))
+        )
 
     def stop(self):
         logger.info('OSF polling requested to stop.')
+        self._keep_running = False
+        if self.restart_job is not None:
+            self.restart_job.cancel()
 
         # Stop was called before start could complete
-        if not self.poll_job or not self.process_job:
+        if not self.poll_job or not self.process_jobs:
             return
 
         # If these futures are complete an exception has been raised in them
         if self.poll_job.done():
             raise self.poll_job.exception()
-        if self.process_job.done():
-            raise self.process_job.exception()
+        for process_job in self.process_jobs:
+            if process_job.done():
+                raise process_job.exception()
 
         # Other wise cancel them, the event loop will clean up for us
         self.poll_job.cancel()
-        self.process_job.cancel()
+        for process_job in self.process_jobs:
+            process_job.cancel()
         self.osf_query.close()
         logger.info('OSF polling requested stopped.')
 
@@ -79,38 +144,91 @@ class Poll(object):
             # Cancellations just mean this thread is exiting
             return
 
+        # Changes of the failed poll that were not committed yet may be half done, drop them
+        if future is self.poll_job:
+            self.unit_of_work.rollback()
+
         # Make sure all our jobs are cancelled
-        if future == self.poll_job:
-            self.process_job.cancel()
-        else:
-            self.poll_job.cancel()
+        for job in [self.poll_job] + self.process_jobs:
+            if job is not future:
+                job.cancel()
 
-        logger.info('Restarting polling in 5 seconds')
-        # Finally restart our watcher thread in 5 seconds
-        self._loop.call_later(5, self.start)
+        logger.info('Restarting polling in {} seconds'.format(self.restart_delay))
+        # Finally restart our jobs, the loop is running so this must not block on it
+        self._loop.call_later(self.restart_delay, self._schedule_restart)
 
     def start(self):
+        """Start polling. Called before the event loop runs."""
         remote_user = self._loop.run_until_complete(self.get_remote_user())
+        self.start_jobs(remote_user)
+        return True
 
-        self.queue = JoinableQueue(maxsize=15)
+    def _schedule_restart(self):
+        if not self._keep_running:
+            return
+        self.restart_job = asyncio.ensure_future(self.restart(), loop=self._loop)
 
-        self.process_job = asyncio.ensure_future(self.process_queue())
-        self.poll_job = asyncio.ensure_future(self.check_osf(remote_user))
+    @asyncio.coroutine
+    def restart(self):
+        """Start polling again after the jobs failed, from within the running event loop"""
+        remote_user = yield from self.get_remote_user()
+        self.start_jobs(remote_user)
+
+    def start_jobs(self, remote_user):
+        # events queued before a restart are still run. Those produced by the batch that was rolled back when the
+        # poll failed have been dropped (see discard_batch), the rest belong to committed changes.
+        if self.queue is None:
+            self.queue = EventQueue(self._loop)
+
+        self.process_jobs = [
+            asyncio.ensure_future(self.process_queue(), loop=self._loop) for _ in range(self.workers)
+        ]
+        self.poll_job = asyncio.ensure_future(self.check_osf(remote_user), loop=self._loop)
 
         self.poll_job.add_done_callback(self.handle_exception)
-        self.process_job.add_done_callback(self.handle_exception)
+        for process_job in self.process_jobs:
+            process_job.add_done_callback(self.handle_exception)
 
-        return True
+    def discard_batch(self):
+        """Called when the current database batch is rolled back, forget what was derived from its changes"""
+        self.checkpoint.discard_pending()
+        if self.queue is not None:
+            self.queue.discard_batch(self.unit_of_work.batch)
+
+    @asyncio.coroutine
+    def enqueue(self, event, node=None):
+        """
+        Queue an event for the changes of the current database batch, it is dropped if the batch is rolled back.
+        node is the local node the event syncs, its watermark does not move if the event fails.
+        """
+        if node is not None:
+            self._event_nodes[event] = node
+        yield from self.queue.put(event, batch=self.unit_of_work.batch)
 
     @asyncio.coroutine
     def process_queue(self):
+        """One of the workers running queued events. Several of these run at the same time."""
         while True:
-            job = yield from self.queue.get()
-            logger.info('Running {}'.format(job))
+            entry = yield from self.queue.get()
             try:
-                yield from job.run()
-            finally:
-                self.queue.task_done()
+                yield from self.queue.wait_turn(entry)
+                logger.info('Running {}'.format(entry.event))
+                yield from entry.event.run()
+            except asyncio.CancelledError:
+                # polling is restarting, let the next worker run this event again
+                self.queue.requeue(entry)
+                raise
+            except Exception:
+                # its node keeps its watermark, so the next poll finds whatever this event did not get done.
+                # Keep the worker and the queue going.
+                logger.exception('Error running {}'.format(entry.event))
+                node = self._event_nodes.pop(entry.event, None)
+                if node is not None:
+                    self._failed_nodes.add(node)
+                self.queue.task_done(entry)
+            else:
+                self._event_nodes.pop(entry.event, None)
+                self.queue.task_done(entry)
 
     @asyncio.coroutine
     def get_remote_user(self):
@@ -187,10 +305,12 @@ class Poll(object):
             assert isinstance(remote, RemoteObject)
             remote_files[remote.id] = remote
 
-        return new_files + [
+        local_remote_tuples = new_files + [
             (local_files.get(fid), remote_files.get(fid))
             for fid in set(itertools.chain(local_files.keys(), remote_files.keys()))
         ]
+        metrics.increment('poll.pairs_compared', len(local_remote_tuples))
+        return local_remote_tuples
 
     @asyncio.coroutine
     def check_osf(self, remote_user):
@@ -202,6 +322,19 @@ class Poll(object):
 
         while True:
             logger.info('Begining OSF poll')
+            cycle_started = time.time()
+            metrics_before = metrics.snapshot()
+            self._project_times = {}
+
+            # start from what is committed (the ui thread may have changed the user), then load the whole local
+            # tree at once instead of lazy loading it level by level while comparing
+            self.unit_of_work.commit()
+            session.expire_all()
+            with metrics.timer('poll.load_local_tree'):
+                load_local_tree(session, self.user)
+
+            self.checkpoint.begin_cycle()
+
             # get local top level nodes
             local_projects = self.user.top_level_nodes
 
@@ -209,22 +342,95 @@ class Poll(object):
 
             paired_projects = self.make_local_remote_tuple_list(local_projects, remote_projects)
 
-            session.refresh(self.user)
+            # changes recorded from here on are handled by the next cycle
+            self.read_pending_operations()
+            self._locally_changed_node_ids = self.get_locally_changed_node_ids()
+            self._synced_node_ids = set()
+            self._checked_nodes = {}
+            self._failed_nodes = set()
 
             sync_list = self.user.guid_for_top_level_nodes_to_sync
             logger.debug('sync list is: {}'.format(sync_list))
 
-            for local, remote in paired_projects:
-                if not remote or remote.id not in sync_list:
-                    continue
-                yield from self.check_node(local, remote, local_parent_node=None)
+            synced_projects = [
+                (local, remote)
+                for local, remote in paired_projects
+                if remote and remote.id in sync_list
+            ]
+            self.scheduler.forget([remote.id for local, remote in synced_projects])
+            due_projects = [
+                (local, remote)
+                for local, remote in synced_projects
+                if self.scheduler.is_due(remote.id) or self.has_local_changes(local)
+            ]
+            logger.debug('projects due for polling: {}'.format([remote.name for local, remote in due_projects]))
+
+            yield from self._check_siblings(self._check_project, due_projects, local_parent_node=None)
 
             yield from self.queue.join()
+            self.record_synced_nodes()
+
+            self.checkpoint.clear()
+            self.discard_pending_operations(sync_list)
+            self.write_poll_report(cycle_started, metrics_before)
+
+            for local, remote in due_projects:
+                self.scheduler.record_poll(remote.id, remote.last_modified)
+                logger.debug('next poll of {} due at {}'.format(remote.name, self.scheduler.next_due(remote.id)))
 
+            self._startup_cycle = False
             AlertHandler.up_to_date()
             logger.debug('---------SHOULD HAVE ALL OSF FILES---------')
 
-            yield from asyncio.sleep(POLL_DELAY)
+            yield from self.wait_for_next_cycle(
+                self.scheduler.seconds_until_next_due([remote.id for local, remote in synced_projects])
+            )
+
+    @asyncio.coroutine
+    def wait_for_next_cycle(self, seconds):
+        """Sleep until the next project is due, or until new local changes have been recorded"""
+        wake_up = time.time() + seconds
+        while True:
+            remaining = wake_up - time.time()
+            if remaining <= 0:
+                return
+            yield from asyncio.sleep(min(remaining, POLL_LOCAL_CHANGES_INTERVAL))
+            # end the current read transaction, it would keep seeing the journal as it was when it started
+            self.unit_of_work.commit()
+            if self.has_new_pending_operations():
+                logger.debug('local changes were recorded, polling right away')
+                return
+
+    @asyncio.coroutine
+    def _check_project(self, local_node, remote_node, local_parent_node):
+        """check_node for a top level project, recording how long the project took"""
+        started = time.time()
+        try:
+            yield from self.check_node(local_node, remote_node, local_parent_node)
+            self.unit_of_work.commit()
+        finally:
+            seconds = time.time() - started
+            self._project_times[remote_node.name if remote_node else local_node.title] = seconds
+            metrics.record_time('poll.project', seconds)
+
+    def write_poll_report(self, cycle_started, metrics_before):
+        """Add the metrics of the poll cycle that just finished to the rolling poll report"""
+        report = {
+            'started': datetime.datetime.utcfromtimestamp(cycle_started).isoformat(),
+            'seconds': time.time() - cycle_started,
+            'project_seconds': self._project_times,
+        }
+        report.update(metrics.difference(metrics_before, metrics.snapshot()))
+        compressed = sum(value for name, value in report['counters'].items() if name.startswith('bytes.compressed.'))
+        uncompressed = sum(value for name, value in report['counters'].items()
+                           if name.startswith('bytes.uncompressed.'))
+        if uncompressed:
+            report['compression_ratio'] = compressed / uncompressed
+        logger.info('OSF poll finished in {:.1f} seconds'.format(report['seconds']))
+        try:
+            metrics.append_report(POLL_REPORT_FILE, report, keep=POLL_REPORT_HISTORY)
+        except OSError:
+            logger.exception('Unable to write poll report')
 
     @asyncio.coroutine
     def check_node(self, local_node, remote_node, local_parent_node):
@@ -253,11 +459,19 @@ class Poll(object):
             yield from self.delete_local_node(local_node)
             return
         elif local_node is not None and remote_node is not None:
+            if self.checkpoint.is_completed(node_key(local_node)):
+                # not counted as synced: the journal may have entries for it that were recorded after it was checked
+                logger.debug('node {} already checked before the poll was restarted'.format(local_node.title))
+                return
             if local_node.title != remote_node.name:
                 yield from self.modify_local_node(local_node, remote_node)
 
         # handle file_folders for node
-        yield from self.check_file_folder(local_node, remote_node)
+        if self.is_unchanged_since_last_sync(local_node, remote_node):
+            logger.debug('files of node {} unchanged since last poll, skipping'.format(local_node.title))
+            metrics.increment('poll.nodes_unchanged')
+        else:
+            yield from self.check_file_folder(local_node, remote_node)
 
         # ensure that local node has Components folder
         yield from self._ensure_components_folder(local_node)
@@ -266,8 +480,102 @@ class Poll(object):
         remote_children = yield from self.osf_query.get_child_nodes(remote_node)
 
         local_remote_nodes = self.make_local_remote_tuple_list(local_node.child_nodes, remote_children)
-        for local, remote in local_remote_nodes:
-            yield from self.check_node(local, remote, local_parent_node=local_node)
+        yield from self._check_siblings(self.check_node, local_remote_nodes, local_parent_node=local_node)
+
+        # only reached when the whole subtree was checked without errors. Its events may still fail, so the
+        # watermark is moved once they have all run.
+        self._checked_nodes[local_node] = to_naive_utc(remote_node.last_modified)
+        self.checkpoint.mark_completed(node_key(local_node))
+        self.unit_of_work.checkpoint()
+
+    def record_synced_nodes(self):
+        """
+        Called once every event of the cycle has run. Moves the watermark of the nodes checked completely in this
+        cycle, unless one of their events failed: those have their files checked again by the next poll, and keep
+        their journal entries until then.
+        """
+        for local_node, last_modified in self._checked_nodes.items():
+            if local_node in self._failed_nodes:
+                logger.info('not all changes of node {} were synced, checking it again next poll'.format(
+                    local_node.title))
+                continue
+            local_node.sync_watermark = last_modified
+            self.unit_of_work.save(local_node)
+            self._synced_node_ids.add(local_node.id)
+        self._checked_nodes = {}
+        self.unit_of_work.commit()
+
+    def is_unchanged_since_last_sync(self, local_node, remote_node):
+        """
+        The files of a node need not be listed when the OSF reports no modification of the node since they were
+        last polled successfully and none of them has been changed locally. Its components are checked regardless,
+        their modifications do not show in the node's date_modified. Watermarks are not trusted before the first
+        cycle after startup finished, local changes made while the app was closed are not in the journal.
+        """
+        assert isinstance(local_node, Node)
+        assert isinstance(remote_node, RemoteNode)
+        if self._startup_cycle or local_node.sync_watermark is None:
+            return False
+        if local_node.id in self._pending_node_ids:
+            return False
+        return local_node.sync_watermark == to_naive_utc(remote_node.last_modified)
+
+    def read_pending_operations(self):
+        """Read the journal of local changes recorded so far, in order, from the (user_id, id) index"""
+        self._pending_operations = session.query(PendingOperation.id, PendingOperation.node_id).filter(
+            PendingOperation.user_id == self.user.id
+        ).order_by(PendingOperation.id).all()
+        if self._pending_operations:
+            self._journal_position = self._pending_operations[-1][0]
+        self._pending_node_ids = {node_id for _, node_id in self._pending_operations}
+        metrics.increment('poll.pending_operations', len(self._pending_operations))
+
+    def has_new_pending_operations(self):
+        return session.query(PendingOperation.id).filter(
+            PendingOperation.user_id == self.user.id,
+            PendingOperation.id > self._journal_position
+        ).first() is not None
+
+    def has_local_changes(self, local_node):
+        """Projects with local changes are polled right away, so the changes are pushed"""
+        return local_node is not None and local_node.id in self._locally_changed_node_ids
+
+    def get_locally_changed_node_ids(self):
+        """
+        Return the ids of every node that contains, directly or through its components, a file/folder with
+        local changes that still have to be pushed to the OSF.
+        """
+        node_ids = set()
+        for node_id in self._pending_node_ids:
+            # the tree is loaded, so this is answered from the identity map
+            node = session.query(Node).get(node_id)
+            while node is not None and node.id not in node_ids:
+                node_ids.add(node.id)
+                node = node.parent
+        return node_ids
+
+    def discard_pending_operations(self, sync_list):
+        """
+        Remove the journal entries read at the start of the cycle that are done with: their node has been synced
+        in this cycle, no longer exists, or belongs to a project that is not synced at all.
+        """
+        done = []
+        for operation_id, node_id in self._pending_operations:
+            node = session.query(Node).get(node_id)
+            if node_id in self._synced_node_ids or node is None:
+                done.append(operation_id)
+                continue
+            while node.parent is not None:
+                node = node.parent
+            if node.osf_id not in sync_list:
+                done.append(operation_id)
+
+        for start in range(0, len(done), DB_BATCH_SIZE):
+            session.query(PendingOperation).filter(
+                PendingOperation.id.in_(done[start:start + DB_BATCH_SIZE])
+            ).delete(synchronize_session=False)
+        self.unit_of_work.commit()
+        self._pending_operations = []
 
     @asyncio.coroutine
     def check_file_folder(self, local_node, remote_node):
@@ -300,13 +608,12 @@ class Poll(object):
             remote_node_top_level_file_folders
         )
 
-        for local, remote in local_remote_files:
-            yield from self._check_file_folder(
-                local,
-                remote,
-                local_parent_file_folder=None,
-                local_node=local_node
-            )
+        yield from self._check_siblings(
+            self._check_file_folder,
+            local_remote_files,
+            local_parent_file_folder=None,
+            local_node=local_node
+        )
 
     @asyncio.coroutine
     def _check_file_folder(self,
@@ -333,6 +640,11 @@ class Poll(object):
 
         assert local_file_folder or remote_file_folder  # both shouldnt be None.
         logger.debug('checking file_folder internal')
+        if local_file_folder is not None and remote_file_folder is not None and local_file_folder.is_folder:
+            if self.checkpoint.is_completed(file_folder_key(local_file_folder)):
+                return
+            self.checkpoint.set_cursor(node=local_node.path, folder=local_file_folder.path)
+
         if local_file_folder is None:
             locally_moved = yield from self.is_locally_moved(remote_file_folder)
             if locally_moved:
@@ -350,8 +662,7 @@ class Poll(object):
         elif local_file_folder.locally_created and remote_file_folder is not None:
             raise ValueError('newly created local file_folder was already on server')
         elif local_file_folder.locally_deleted and remote_file_folder is None:
-            session.delete(local_file_folder)
-            save(session)
+            self.unit_of_work.delete(local_file_folder)
             logger.warning('local file_folder is to be deleted, however, it was never on the server.')
             return
         elif local_file_folder.locally_deleted and remote_file_folder is not None:
@@ -388,15 +699,63 @@ class Poll(object):
 
             local_remote_file_folders = self.make_local_remote_tuple_list(local_file_folder.files, remote_children)
 
-            for local, remote in local_remote_file_folders:
-                yield from self._check_file_folder(
-                    local,
-                    remote,
-                    local_parent_file_folder=local_file_folder,
-                    local_node=local_node
-                )
+            yield from self._check_siblings(
+                self._check_file_folder,
+                local_remote_file_folders,
+                local_parent_file_folder=local_file_folder,
+                local_node=local_node
+            )
+            self.checkpoint.mark_completed(file_folder_key(local_file_folder))
+            # commit at folder boundaries so a folder's changes end up in the same batch
+            self.unit_of_work.checkpoint()
+
+    @asyncio.coroutine
+    def _check_siblings(self, check, local_remote_pairs, **kwargs):
+        """
+        Run ``check(local, remote, **kwargs)`` for every pair in one level of the tree.
+
+        Pairs without a remote counterpart are handled first and one at a time, so that an item which is going
+        away locally is dealt with before a sibling that may reuse its name. The remaining pairs have their
+        subtrees explored concurrently: each is handed to a task of its own while one of the poll's traversal slots
+        is free, and checked by the calling task otherwise. No more than ``self.fan_out`` checks run at once across
+        all levels, and nothing waits for a slot, so a level never blocks on the levels beneath it. Every event for
+        the parent has already been queued when this is called, so children can never overtake their parents in
+        the queue.
+
+        :param check: coroutine function, either check_node or _check_file_folder
+        :param local_remote_pairs: list of (local, remote) tuples from make_local_remote_tuple_list
+        """
+        local_only = [(local, remote) for local, remote in local_remote_pairs if remote is None]
+        remaining = [(local, remote) for local, remote in local_remote_pairs if remote is not None]
+
+        for local, remote in local_only:
+            yield from check(local, remote, **kwargs)
 
-                    # if we are unable to get children, then we do not try to get and manipulate children
+        tasks = []
+        try:
+            for local, remote in remaining:
+                if self._traversal_slots.locked():
+                    yield from check(local, remote, **kwargs)
+                else:
+                    # free, so this does not wait
+                    yield from self._traversal_slots.acquire()
+                    tasks.append(asyncio.ensure_future(
+                        self._check_in_slot(check, local, remote, kwargs),
+                        loop=self._loop
+                    ))
+            yield from asyncio.gather(*tasks, loop=self._loop)
+        except (Exception, asyncio.CancelledError):
+            # Do not leave half of a level running once one of its siblings failed
+            for task in tasks:
+                task.cancel()
+            raise
+
+    @asyncio.coroutine
+    def _check_in_slot(self, check, local, remote, kwargs):
+        try:
+            yield from check(local, remote, **kwargs)
+        finally:
+            self._traversal_slots.release()
 
     # Create
     @asyncio.coroutine
@@ -414,11 +773,11 @@ class Poll(object):
             user=self.user,
             parent=local_parent_node
         )
-        save(session, new_node)
+        self.unit_of_work.save(new_node)
 
         if local_parent_node:
             yield from self._ensure_components_folder(local_parent_node)
-        yield from self.queue.put(CreateFolder(new_node.path))
+        yield from self.enqueue(CreateFolder(new_node.path), new_node)
         yield from self._ensure_components_folder(new_node)
 
         assert local_parent_node is None or (new_node in local_parent_node.child_nodes)
@@ -447,17 +806,19 @@ class Poll(object):
             parent=local_parent_folder,
             node=local_node
         )
-        save(session, new_file_folder)
+        self.unit_of_work.save(new_file_folder)
 
         if file_type == File.FILE:
             event = CreateFile(
                 path=new_file_folder.path,
                 download_url=remote_file_folder.download_url,
-                osf_query=self.osf_query
+                osf_query=self.osf_query,
+                size=remote_file_folder.size,
+                md5=remote_file_folder.md5
             )
-            yield from self.queue.put(event)
+            yield from self.enqueue(event, local_node)
         elif file_type == File.FOLDER:
-            yield from self.queue.put(CreateFolder(new_file_folder.path))
+            yield from self.enqueue(CreateFolder(new_file_folder.path), local_node)
         else:
             raise ValueError('file type is unknown')
 
@@ -476,7 +837,7 @@ class Poll(object):
             remote_file_folder = yield from self.osf_query.upload_folder(local_file_folder)
         elif local_file_folder.is_file:
             try:
-                remote_file_folder = yield from self.osf_query.upload_file(local_file_folder)
+                remote_file_folder = yield from self._upload_file(local_file_folder)
             except FileNotFoundError:
                 logger.warning('file not created on remote server because does not exist locally: {}'.format(
                     local_file_folder.name))
@@ -486,7 +847,9 @@ class Poll(object):
         local_file_folder.osf_path = remote_file_folder.id
         local_file_folder.locally_created = False
 
-        save(session, local_file_folder)
+        # the file/folder now exists on the OSF, this must not be lost with a later failing batch
+        self.unit_of_work.save(local_file_folder)
+        self.unit_of_work.commit()
 
         return remote_file_folder
 
@@ -503,9 +866,9 @@ class Poll(object):
 
         local_node.category = remote_node.category
 
-        save(session, local_node)
+        self.unit_of_work.save(local_node)
 
-        yield from self.queue.put(RenameFolder(old_path, local_node.path))
+        yield from self.enqueue(RenameFolder(old_path, local_node.path), local_node)
 
     @asyncio.coroutine
     def modify_file_folder_logic(self, local_file_folder, remote_file_folder):
@@ -528,16 +891,86 @@ class Poll(object):
             else:
                 yield from self.rename_local_file_folder(local_file_folder, remote_file_folder)
 
-        # if file size is different, then only do you  bother checking whether to upload or to download
-        if local_file_folder.is_file and local_file_folder.size != remote_file_folder.size:  # todo: local_file_folder.hash != remote_file_folder.size
-            if (yield from self.local_file_is_newer(local_file_folder, remote_file_folder)):
+        if local_file_folder.is_file:
+            transfer = yield from self.file_transfer_direction(local_file_folder, remote_file_folder)
+            if transfer == AlertHandler.UPLOAD:
                 updated_remote_file_folder = yield from self.update_remote_file(local_file_folder, remote_file_folder)
-            elif (yield from self.remote_file_is_newer(local_file_folder, remote_file_folder)):
+            elif transfer == AlertHandler.DOWNLOAD:
                 yield from self.update_local_file(local_file_folder, remote_file_folder)
 
         # want to have the remote file folder continue to be the most recent version.
         return updated_remote_file_folder
 
+    @asyncio.coroutine
+    def file_transfer_direction(self, local_file, remote_file):
+        """
+        Decide whether a file needs to be uploaded (AlertHandler.UPLOAD), downloaded (AlertHandler.DOWNLOAD) or
+        neither (None).
+
+        Contents are compared by md5. When they differ, the copy that still has the content both sides last agreed
+        on (File.synced_hash) is the outdated one. Timestamps only decide when both copies changed since, when
+        there is no sync history, or when the provider does not report checksums (then only if the size differs).
+        """
+        assert isinstance(local_file, File)
+        assert isinstance(remote_file, RemoteFile)
+
+        if remote_file.md5 is None:
+            return (yield from self._transfer_direction_without_md5(local_file, remote_file))
+
+        try:
+            self.refresh_local_file(local_file)
+        except OSError:
+            logger.warning('Unable to hash {}, comparing timestamps instead'.format(local_file.name))
+            return (yield from self._newer_file_side(local_file, remote_file))
+
+        if local_file.hash == remote_file.md5:
+            if local_file.synced_hash != remote_file.md5:
+                local_file.synced_hash = remote_file.md5
+                self.unit_of_work.save(local_file)
+            return None
+        if local_file.synced_hash == remote_file.md5:
+            return AlertHandler.UPLOAD
+        if local_file.synced_hash is not None and local_file.synced_hash == local_file.hash:
+            return AlertHandler.DOWNLOAD
+        return (yield from self._newer_file_side(local_file, remote_file))
+
+    @asyncio.coroutine
+    def _transfer_direction_without_md5(self, local_file, remote_file):
+        try:
+            self.refresh_local_file(local_file, rehash=False)
+        except OSError:
+            pass
+        if local_file.size == remote_file.size:
+            return None
+        return (yield from self._newer_file_side(local_file, remote_file))
+
+    def refresh_local_file(self, local_file, rehash=True):
+        """
+        Bring the stored stat and hash of local_file up to date with the file on disk, rehashing only when the stat
+        changed. While the app runs the watcher keeps them up to date, so the file is only stat'ed in the first
+        cycle after startup, when it may have been changed while nothing was watching, or when nothing is stored
+        yet, e.g. right after the poller downloaded it.
+        Raises OSError when the file cannot be read.
+        """
+        stored = local_file.mtime_ns is not None and (local_file.hash is not None or not rehash)
+        if stored and not self._startup_cycle:
+            return
+        stat = os.stat(local_file.path)
+        if local_file.stat_matches(stat) and (local_file.hash is not None or not rehash):
+            return
+        if rehash:
+            local_file.update_hash()
+        local_file.update_stat()
+        self.unit_of_work.save(local_file)
+
+    @asyncio.coroutine
+    def _newer_file_side(self, local_file, remote_file):
+        if (yield from self.local_file_is_newer(local_file, remote_file)):
+            return AlertHandler.UPLOAD
+        if (yield from self.remote_file_is_newer(local_file, remote_file)):
+            return AlertHandler.DOWNLOAD
+        return None
+
     @asyncio.coroutine
     def rename_local_file_folder(self, local_file_folder, remote_file_folder):
         logger.debug('rename_local_file_folder')
@@ -550,12 +983,12 @@ class Poll(object):
         # update model
         local_file_folder.name = remote_file_folder.name
 
-        save(session, local_file_folder)
+        self.unit_of_work.save(local_file_folder)
 
         if local_file_folder.is_folder:
-            yield from self.queue.put(RenameFolder(old_path, local_file_folder.path))
+            yield from self.enqueue(RenameFolder(old_path, local_file_folder.path), local_file_folder.node)
         elif local_file_folder.is_file:
-            yield from self.queue.put(RenameFile(old_path, local_file_folder.path))
+            yield from self.enqueue(RenameFile(old_path, local_file_folder.path), local_file_folder.node)
 
     @asyncio.coroutine
     def update_local_file(self, local_file, remote_file):
@@ -564,15 +997,20 @@ class Poll(object):
         assert remote_file.id == local_file.osf_path
 
         # update model
-        # nothing to update. size, hash are all updated internally as the event occurs.
+        # the watcher ignores the poller's own writes, so hash and stat are refreshed the next time they are compared
+        local_file.hash = None
+        local_file.forget_stat()
+        self.unit_of_work.save(local_file)
 
         # update local file system
         event = UpdateFile(
             path=local_file.path,
             download_url=remote_file.download_url,
-            osf_query=self.osf_query
+            osf_query=self.osf_query,
+            size=remote_file.size,
+            md5=remote_file.md5
         )
-        yield from self.queue.put(event)
+        yield from self.enqueue(event, local_file.node)
 
     @asyncio.coroutine
     def update_remote_file(self, local_file, remote_file):
@@ -582,15 +1020,28 @@ class Poll(object):
         assert remote_file.id == local_file.osf_path
 
         try:
-            new_remote_file = yield from self.osf_query.upload_file(local_file)
+            new_remote_file = yield from self._upload_file(local_file)
         except FileNotFoundError:
             logger.warning(
                 'file {} not reuploaded on remote server because does not exist locally. it probably downloaded incorrectly.'.format(local_file.name))
             yield from self.update_local_file(local_file, remote_file)
             return remote_file
 
+        # the remote copy now has the local content
+        local_file.synced_hash = local_file.hash
+        self.unit_of_work.save(local_file)
         return new_remote_file
 
+    @asyncio.coroutine
+    def _upload_file(self, local_file):
+        path = local_file.path
+        progress = TransferProgress(local_file.name, AlertHandler.UPLOAD)
+        self.active_transfers[path] = progress
+        try:
+            return (yield from self.osf_query.upload_file(local_file, progress=progress))
+        finally:
+            del self.active_transfers[path]
+
     @asyncio.coroutine
     def rename_remote_file_folder(self, local_file_folder, remote_file_folder):
         logger.debug('rename_remote_file_folder.')
@@ -617,6 +1068,10 @@ class Poll(object):
         else:  # if local_file_folder.is_folder:
             new_remote_file_folder = yield from self.osf_query.move_remote_folder(local_file_folder)
 
+        # the move cleared locally_moved. It happened on the OSF already, so commit right away.
+        self.unit_of_work.save(local_file_folder)
+        self.unit_of_work.commit()
+
         return new_remote_file_folder
 
     # Delete
@@ -628,10 +1083,9 @@ class Poll(object):
         path = local_node.path
 
         # delete model
-        session.delete(local_node)
-        save(session)
+        self.unit_of_work.delete(local_node)
 
-        yield from self.queue.put(DeleteFolder(path))
+        yield from self.enqueue(DeleteFolder(path), local_node)
 
     @asyncio.coroutine
     def delete_local_file_folder(self, local_file_folder):
@@ -640,15 +1094,15 @@ class Poll(object):
 
         path = local_file_folder.path
         is_folder = local_file_folder.is_folder
+        node = local_file_folder.node
         # delete model
-        session.delete(local_file_folder)
-        save(session)
+        self.unit_of_work.delete(local_file_folder)
 
         # delete from local
         if is_folder:
-            yield from self.queue.put(DeleteFolder(path))
+            yield from self.enqueue(DeleteFolder(path), node)
         else:
-            yield from self.queue.put(DeleteFile(path))
+            yield from self.enqueue(DeleteFile(path), node)
 
     @asyncio.coroutine
     def delete_remote_file_folder(self, local_file_folder, remote_file_folder):
@@ -664,15 +1118,22 @@ class Poll(object):
             yield from self.osf_query.delete_remote_folder(remote_file_folder)
 
         local_file_folder.deleted = False
-        session.delete(local_file_folder)
-        save(session)
+        # already deleted on the OSF, commit right away
+        self.unit_of_work.delete(local_file_folder)
+        self.unit_of_work.commit()
 
     @asyncio.coroutine
     def _get_local_remote_times(self, local, remote):
         assert isinstance(local, File)
         assert isinstance(remote, RemoteFile)
 
-        local_time = local.date_modified.replace(tzinfo=iso8601.iso8601.Utc())
+        # the modification time of the file itself, File.date_modified also changes with every update of the row
+        if local.mtime_ns is None:
+            local.update_stat()
+        if local.mtime_ns is None:  # file is gone locally
+            local_time = datetime.datetime.min.replace(tzinfo=iso8601.iso8601.Utc())
+        else:
+            local_time = datetime.datetime.fromtimestamp(local.mtime_ns / 10 ** 9, tz=iso8601.iso8601.Utc())
         # NOTE; waterbutler does NOT update time when a file or folder is RENAMED.
         # thus cannot accurately determine when file/folder was renamed.
         # thus, going to have to go with local is pretty much always newer.
@@ -734,8 +1195,9 @@ class Poll(object):
     def _ensure_components_folder(self, local_node):
         assert isinstance(local_node, Node)
         if local_node.child_nodes:
-            yield from self.queue.put(
+            yield from self.enqueue(
                 CreateFolder(
                     os.path.join(local_node.path, 'Components')
-                )
+                ),
+                local_node
             )
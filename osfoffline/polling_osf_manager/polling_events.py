@@ -1,3 +1,6 @@
+import functools
+import glob
+import hashlib
 import os
 import shutil
 import asyncio
@@ -5,25 +8,53 @@ import logging
 
 import aiohttp
 
+from osfoffline.exceptions.poll_exceptions import DownloadFailed
 from osfoffline.utils.path import ProperPath
-from osfoffline.polling_osf_manager.osf_query import OSFQuery
+from osfoffline.polling_osf_manager.osf_query import OSFQuery, OK, PARTIAL_CONTENT, RANGE_NOT_SATISFIABLE
+from osfoffline.polling_osf_manager.transfer import TransferProgress, preallocate, stream_to_file
+from osfoffline.polling_osf_manager import bandwidth
+from osfoffline.filesystem_manager import self_writes
+from osfoffline.settings import DOWNLOAD_PART_SUFFIX, DOWNLOAD_PREALLOCATE, TRANSFER_READ_TIMEOUT
 import osfoffline.alerts as AlertHandler
 
+# number of md5 hex digits naming the version a .part file belongs to
+PART_VERSION_LENGTH = 16
+# a preallocated .part file has its full size until the download stops, the number of bytes written to it so far is
+# kept in a file named after it with this suffix
+PART_LENGTH_SUFFIX = '.length'
+
 
 class PollingEvent(object):
     def __init__(self):
         pass
 
+    @property
+    def paths(self):
+        """Local paths this event touches. Events sharing a path or subtree are never run at the same time."""
+        return ()
+
+    @property
+    def size(self):
+        """Number of bytes transferred by this event, None when it does not transfer a file"""
+        return None
+
     @asyncio.coroutine
     def run(self):
         pass
 
+    def __repr__(self):
+        return '<{} {}>'.format(self.__class__.__name__, ' -> '.join(self.paths))
+
 
 class CreateFolder(PollingEvent):
     def __init__(self, path):
         super().__init__()
         self.path = path
 
+    @property
+    def paths(self):
+        return (self.path,)
+
     @asyncio.coroutine
     def run(self):
         # create local node folder on filesystem
@@ -36,7 +67,8 @@ class CreateFolder(PollingEvent):
         if not os.path.exists(folder_to_create.full_path):
             AlertHandler.info(folder_to_create.name, AlertHandler.DOWNLOAD)
             try:
-                os.makedirs(folder_to_create.full_path)
+                with self_writes.writing(folder_to_create.full_path, self_writes.CREATED):
+                    os.makedirs(folder_to_create.full_path)
             except Exception:
                 # TODO: Narrow down this exception and do client side warnings
                 logging.exception('Exception caught: Problem making a directory.')
@@ -44,11 +76,21 @@ class CreateFolder(PollingEvent):
 
 
 class CreateFile(PollingEvent):
-    def __init__(self, path, download_url, osf_query):
+    def __init__(self, path, download_url, osf_query, size=None, md5=None):
         super().__init__()
         self.path = path
         self.osf_query = osf_query
         self.download_url = download_url
+        self._size = size
+        self.md5 = md5
+
+    @property
+    def paths(self):
+        return (self.path,)
+
+    @property
+    def size(self):
+        return self._size
 
     @asyncio.coroutine
     def run(self):
@@ -59,7 +101,9 @@ class CreateFile(PollingEvent):
             logging.exception('Exception caught: Invalid target path for new file.')
             return
         AlertHandler.info(new_file_path.name, AlertHandler.DOWNLOAD)
-        yield from _download_file(new_file_path, self.download_url, self.osf_query)
+        if not (yield from _download_file(new_file_path, self.download_url, self.osf_query, size=self.size,
+                                          md5=self.md5)):
+            raise DownloadFailed('Unable to download {}'.format(self.path))
 
 
 class RenameFolder(PollingEvent):
@@ -69,6 +113,10 @@ class RenameFolder(PollingEvent):
         self.old_path = old_path
         self.new_path = new_path
 
+    @property
+    def paths(self):
+        return (self.old_path, self.new_path)
+
     @asyncio.coroutine
     def run(self):
         try:
@@ -95,6 +143,10 @@ class RenameFile(PollingEvent):
         self.old_path = old_path
         self.new_path = new_path
 
+    @property
+    def paths(self):
+        return (self.old_path, self.new_path)
+
     @asyncio.coroutine
     def run(self):
         try:
@@ -115,11 +167,21 @@ class RenameFile(PollingEvent):
 
 
 class UpdateFile(PollingEvent):
-    def __init__(self, path, download_url, osf_query):
+    def __init__(self, path, download_url, osf_query, size=None, md5=None):
         super().__init__()
         self.path = path
         self.osf_query = osf_query
         self.download_url = download_url
+        self._size = size
+        self.md5 = md5
+
+    @property
+    def paths(self):
+        return (self.path,)
+
+    @property
+    def size(self):
+        return self._size
 
     @asyncio.coroutine
     def run(self):
@@ -136,7 +198,9 @@ class UpdateFile(PollingEvent):
             logging.exception('Exception caught: Invalid target path for updated file.')
             return
         AlertHandler.info(updated_file_path.name, AlertHandler.MODIFYING)
-        yield from _download_file(updated_file_path, self.download_url, self.osf_query)
+        if not (yield from _download_file(updated_file_path, self.download_url, self.osf_query, size=self.size,
+                                          md5=self.md5)):
+            raise DownloadFailed('Unable to download {}'.format(self.path))
 
 
 class DeleteFolder(PollingEvent):
@@ -144,6 +208,10 @@ class DeleteFolder(PollingEvent):
         super().__init__()
         self.path = path
 
+    @property
+    def paths(self):
+        return (self.path,)
+
     @asyncio.coroutine
     def run(self):
         try:
@@ -155,10 +223,11 @@ class DeleteFolder(PollingEvent):
 
         AlertHandler.info(folder_to_delete.name, AlertHandler.DELETING)
         try:
-            shutil.rmtree(
-                folder_to_delete.full_path,
-                onerror=lambda a, b, c: logging.warning('local node not deleted because it does not exist.')
-            )
+            with self_writes.writing(folder_to_delete.full_path, self_writes.DELETED):
+                shutil.rmtree(
+                    folder_to_delete.full_path,
+                    onerror=lambda a, b, c: logging.warning('local node not deleted because it does not exist.')
+                )
         except Exception:
             # TODO: Narrow down this exception and do client side warnings
             logging.exception('Exception caught: Problem removing the tree.')
@@ -170,57 +239,245 @@ class DeleteFile(PollingEvent):
         super().__init__()
         self.path = path
 
+    @property
+    def paths(self):
+        return (self.path,)
+
     @asyncio.coroutine
     def run(self):
         file_to_delete = ProperPath(self.path, is_dir=False)
         AlertHandler.info(file_to_delete.name, AlertHandler.DELETING)
         try:
-            os.remove(file_to_delete.full_path)
+            with self_writes.writing(file_to_delete.full_path, self_writes.DELETED):
+                os.remove(file_to_delete.full_path)
         except FileNotFoundError:
             logging.warning(
                 'file not deleted because does not exist on local filesystem. inside delete_local_file_folder (2)')
 
 
 @asyncio.coroutine
-def _download_file(path, url, osf_query):
+def _download_file(path, url, osf_query, size=None, md5=None):
+    """
+    Download url into a .part file next to path and move it into place once complete. If a .part file was left
+    behind by an interrupted download of the same version, only the missing bytes are requested with a Range header.
+
+    :param size: expected size of the file in bytes, if known
+    :param md5: md5 of the expected content, if known. Partial downloads are only resumed when it is, it names the
+        version a .part file belongs to and the finished download is checked against it.
+    """
     if not isinstance(path, ProperPath):
         logging.error("New file path is not a ProperPath.")
         return
     if not isinstance(url, str):
         logging.error("New file URL is not a string.")
         return
+
+    part_path = _part_path(path.full_path, md5)
+    _remove_stale_parts(path.full_path, keep=part_path)
+    offset = _resume_offset(part_path, size, md5)
+
+    # the transfer slot is held until the whole body has been read
+    with (yield from osf_query.transfer_slot()):
+        progress = yield from _fetch_part(path, url, osf_query, part_path, offset, size)
+    if progress is None:
+        return
+    if not _finish_download(path, part_path, progress.transferred, size, md5):
+        return
+    progress.finish()
+    return True
+
+
+@asyncio.coroutine
+def _fetch_part(path, url, osf_query, part_path, offset, size):
+    """Download url into part_path from offset on. Returns the TransferProgress, None if the download failed."""
+    resp = yield from _request_download(path, url, osf_query, offset)
+    if resp is not None and offset and resp.status == RANGE_NOT_SATISFIABLE:
+        logging.info('Server rejected the range request for {}, downloading it again'.format(path.name))
+        yield from resp.release()
+        _remove_part(part_path)
+        offset = 0
+        resp = yield from _request_download(path, url, osf_query, offset)
+    if resp is None:
+        return None
+    if offset and resp.status != PARTIAL_CONTENT:
+        logging.info('Server ignored the range request for {}, downloading it again'.format(path.name))
+        offset = 0
+
+    progress = TransferProgress(path.name, AlertHandler.DOWNLOAD, total=size, offset=offset)
+    if not (yield from _write_part(resp, part_path, offset, size, progress)):
+        return None
+    return progress
+
+
+@asyncio.coroutine
+def _request_download(path, url, osf_query, offset):
+    """Request the file contents from offset on. Returns the response, None if the request failed."""
+    # ranges refer to the bytes of the stored file, not of a compressed transfer
+    headers = {'Accept-Encoding': 'identity'}
+    expects = None
+    if offset:
+        headers['Range'] = 'bytes={}-'.format(offset)
+        expects = (OK, PARTIAL_CONTENT, RANGE_NOT_SATISFIABLE)
     try:
-        resp = yield from osf_query.make_request(url)
+        return (yield from osf_query.make_request(url, headers=headers, expects=expects, slot_held=True))
+    except asyncio.CancelledError:
+        raise
     except (aiohttp.errors.ClientOSError):
         AlertHandler.warn("Please install operating system updates")
         logging.exception("SSL certificate error")
-        return
     except (aiohttp.errors.ClientConnectionError, aiohttp.errors.ClientTimeoutError):
         # FIXME: Consolidate redundant messages
         AlertHandler.warn("Bad Internet Connection")
         logging.exception("Bad Internet Connection")
-        return
     except (aiohttp.errors.HttpMethodNotAllowed, aiohttp.errors.BadHttpMessage):
         AlertHandler.warn("Do not have access to file.")
         logging.exception("Do not have access to file.")
-        return
     except aiohttp.errors.HttpBadRequest:
         AlertHandler.warn("Problem accessing file.")
         logging.exception("Exception caught downloading file.")
-        return
     except Exception:
         logging.exception("Exception caught: problem downloading file.")
-        return
+    return None
+
+
+@asyncio.coroutine
+def _write_part(resp, part_path, offset, size, progress):
+    """Stream the response body into part_path from offset on. Returns whether the whole body was written."""
     try:
-        with open(path.full_path, 'wb') as fd:
-            while True:
-                chunk = yield from resp.content.read(2048)
-                if not chunk:
-                    break
-                fd.write(chunk)
+        with open(part_path, 'r+b' if offset else 'wb') as fd:
+            fd.seek(offset)
+            on_write = None
+            if DOWNLOAD_PREALLOCATE and size:
+                # should the app be killed before the file is truncated below, this tells where to resume
+                _save_part_length(part_path, offset)
+                preallocate(fd, size)
+                on_write = functools.partial(_save_part_length, part_path, offset=offset)
+            try:
+                yield from stream_to_file(resp.content, fd, progress=progress,
+                                          throttle=bandwidth.limiter.throttle_download,
+                                          read_timeout=TRANSFER_READ_TIMEOUT, on_write=on_write)
+            finally:
+                # drop the preallocated tail (or any stale bytes) so the .part file ends where the data does
+                fd.truncate()
+                _remove_file(_part_length_path(part_path))
+        yield from resp.release()
+    except asyncio.CancelledError:
+        # stopped, the connection is in an unknown state
+        resp.close()
+        raise
+    except (aiohttp.errors.ClientError, asyncio.TimeoutError):
+        # keep the .part file, the next attempt continues where this one stopped. Handled before OSError, which
+        # some of these derive from.
         resp.close()
+        AlertHandler.warn("Bad Internet Connection")
+        logging.exception('Download to {} interrupted after {} bytes'.format(part_path, progress.transferred))
+        return False
+    except OSError:
+        resp.close()
+        AlertHandler.warn("unable to open file")
+        logging.exception('Unable to write download to {}'.format(part_path))
+        return False
+    return True
+
+
+def _finish_download(path, part_path, transferred, size, md5):
+    """Check the complete .part file and move it into place. Returns whether the file was replaced."""
+    if size is not None and transferred != size:
+        logging.warning('Downloaded {} bytes of {} but expected {}, keeping the partial file'.format(
+            transferred, path.name, size))
+        return False
+    if md5 is not None and _file_md5(part_path) != md5:
+        logging.warning('Download of {} does not match the checksum reported by the OSF, discarding it'.format(
+            path.name))
+        _remove_part(part_path)
+        return False
+
+    try:
+        # the watcher sees the move out of the .part file as a modification of the file
+        with self_writes.writing(path.full_path, self_writes.MODIFIED):
+            os.replace(part_path, path.full_path)
     except OSError:
         AlertHandler.warn("unable to open file")
+        logging.exception('Unable to move downloaded file into place: {}'.format(path.full_path))
+        return False
+    return True
+
+
+def _part_path(full_path, md5):
+    """Where a download of full_path is staged. The version, when known, is part of the name."""
+    if md5 is None:
+        return full_path + DOWNLOAD_PART_SUFFIX
+    return '{}.{}{}'.format(full_path, md5[:PART_VERSION_LENGTH], DOWNLOAD_PART_SUFFIX)
+
+
+def _remove_stale_parts(full_path, keep):
+    """Remove .part files of full_path that belong to other versions, they must never be resumed"""
+    pattern = glob.escape(full_path) + '.' + '[0-9a-f]' * PART_VERSION_LENGTH + DOWNLOAD_PART_SUFFIX
+    for part_path in glob.glob(pattern) + [full_path + DOWNLOAD_PART_SUFFIX]:
+        if part_path != keep:
+            _remove_part(part_path)
+
+
+def _remove_part(part_path):
+    _remove_file(part_path)
+    _remove_file(_part_length_path(part_path))
+
+
+def _remove_file(file_path):
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        logging.exception('Unable to remove partial download {}'.format(file_path))
+
+
+def _part_length_path(part_path):
+    return part_path + PART_LENGTH_SUFFIX
+
+
+def _save_part_length(part_path, length, offset=0):
+    with open(_part_length_path(part_path), 'w') as fd:
+        fd.write(str(offset + length))
+
+
+def _saved_part_length(part_path):
+    """Bytes written to a preallocated part_path that was never truncated, None if it was not preallocated"""
+    try:
+        with open(_part_length_path(part_path)) as fd:
+            return int(fd.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        # cut short while it was written, trust none of the part
+        return 0
+
+
+def _resume_offset(part_path, size, md5):
+    """Number of bytes of a previous download already in part_path, 0 when the download has to start over"""
+    if md5 is None:
+        # nothing tells which version the bytes belong to
+        return 0
+    try:
+        offset = os.path.getsize(part_path)
+    except OSError:
+        return 0
+    saved_length = _saved_part_length(part_path)
+    if saved_length is not None:
+        # the download was killed while the file still had its preallocated size
+        offset = min(offset, saved_length)
+    if size is not None and offset >= size:
+        # either complete but never moved into place or not the file we expect, cheaper to start over
+        return 0
+    return offset
+
+
+def _file_md5(file_path, block_size=2 ** 20):
+    m = hashlib.md5()
+    with open(file_path, 'rb') as fd:
+        for block in iter(lambda: fd.read(block_size), b''):
+            m.update(block)
+    return m.hexdigest()
 
 
 @asyncio.coroutine
@@ -231,6 +488,7 @@ def _rename(old_path, new_path):
         logging.error("Old path for rename is not a ProperPath.")
     try:
         AlertHandler.info(new_path.name, AlertHandler.MODIFYING)
-        os.renames(old_path.full_path, new_path.full_path)
+        with self_writes.writing(old_path.full_path, self_writes.MOVED):
+            os.renames(old_path.full_path, new_path.full_path)
     except FileNotFoundError:
         logging.warning('renaming of file/folder failed because file/folder not there')
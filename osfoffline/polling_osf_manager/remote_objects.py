@@ -104,6 +104,9 @@ class RemoteFile(RemoteFileFolder):
         self.overwrite_url = remote_dict['links']['upload']
         self.size = remote_dict['attributes']['size']
         self.last_modified_string = remote_dict['attributes'].get('date_modified')
+        # checksums of the stored content, e.g. {'md5': ..., 'sha256': ...}. not every provider reports them.
+        extra = remote_dict['attributes'].get('extra') or {}
+        self.hashes = extra.get('hashes') or {}
 
         self.validate()
 
@@ -115,6 +118,10 @@ class RemoteFile(RemoteFileFolder):
         """
         return remote_to_local_datetime(self.last_modified_string)
 
+    @property
+    def md5(self):
+        return self.hashes.get('md5')
+
     def validate(self):
         super().validate()
         assert self.download_url
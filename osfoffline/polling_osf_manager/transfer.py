@@ -0,0 +1,157 @@
+"""
+Helpers shared by file uploads and downloads: progress reporting and streaming file bodies.
+"""
+import asyncio
+import logging
+import os
+import time
+
+import osfoffline.alerts as AlertHandler
+from osfoffline import metrics
+from osfoffline.settings import UPLOAD_CHUNK_SIZE, DOWNLOAD_BUFFER_SIZE
+
+
+logger = logging.getLogger(__name__)
+
+
+class TransferProgress(object):
+    """
+    Tracks the bytes moved by a single upload or download.
+
+    Progress is published to the metrics registry and shown in the tray menu (in steps of ``alert_step`` percent),
+    and the achieved throughput is logged once the transfer is finished. A transfer resumed part way through starts
+    at ``offset``; those bytes count towards the percentage but not towards the throughput.
+    """
+
+    def __init__(self, name, action, total=None, alert_step=10, offset=0):
+        assert action in (AlertHandler.UPLOAD, AlertHandler.DOWNLOAD, AlertHandler.MODIFYING)
+        self.name = name
+        self.action = action
+        self.total = total
+        self.alert_step = alert_step
+        self.offset = offset
+        self.transferred = offset
+        self.started = time.time()
+        self.finished = None
+        self._last_alerted_step = None
+
+    @property
+    def direction(self):
+        return 'uploads' if self.action == AlertHandler.UPLOAD else 'downloads'
+
+    @property
+    def seconds(self):
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def bytes_per_second(self):
+        return (self.transferred - self.offset) / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def percent(self):
+        if not self.total:
+            return None
+        return min(100, int(100 * self.transferred / self.total))
+
+    def update(self, byte_count):
+        self.transferred += byte_count
+        metrics.increment('bytes.{}'.format(self.direction), byte_count)
+
+        percent = self.percent
+        if percent is not None and percent // self.alert_step != self._last_alerted_step:
+            self._last_alerted_step = percent // self.alert_step
+            AlertHandler.progress(self.name, self.action, percent)
+
+    def finish(self):
+        self.finished = time.time()
+        metrics.record_time('transfers.{}'.format(self.direction), self.seconds)
+        logger.info('{} {}: {} bytes in {:.1f}s ({:.2f} MB/s)'.format(
+            self.direction, self.name, self.transferred - self.offset, self.seconds, self.bytes_per_second / 2 ** 20))
+
+
+@asyncio.coroutine
+def file_sender(file, size, chunk_size=UPLOAD_CHUNK_SIZE, progress=None, throttle=None):
+    """
+    Request body streaming an open binary file in chunks, so uploads run in constant memory.
+
+    At most size bytes are sent, matching the Content-Length announced for the request. The file is closed as soon
+    as the body is exhausted or the request is abandoned. throttle is a coroutine function given the size of every
+    chunk before it is sent, e.g. ``bandwidth.limiter.throttle_upload``.
+    """
+    remaining = size
+    try:
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            if throttle:
+                yield from throttle(len(chunk))
+            yield chunk
+            if progress:
+                progress.update(len(chunk))
+    finally:
+        file.close()
+
+
+def preallocate(file, size):
+    """
+    Reserve size bytes for an open binary file up front so the file system can lay it out in one piece.
+
+    The file is extended to size; callers truncate it to the bytes actually written if the transfer stops early.
+    """
+    file.flush()
+    try:
+        os.posix_fallocate(file.fileno(), 0, size)
+    except AttributeError:
+        # not available on Windows and OS X, setting the end of file reserves the space there as well
+        file.truncate(size)
+    except OSError:
+        # file system does not support it, the file simply grows as it is written
+        logger.debug('Unable to preallocate {} bytes for {}'.format(size, file.name))
+
+
+@asyncio.coroutine
+def stream_to_file(content, file, buffer_size=DOWNLOAD_BUFFER_SIZE, progress=None, throttle=None, read_timeout=None,
+                   on_write=None):
+    """
+    Copy a response body into an open binary file, returning the number of bytes written.
+
+    Network reads are collected in a single reusable buffer which is written out whenever it is full, so the file
+    receives a few large writes instead of one per network read. The response still hands out every read as a new
+    bytes object, which is copied into the buffer. Whatever is buffered is still written if reading fails, so an
+    interrupted download can be resumed from the end of the file.
+    throttle is a coroutine function given the size of every chunk read, e.g. ``bandwidth.limiter.throttle_download``.
+    read_timeout is the number of seconds a single read may wait for data before asyncio.TimeoutError is raised, time
+    spent in throttle does not count. on_write is called with the number of bytes written so far every time a full
+    buffer has been written.
+    """
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    filled = written = 0
+    try:
+        while True:
+            read = content.read(buffer_size - filled)
+            if read_timeout is not None:
+                read = asyncio.wait_for(read, read_timeout)
+            chunk = yield from read
+            if not chunk:
+                break
+            view[filled:filled + len(chunk)] = chunk
+            filled += len(chunk)
+            if progress:
+                progress.update(len(chunk))
+            if throttle:
+                yield from throttle(len(chunk))
+            if filled == buffer_size:
+                file.write(view)
+                written += filled
+                filled = 0
+                if on_write:
+                    on_write(written)
+    finally:
+        if filled:
+            file.write(view[:filled])
+            written += filled
+        view.release()
+    return written
@@ -21,9 +21,12 @@ except ImportError:
 # Variables used to control where application config data is stored
 PROJECT_DB_DIR = user_data_dir(appname=PROJECT_NAME, appauthor=PROJECT_AUTHOR)
 PROJECT_DB_FILE = os.path.join(PROJECT_DB_DIR, 'osf.db')
+PROJECT_LISTING_CACHE_FILE = os.path.join(PROJECT_DB_DIR, 'listing_cache')
+POLL_CHECKPOINT_FILE = os.path.join(PROJECT_DB_DIR, 'poll_checkpoint.json')
 
 PROJECT_LOG_DIR = user_log_dir(appname=PROJECT_NAME, appauthor=PROJECT_AUTHOR)
 PROJECT_LOG_FILE = os.path.join(PROJECT_LOG_DIR, 'osfoffline.log')
+POLL_REPORT_FILE = os.path.join(PROJECT_LOG_DIR, 'poll_report.json')
 
 
 # Ensure that storage directories are created when application starts
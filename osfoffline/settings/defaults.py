@@ -13,8 +13,103 @@ APPLICATION_SCOPES = 'osf.full_write'
 API_BASE = 'https://test-api.osf.io'
 FILE_BASE = 'https://test-files.osf.io'
 
-# Interval (in seconds) to poll the OSF for server-side file changes
+# Interval (in seconds) to poll the OSF for server-side file changes. Each project is polled on its own schedule:
+# every POLL_MIN_DELAY seconds while it keeps changing, backing off to at most every POLL_DELAY seconds when it does not.
 POLL_DELAY = 24 * 60 * 60  # Once per day
+POLL_MIN_DELAY = 5 * 60
+# Fraction by which poll intervals are randomly shortened or lengthened
+POLL_JITTER = 0.1
+# Seconds between checks for local changes while waiting for the next poll. Local changes start a poll right away.
+POLL_LOCAL_CHANGES_INTERVAL = 10
+
+# Number of node/folder subtrees checked concurrently during a poll, across all levels of the tree. 1 walks the tree
+# serially.
+POLL_TRAVERSAL_FAN_OUT = 5
+
+# Number of workers running downloads, renames and deletes found by the poller in parallel
+POLL_EVENT_WORKERS = 4
+
+# Events the poller may queue ahead of the workers. Every event running longer than EVENT_QUEUE_SLOW_EVENT_SECONDS
+# makes room for another EVENT_QUEUE_SIZE events, up to EVENT_QUEUE_MAX_SIZE. Only running events can be slow, so
+# the bound never grows past EVENT_QUEUE_SIZE * (1 + POLL_EVENT_WORKERS); this one is reached with three slow events.
+EVENT_QUEUE_SIZE = 15
+EVENT_QUEUE_MAX_SIZE = 60
+EVENT_QUEUE_SLOW_EVENT_SECONDS = 10
+
+# Order in which queued events are run, lowest first. Cheap metadata operations go before file transfers.
+EVENT_PRIORITIES = {
+    'CreateFolder': 0,
+    'RenameFolder': 0,
+    'RenameFile': 0,
+    'DeleteFolder': 0,
+    'DeleteFile': 0,
+    'CreateFile': 1,
+    'UpdateFile': 1,
+}
+# Added to the priority of a file transfer: (largest size in bytes, extra priority). None matches any size.
+EVENT_SIZE_BUCKETS = [
+    (1024 * 1024, 0),
+    (100 * 1024 * 1024, 1),
+    (None, 2),
+]
+# Seconds an event waits in the queue to gain one priority level, so large transfers are never starved
+EVENT_PRIORITY_AGING_SECONDS = 60
+
+# Bytes read from disk and sent at a time when uploading a file
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Downloads are collected in a buffer of this many bytes before being written to disk
+DOWNLOAD_BUFFER_SIZE = 1024 * 1024
+# Reserve the full size of a download on disk before writing it
+DOWNLOAD_PREALLOCATE = True
+
+# Concurrent api requests and their timeouts in seconds. File contents (downloads and uploads) have their own
+# limit so large transfers do not stall metadata requests.
+METADATA_REQUEST_LIMIT = 5
+METADATA_REQUEST_TIMEOUT = 180
+TRANSFER_REQUEST_LIMIT = 3
+TRANSFER_REQUEST_TIMEOUT = 60 * 60
+# Seconds a download may go without receiving any data before it is abandoned. The download as a whole has no time
+# limit, with a bandwidth limit a large file takes as long as it takes.
+TRANSFER_READ_TIMEOUT = 60
+
+# Connection pool used for all api requests. Idle connections are kept open for the keepalive timeout so following
+# requests skip the TCP and TLS handshakes.
+CONNECTION_LIMIT_PER_HOST = METADATA_REQUEST_LIMIT + TRANSFER_REQUEST_LIMIT
+CONNECTION_KEEPALIVE_TIMEOUT = 60
+CONNECTION_TIMEOUT = 30
+DNS_CACHE_SECONDS = 10 * 60
+
+# Seconds after the poller changed a local file during which the watcher ignores events for it
+SELF_WRITE_EXPIRY = 5
+
+# Bandwidth limits in bytes per second, None for unlimited
+BANDWIDTH_UPLOAD_LIMIT = None
+BANDWIDTH_DOWNLOAD_LIMIT = None
+# Different limits during parts of the day: [('HH:MM', 'HH:MM', upload limit, download limit), ...]
+BANDWIDTH_SCHEDULE = []
+
+# Downloads are written next to their target with this suffix and only moved into place once complete
+DOWNLOAD_PART_SUFFIX = '.osfoffline.part'
+
+# Number of database changes the poller collects before committing them in one transaction
+DB_BATCH_SIZE = 500
+
+# Number of idle database connections kept open for reuse, one for each thread that uses the database is enough
+DB_POOL_SIZE = 4
+
+# sqlite page cache and memory mapped i/o per open connection, in bytes
+DB_CACHE_SIZE = 16 * 1024 * 1024
+DB_MMAP_SIZE = 64 * 1024 * 1024
+
+# Seconds to wait before polling again after a poll failed
+POLL_RESTART_DELAY = 5
+
+# Seconds after which the checkpoint of an interrupted poll is too old to resume from
+POLL_CHECKPOINT_MAX_AGE = 6 * 60 * 60
+
+# Number of poll cycles kept in the poll report written to the log directory
+POLL_REPORT_HISTORY = 50
 
 # Time to keep alert messages on screen (in milliseconds); may not be configurable on all platforms
 ALERT_TIME = 1000  # ms
@@ -1,5 +1,6 @@
 # Interval (in seconds) to poll the OSF for server-side file changes
 POLL_DELAY = 5  # seconds
+POLL_MIN_DELAY = 5  # seconds
 
 LOG_LEVEL = 'DEBUG'
 
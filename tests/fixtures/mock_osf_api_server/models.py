@@ -268,6 +268,14 @@ class File(Base):
             assert self.files == []
         return files
 
+    @property
+    def hashes(self):
+        contents = self.contents.encode('utf-8') if isinstance(self.contents, str) else self.contents or b''
+        return {
+            'md5': hashlib.md5(contents).hexdigest(),
+            'sha256': hashlib.sha256(contents).hexdigest()
+        }
+
     @validates('contents')
     def validate_contents(self, key, contents):
         if self.is_folder:
@@ -285,8 +293,10 @@ class File(Base):
                 "path": self.path,
                 "provider": "osfstorage",
                 "last_touched": None,
-                "size": len(self.contents) if self.is_file else None
-
+                "size": len(self.contents) if self.is_file else None,
+                "extra": {
+                    "hashes": self.hashes
+                } if self.is_file else {}
             },
             "relationships": {
                 "checkout": {
@@ -1,4 +1,7 @@
 from tests.fixtures.mock_osf_api_server.models import User, Node, File
+import gzip
+import zlib
+import iso8601
 from flask import Flask, jsonify, request, make_response
 from tests.fixtures.mock_osf_api_server.utils import (
     session,
@@ -9,15 +12,38 @@ from tests.fixtures.mock_osf_api_server.utils import (
 
 
 app = Flask(__name__)
+# compress json responses for clients that accept it. switch off to compare against uncompressed transfers.
+app.config['COMPRESS_RESPONSES'] = True
+
+
+@app.after_request
+def compress_response(response):
+    accepted = request.headers.get('Accept-Encoding', '')
+    if (not app.config['COMPRESS_RESPONSES'] or response.status_code != 200 or response.direct_passthrough or
+            response.mimetype != 'application/json' or 'Content-Encoding' in response.headers):
+        return response
+    if 'gzip' in accepted:
+        response.set_data(gzip.compress(response.get_data()))
+        response.headers['Content-Encoding'] = 'gzip'
+    elif 'deflate' in accepted:
+        response.set_data(zlib.compress(response.get_data()))
+        response.headers['Content-Encoding'] = 'deflate'
+    else:
+        return response
+    response.headers['Content-Length'] = len(response.get_data())
+    response.vary.add('Accept-Encoding')
+    return response
 
 
 def paginate_response(data):
     """
     obviously this is only a start. Will handle pagination properly when time comes.
+    Responses carry an ETag and, when the data has modification dates, a Last-Modified header so that
+    conditional requests (If-None-Match/If-Modified-Since) are answered with 304 Not Modified.
     :param data:
     :return:
     """
-    return jsonify({
+    response = jsonify({
         "data":data,
         "links": {
             "first": None,
@@ -30,6 +56,21 @@ def paginate_response(data):
             }
         }
     })
+    response.add_etag()
+    last_modified = _last_modified(data)
+    if last_modified:
+        response.last_modified = last_modified
+    return response.make_conditional(request)
+
+
+def _last_modified(data):
+    items = data if isinstance(data, list) else [data]
+    dates = [
+        iso8601.parse_date(item['attributes']['date_modified'])
+        for item in items
+        if item.get('attributes', {}).get('date_modified')
+    ]
+    return max(dates) if dates else None
 
 
 @app.route("/v2/users/", methods=['POST']) # create user
@@ -0,0 +1,77 @@
+import datetime
+from unittest import TestCase
+
+from osfoffline.polling_osf_manager.bandwidth import BandwidthLimiter, TokenBucket
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_unlimited(self):
+        bucket = TokenBucket(None, clock=self.clock)
+        self.assertEqual(bucket.reserve(10 ** 9), 0.0)
+
+    def test_burst_then_wait(self):
+        bucket = TokenBucket(100, clock=self.clock)
+        self.assertEqual(bucket.reserve(100), 0.0)
+        self.assertAlmostEqual(bucket.reserve(50), 0.5)
+
+    def test_refills_over_time(self):
+        bucket = TokenBucket(100, clock=self.clock)
+        bucket.reserve(100)
+        self.clock.now = 0.5
+        self.assertEqual(bucket.reserve(50), 0.0)
+
+    def test_refill_is_capped_at_one_second(self):
+        bucket = TokenBucket(100, clock=self.clock)
+        self.clock.now = 60
+        self.assertAlmostEqual(bucket.reserve(200), 1.0)
+
+    def test_rate_change(self):
+        bucket = TokenBucket(100, clock=self.clock)
+        bucket.set_rate(10)
+        self.assertAlmostEqual(bucket.reserve(20), 1.0)
+        bucket.set_rate(None)
+        self.assertEqual(bucket.reserve(10 ** 9), 0.0)
+
+
+class TestBandwidthLimiter(TestCase):
+
+    def setUp(self):
+        self.moment = datetime.datetime(2015, 10, 1, 12, 0)
+        self.limiter = BandwidthLimiter(
+            upload=1000,
+            download=None,
+            schedule=[('08:00', '18:00', 10, 20), ('22:00', '06:00', None, 5)],
+            clock=FakeClock(),
+            now=lambda: self.moment
+        )
+
+    def test_schedule(self):
+        self.assertEqual(self.limiter.limits(), (10, 20))
+        self.assertEqual(self.limiter.limits(datetime.datetime(2015, 10, 1, 20, 0)), (1000, None))
+        self.assertEqual(self.limiter.limits(datetime.datetime(2015, 10, 1, 23, 0)), (None, 5))
+        self.assertEqual(self.limiter.limits(datetime.datetime(2015, 10, 2, 5, 59)), (None, 5))
+
+    def test_apply_follows_the_clock(self):
+        self.assertEqual(self.limiter.upload.rate, 10)
+        self.moment = datetime.datetime(2015, 10, 1, 20, 0)
+        self.limiter.apply()
+        self.assertEqual(self.limiter.upload.rate, 1000)
+        self.assertIsNone(self.limiter.download.rate)
+
+    def test_reconfigure(self):
+        self.limiter.configure(upload=None, download=300)
+        self.assertEqual(self.limiter.limits(), (None, 300))
+        self.assertEqual(self.limiter.download.rate, 300)
@@ -0,0 +1,98 @@
+import os
+import tempfile
+import threading
+from unittest import TestCase
+
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+from osfoffline.database_manager.db import create_db_engine
+from osfoffline.database_manager.models import Base, User
+from osfoffline.settings import DB_CACHE_SIZE, DB_MMAP_SIZE
+
+
+class TestDBEngine(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.engine = create_db_engine('sqlite:///{}'.format(os.path.join(self.folder.name, 'osf.db')))
+        Base.metadata.create_all(self.engine)
+        self.Session = scoped_session(sessionmaker(bind=self.engine))
+
+    def tearDown(self):
+        self.Session.remove()
+        self.engine.dispose()
+        self.folder.cleanup()
+
+    def pragma(self, connection, name):
+        return connection.execute('PRAGMA {}'.format(name)).scalar()
+
+    def in_threads(self, count, target):
+        errors = []
+
+        def run():
+            try:
+                target()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                self.Session.remove()
+
+        threads = [threading.Thread(target=run) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(errors, [])
+
+    def test_every_connection_is_configured(self):
+        for _ in range(2):
+            with self.engine.connect() as connection:
+                self.assertEqual(self.pragma(connection, 'journal_mode'), 'wal')
+                # NORMAL
+                self.assertEqual(self.pragma(connection, 'synchronous'), 1)
+                self.assertEqual(self.pragma(connection, 'cache_size'), -(DB_CACHE_SIZE // 1024))
+                self.assertEqual(self.pragma(connection, 'mmap_size'), DB_MMAP_SIZE)
+
+    def test_transactions_reuse_a_configured_connection(self):
+        session = self.Session()
+        connections = set()
+        for _ in range(3):
+            session.query(User).count()
+            connection = session.connection()
+            connections.add(id(connection.connection.connection))
+            # the cache settings are still in effect for the next transaction
+            self.assertEqual(self.pragma(connection, 'cache_size'), -(DB_CACHE_SIZE // 1024))
+            self.assertEqual(self.pragma(connection, 'mmap_size'), DB_MMAP_SIZE)
+            session.commit()
+        self.assertEqual(len(connections), 1)
+
+    def test_threads_work_on_their_own_session_and_connection(self):
+        # more threads than a pool would keep connections for
+        count = 8
+        barrier = threading.Barrier(count, timeout=10)
+        seen = []
+
+        def work():
+            session = self.Session()
+            session.query(User).count()
+            seen.append((id(session), id(session.connection().connection)))
+            # every thread holds its connection at the same time
+            barrier.wait()
+            session.query(User).count()
+
+        self.in_threads(count, work)
+        self.assertEqual(len(set(session_id for session_id, _ in seen)), count)
+        self.assertEqual(len(set(connection_id for _, connection_id in seen)), count)
+
+    def test_readers_are_not_blocked_by_a_writer(self):
+        writer = self.Session()
+        writer.add(User(full_name='Writer'))
+        writer.flush()
+        counts = []
+
+        self.in_threads(1, lambda: counts.append(self.Session().query(User).count()))
+        self.assertEqual(counts, [0])
+
+        writer.commit()
+        self.in_threads(1, lambda: counts.append(self.Session().query(User).count()))
+        self.assertEqual(counts, [0, 1])
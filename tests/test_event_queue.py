@@ -0,0 +1,148 @@
+import asyncio
+import random
+import time
+from unittest import TestCase, mock
+
+from osfoffline.polling_osf_manager.event_queue import EventQueue, paths_overlap, event_priority
+from osfoffline.polling_osf_manager.polling_events import CreateFile, CreateFolder, RenameFolder
+from osfoffline.settings import EVENT_QUEUE_SIZE, EVENT_QUEUE_MAX_SIZE, POLL_EVENT_WORKERS
+
+
+class TestPathsOverlap(TestCase):
+
+    def test_same_path(self):
+        self.assertTrue(paths_overlap('/osf/a', '/osf/a/'))
+
+    def test_parent_and_child(self):
+        self.assertTrue(paths_overlap('/osf/a', '/osf/a/b.txt'))
+        self.assertTrue(paths_overlap('/osf/a/b.txt', '/osf/a'))
+
+    def test_siblings_with_common_prefix(self):
+        self.assertFalse(paths_overlap('/osf/a', '/osf/ab'))
+        self.assertFalse(paths_overlap('/osf/a/b.txt', '/osf/a/c.txt'))
+
+
+class TestEventQueue(TestCase):
+
+    def setUp(self):
+        self._loop = asyncio.new_event_loop()
+        self.queue = EventQueue(self._loop, size=10, max_size=10)
+
+    def tearDown(self):
+        self._loop.close()
+
+    def run_coroutine(self, coroutine):
+        return self._loop.run_until_complete(coroutine)
+
+    def test_child_waits_for_parent(self):
+        self.run_coroutine(self.queue.put(CreateFolder('/osf/a')))
+        self.run_coroutine(self.queue.put(CreateFile('/osf/a/b.txt', 'http://localhost/b', None)))
+        parent = self.run_coroutine(self.queue.get())
+        child = self.run_coroutine(self.queue.get())
+        self.run_coroutine(self.queue.wait_turn(parent))
+
+        self.assertTrue(self.queue._blocked(child))
+        self.queue.task_done(parent)
+        self.assertFalse(self.queue._blocked(child))
+
+    def test_unrelated_paths_run_in_parallel(self):
+        self.run_coroutine(self.queue.put(RenameFolder('/osf/a', '/osf/b')))
+        self.run_coroutine(self.queue.put(CreateFolder('/osf/c')))
+        self.run_coroutine(self.queue.get())
+        other = self.run_coroutine(self.queue.get())
+        self.assertFalse(self.queue._blocked(other))
+
+    def test_join_waits_for_task_done(self):
+        self.run_coroutine(self.queue.put(CreateFolder('/osf/a')))
+        entry = self.run_coroutine(self.queue.get())
+        self.assertEqual(self.queue.unfinished(), 1)
+        self.queue.task_done(entry)
+        self.run_coroutine(self.queue.join())
+        self.assertEqual(self.queue.unfinished(), 0)
+
+    def test_metadata_before_large_download(self):
+        self.run_coroutine(self.queue.put(CreateFile('/osf/big.bin', 'http://localhost/big', None, size=2 ** 34)))
+        self.run_coroutine(self.queue.put(CreateFolder('/osf/c')))
+        self.assertIsInstance(self.run_coroutine(self.queue.get()).event, CreateFolder)
+
+    def test_priority_does_not_reorder_a_subtree(self):
+        self.run_coroutine(self.queue.put(CreateFile('/osf/a/big.bin', 'http://localhost/big', None, size=2 ** 34)))
+        self.run_coroutine(self.queue.put(RenameFolder('/osf/a', '/osf/b')))
+        self.assertIsInstance(self.run_coroutine(self.queue.get()).event, CreateFile)
+
+    def test_aging(self):
+        self.queue.aging_seconds = 1
+        with mock.patch('osfoffline.polling_osf_manager.event_queue.time.time', return_value=time.time() - 60):
+            self.run_coroutine(self.queue.put(CreateFile('/osf/big.bin', 'http://localhost/big', None, size=2 ** 34)))
+        self.run_coroutine(self.queue.put(CreateFolder('/osf/c')))
+        self.assertIsInstance(self.run_coroutine(self.queue.get()).event, CreateFile)
+
+    def test_discarded_batch_is_dropped(self):
+        self.run_coroutine(self.queue.put(CreateFolder('/osf/a'), batch=1))
+        self.run_coroutine(self.queue.put(CreateFolder('/osf/b'), batch=2))
+        self.run_coroutine(self.queue.put(CreateFolder('/osf/c'), batch=2))
+        taken = self.run_coroutine(self.queue.get())
+        self.queue.discard_batch(2)
+        self.assertEqual([entry.event.path for entry in self.queue._queued.values()], [])
+        self.assertEqual(taken.event.path, '/osf/a')
+        self.queue.task_done(taken)
+        self.run_coroutine(self.queue.join())
+
+    def test_requeued_event_of_a_discarded_batch_is_dropped(self):
+        self.run_coroutine(self.queue.put(CreateFolder('/osf/a'), batch=1))
+        self.run_coroutine(self.queue.put(CreateFolder('/osf/b'), batch=2))
+        first = self.run_coroutine(self.queue.get())
+        second = self.run_coroutine(self.queue.get())
+        self.queue.discard_batch(2)
+        self.queue.requeue(first)
+        self.queue.requeue(second)
+        self.assertEqual([entry.event.path for entry in self.queue._queued.values()], ['/osf/a'])
+        self.assertEqual(self.queue.unfinished(), 1)
+
+    def test_paths_are_compared_normalized(self):
+        self.run_coroutine(self.queue.put(CreateFolder('/osf/a/')))
+        self.run_coroutine(self.queue.put(CreateFile('/osf//a/b.txt', 'http://localhost/b', None)))
+        self.run_coroutine(self.queue.get())
+        child = self.run_coroutine(self.queue.get())
+        self.assertTrue(self.queue._blocked(child))
+
+    def test_max_size_can_be_reached(self):
+        # every worker adds room for EVENT_QUEUE_SIZE events at most once
+        self.assertLessEqual(EVENT_QUEUE_MAX_SIZE, EVENT_QUEUE_SIZE * (1 + POLL_EVENT_WORKERS))
+
+    def test_order_matches_comparing_every_pair(self):
+        """Events are handed out as if every queued event was compared with every earlier queued one"""
+        folders = ['/osf', '/osf/a', '/osf/a/b', '/osf/c', '/osf/c/d', '/osf/ab']
+        rng = random.Random(4)
+        queue = EventQueue(self._loop, size=1000, max_size=1000, aging_seconds=0)
+        queued = []  # (sequence, event) in the order they were queued
+        for sequence in range(300):
+            if rng.random() < 0.6:
+                folder = rng.choice(folders)
+                event = CreateFile('{}/{}.bin'.format(folder, rng.randint(0, 3)), 'http://localhost/f', None,
+                                   size=rng.choice([None, 10, 2 ** 34]))
+            elif rng.random() < 0.5:
+                event = CreateFolder(rng.choice(folders))
+            else:
+                event = RenameFolder(rng.choice(folders), rng.choice(folders))
+            self.run_coroutine(queue.put(event))
+            queued.append((sequence, event))
+
+        while queued:
+            candidates = [
+                (sequence, event) for index, (sequence, event) in enumerate(queued)
+                if not any(paths_overlap(path, other_path)
+                           for _, earlier in queued[:index] for path in event.paths for other_path in earlier.paths)
+            ]
+            expected = min(candidates, key=lambda candidate: (event_priority(candidate[1]), candidate[0]))
+            entry = self.run_coroutine(queue.get())
+            self.assertIs(entry.event, expected[1])
+            queued.remove(expected)
+            if rng.random() < 0.2:
+                # a stopped worker hands its event back
+                queue.requeue(entry)
+                queued.append(expected)
+                queued.sort(key=lambda item: item[0])
+            else:
+                queue.task_done(entry)
+        self.assertEqual(queue.unfinished(), 0)
@@ -0,0 +1,44 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from osfoffline.database_manager.models import File
+
+
+class TestFileStat(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'file.txt')
+        with open(self.path, 'wb') as fp:
+            fp.write(b'12345')
+        self.file = File(type=File.FILE, materialized_path=self.path)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_size_is_cached(self):
+        self.assertEqual(self.file.size, 5)
+        with open(self.path, 'ab') as fp:
+            fp.write(b'678')
+        self.assertEqual(self.file.size, 5)
+        self.file.update_stat()
+        self.assertEqual(self.file.size, 8)
+
+    def test_forget_stat(self):
+        self.file.update_stat()
+        with open(self.path, 'ab') as fp:
+            fp.write(b'678')
+        self.file.forget_stat()
+        self.assertEqual(self.file.size, 8)
+
+    def test_missing_file(self):
+        os.remove(self.path)
+        self.assertIsNone(self.file.update_stat())
+        self.assertEqual(self.file.size, 0)
+
+    def test_stat_matches(self):
+        stat = self.file.update_stat()
+        self.assertTrue(self.file.stat_matches(os.stat(self.path)))
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertFalse(self.file.stat_matches(os.stat(self.path)))
@@ -0,0 +1,43 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from osfoffline.polling_osf_manager.listing_cache import ListingCache
+
+
+class TestListingCache(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = ListingCache(os.path.join(self.cache_dir, 'listing_cache'))
+        self.url = 'http://localhost:8000/v2/nodes/1/files/osfstorage/'
+        self.body = {'data': [], 'links': {'next': None}}
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.cache_dir)
+
+    def test_store_and_get(self):
+        self.cache.store(self.url, '"abc"', None, self.body)
+        cached = self.cache.get(self.url)
+        self.assertEqual(cached.body, self.body)
+        self.assertEqual(cached.conditional_headers, {'If-None-Match': '"abc"'})
+
+    def test_both_validators(self):
+        self.cache.store(self.url, '"abc"', 'Wed, 21 Oct 2015 07:28:00 GMT', self.body)
+        self.assertEqual(self.cache.get(self.url).conditional_headers, {
+            'If-None-Match': '"abc"',
+            'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT'
+        })
+
+    def test_response_without_validators_is_not_cached(self):
+        self.cache.store(self.url, '"abc"', None, self.body)
+        self.cache.store(self.url, None, None, self.body)
+        self.assertIsNone(self.cache.get(self.url))
+
+    def test_persists_between_instances(self):
+        self.cache.store(self.url, '"abc"', None, self.body)
+        self.cache.close()
+        self.cache = ListingCache(os.path.join(self.cache_dir, 'listing_cache'))
+        self.assertEqual(self.cache.get(self.url).etag, '"abc"')
@@ -0,0 +1,64 @@
+import os
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from osfoffline.database_manager.models import Base, User, Node, File, below_path, path_key
+
+
+class TestMaterializedPath(TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.osf_folder = os.path.join(os.path.sep, 'home', 'osf')
+
+        self.user = User(full_name='Tester', osf_local_folder_path=self.osf_folder)
+        self.project = Node(title='project', osf_id='abc12', user=self.user)
+        self.user.nodes.append(self.project)
+        self.component = Node(title='component', osf_id='def34', user=self.user)
+        self.project.child_nodes.append(self.component)
+
+        self.provider = File(name=File.DEFAULT_PROVIDER, type=File.FOLDER, user=self.user, node=self.component)
+        self.folder = File(name='folder', type=File.FOLDER, user=self.user, node=self.component)
+        self.provider.files.append(self.folder)
+        self.file = File(name='file.txt', type=File.FILE, user=self.user, node=self.component)
+        self.folder.files.append(self.file)
+        self.session.add(self.user)
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def component_path(self, *names):
+        return os.path.join(
+            self.osf_folder, 'project - abc12', 'Components', 'component - def34', File.DEFAULT_PROVIDER, *names
+        )
+
+    def test_paths_are_stored(self):
+        self.assertEqual(self.file.materialized_path, self.component_path('folder', 'file.txt'))
+        self.assertEqual(self.file.path, self.file.build_path())
+        self.assertEqual(self.folder.path_key, path_key(self.component_path('folder')))
+
+    def test_rename_updates_descendants(self):
+        self.folder.name = 'renamed'
+        self.assertEqual(self.file.path, self.component_path('renamed', 'file.txt'))
+
+        self.project.title = 'new title'
+        self.assertEqual(self.file.path, self.file.build_path())
+        self.assertIn('new title - abc12', self.file.path)
+
+    def test_move_updates_path(self):
+        other = File(name='other', type=File.FOLDER, user=self.user, node=self.component)
+        self.provider.files.append(other)
+        self.file.parent = other
+        self.assertEqual(self.file.path, self.component_path('other', 'file.txt'))
+
+    def test_lookup_by_path(self):
+        self.session.commit()
+        found = self.session.query(File).filter(File.path_key == path_key(self.component_path('folder') + os.path.sep))
+        self.assertEqual(found.one(), self.folder)
+        below = self.session.query(File).filter(below_path(File, self.component_path())).all()
+        self.assertEqual(set(below), {self.folder, self.file})
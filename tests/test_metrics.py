@@ -0,0 +1,52 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from osfoffline.metrics import MetricsRegistry, difference, append_report
+from osfoffline.polling_osf_manager.api_url_builder import endpoint_type
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.report_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.report_dir)
+
+    def test_difference(self):
+        self.registry.increment('requests.nodes')
+        self.registry.record_time('events.queue_wait', 1.0)
+        before = self.registry.snapshot()
+        self.registry.increment('requests.nodes', 2)
+        self.registry.increment('requests.files')
+        self.registry.record_time('events.queue_wait', 3.0)
+        diff = difference(before, self.registry.snapshot())
+
+        self.assertEqual(diff['counters'], {'requests.nodes': 2, 'requests.files': 1})
+        self.assertEqual(diff['timings']['events.queue_wait'], {'count': 1, 'total': 3.0, 'average': 3.0})
+
+    def test_report_keeps_last_cycles(self):
+        path = os.path.join(self.report_dir, 'poll_report.json')
+        for cycle in range(5):
+            append_report(path, {'cycle': cycle}, keep=3)
+        with open(path) as fp:
+            self.assertEqual([report['cycle'] for report in json.load(fp)], [2, 3, 4])
+
+    def test_endpoint_type(self):
+        self.assertEqual(endpoint_type('http://localhost:8000/v2/users/5bqt9/nodes/'), 'users')
+        self.assertEqual(endpoint_type('http://localhost:8000/v2/nodes/abcde/children/'), 'children')
+        self.assertEqual(endpoint_type('http://localhost:8000/v2/nodes/abcde/files/osfstorage/'), 'files')
+        self.assertEqual(endpoint_type('http://localhost:7777/v1/resources/abcde/providers/osfstorage/123'), 'downloads')
+        self.assertEqual(
+            endpoint_type('http://localhost:7777/v1/resources/abcde/providers/osfstorage/', method='PUT'),
+            'uploads'
+        )
+        self.assertEqual(
+            endpoint_type('http://localhost:7777/v1/resources/abcde/providers/osfstorage/', method='PUT',
+                          params={'kind': 'folder', 'name': 'new folder'}),
+            'files'
+        )
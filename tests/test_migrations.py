@@ -0,0 +1,32 @@
+from unittest import TestCase
+
+from sqlalchemy import create_engine, inspect
+
+from osfoffline.database_manager.migrations import migrate
+from osfoffline.database_manager.models import Base
+
+
+class TestMigrations(TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        # a database from before sync_watermark and the file indexes existed
+        self.engine.execute('CREATE TABLE node (id INTEGER PRIMARY KEY, title VARCHAR, user_id INTEGER)')
+        Base.metadata.create_all(self.engine)
+        self.engine.execute('DROP INDEX ix_file_node_id_osf_path')
+
+    def test_missing_columns_are_added(self):
+        migrate(self.engine)
+        columns = {column['name'] for column in inspect(self.engine).get_columns('node')}
+        self.assertIn('sync_watermark', columns)
+        self.assertIn('path_key', columns)
+
+    def test_missing_indexes_are_added(self):
+        migrate(self.engine)
+        indexes = {index['name'] for index in inspect(self.engine).get_indexes('file')}
+        self.assertIn('ix_file_node_id_osf_path', indexes)
+        self.assertIn('ix_file_parent_id_name', indexes)
+
+    def test_migrating_twice_is_harmless(self):
+        migrate(self.engine)
+        migrate(self.engine)
@@ -0,0 +1,100 @@
+import asyncio
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from sqlalchemy.orm import sessionmaker
+from watchdog.events import FileModifiedEvent
+
+from osfoffline.database_manager.db import create_db_engine
+from osfoffline.database_manager.models import Base, User, Node, File, PendingOperation
+from osfoffline.database_manager.utils import UnitOfWork
+from osfoffline.filesystem_manager import osf_event_handler
+
+
+class TestOSFEventHandlerSession(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.folder = tempfile.TemporaryDirectory()
+        self.engine = create_db_engine('sqlite:///{}'.format(os.path.join(self.folder.name, 'osf.db')))
+        Base.metadata.create_all(self.engine)
+        self.session_factory = sessionmaker(bind=self.engine)
+
+        setup_session = self.session_factory()
+        user = User(full_name='Tester', logged_in=True, osf_local_folder_path=os.path.join(self.folder.name, 'OSF'))
+        node = Node(title='project', osf_id='nid', user=user)
+        local_file = File(name='a.txt', type=File.FILE, user=user, node=node, osf_path='/2')
+        node.files.append(local_file)
+        setup_session.add(user)
+        setup_session.commit()
+        self.osf_folder = user.osf_local_folder_path
+        self.file_path = local_file.path
+        os.makedirs(os.path.dirname(self.file_path))
+        with open(self.file_path, 'wb') as fp:
+            fp.write(b'edited')
+        setup_session.close()
+
+        with mock.patch.object(osf_event_handler, 'session_factory', self.session_factory):
+            self.handler = osf_event_handler.OSFEventHandler(self.osf_folder, self.loop)
+
+        # the poller collects a batch in a session of its own
+        self.poller_session = self.session_factory()
+        self.unit_of_work = UnitOfWork(self.poller_session)
+
+    def tearDown(self):
+        self.handler.close()
+        self.poller_session.close()
+        self.engine.dispose()
+        self.loop.close()
+        self.folder.cleanup()
+
+    def count(self, model):
+        session = self.session_factory()
+        try:
+            return session.query(model).count()
+        finally:
+            session.close()
+
+    def test_watcher_commits_only_its_own_changes(self):
+        user = self.poller_session.query(User).one()
+        self.unit_of_work.save(Node(title='half done', osf_id='other', user=user))
+
+        self.loop.run_until_complete(self.handler.on_modified(FileModifiedEvent(self.file_path)))
+        self.assertEqual(self.count(PendingOperation), 1)
+        self.assertEqual(self.count(Node), 1)
+
+        self.unit_of_work.rollback()
+        self.assertEqual(self.count(PendingOperation), 1)
+        self.assertEqual(self.count(Node), 1)
+
+    def test_poller_batch_and_watcher_changes_are_committed_independently(self):
+        user = self.poller_session.query(User).one()
+        self.unit_of_work.save(Node(title='batch', osf_id='other', user=user))
+
+        self.loop.run_until_complete(self.handler.on_modified(FileModifiedEvent(self.file_path)))
+        self.unit_of_work.commit()
+        self.assertEqual(self.count(PendingOperation), 1)
+        self.assertEqual(self.count(Node), 2)
+
+    def journal(self):
+        session = self.session_factory()
+        try:
+            return session.query(PendingOperation.id, PendingOperation.operation).order_by(PendingOperation.id).all()
+        finally:
+            session.close()
+
+    def test_repeated_changes_leave_a_single_entry(self):
+        for content in (b'first', b'second', b'third'):
+            with open(self.file_path, 'wb') as fp:
+                fp.write(content)
+            self.loop.run_until_complete(self.handler.on_modified(FileModifiedEvent(self.file_path)))
+        journal = self.journal()
+        self.assertEqual([operation for _, operation in journal], [PendingOperation.MODIFIED])
+
+    def test_replaced_entry_is_journaled_after_the_earlier_one(self):
+        self.loop.run_until_complete(self.handler.on_modified(FileModifiedEvent(self.file_path)))
+        (first_id, _), = self.journal()
+        self.loop.run_until_complete(self.handler.on_modified(FileModifiedEvent(self.file_path)))
+        (second_id, _), = self.journal()
+        self.assertGreater(second_id, first_id)
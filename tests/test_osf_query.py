@@ -1,8 +1,14 @@
 __author__ = 'himanshu'
 
-from unittest import TestCase
+import gzip
+import json
+from unittest import TestCase, mock
+
+import aiohttp
+
 from osfoffline.polling_osf_manager.remote_objects import RemoteFile,RemoteFileFolder,RemoteObject,RemoteFolder,RemoteNode,RemoteUser
-from osfoffline.polling_osf_manager.osf_query import OSFQuery
+from osfoffline import metrics
+from osfoffline.polling_osf_manager.osf_query import OSFQuery, METADATA_ACCEPT_ENCODING
 import asyncio
 from tests.utils.decorators import async
 from osfoffline.polling_osf_manager.api_url_builder import api_url_for, NODES, USERS, CHILDREN
@@ -22,4 +28,166 @@ class TestRemoteObjects(TestCase):
         url = api_url_for(NODES,related_type=CHILDREN, node_id=1)
         print(url)
         children = yield from self.osf_query._get_all_paginated_members(url)
-        self.assertEquals(children, [])
\ No newline at end of file
+        self.assertEquals(children, [])
+
+    def test_remaining_page_urls(self):
+        first_page = {
+            'data': [],
+            'links': {
+                'next': 'http://localhost:8000/v2/nodes/abcde/children/?page=2',
+                'meta': {'total': 25, 'per_page': 10}
+            }
+        }
+        self.assertEqual(self.osf_query._remaining_page_urls(first_page), [
+            'http://localhost:8000/v2/nodes/abcde/children/?page=2',
+            'http://localhost:8000/v2/nodes/abcde/children/?page=3',
+        ])
+
+    def test_remaining_page_urls_without_meta(self):
+        first_page = {
+            'data': [],
+            'links': {'next': 'http://localhost:8000/v2/nodes/abcde/children/?page=2'}
+        }
+        self.assertIsNone(self.osf_query._remaining_page_urls(first_page))
+
+    def test_remaining_page_urls_single_page(self):
+        self.assertEqual(self.osf_query._remaining_page_urls({'data': [], 'links': {'next': None}}), [])
+
+
+class FakeResponse(object):
+
+    def __init__(self, status=200, body=b'', headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+    @asyncio.coroutine
+    def read(self):
+        return self.body
+
+    @asyncio.coroutine
+    def release(self):
+        pass
+
+
+class FakeSessionTestCase(TestCase):
+    """OSFQuery whose requests are answered by self.responses, or with an empty 200 once they run out"""
+
+    METADATA_URL = 'http://localhost:8000/v2/nodes/abcde/files/osfstorage/'
+    DOWNLOAD_URL = 'http://localhost:7777/v1/resources/abcde/providers/osfstorage/123'
+
+    def setUp(self):
+        self._loop = asyncio.new_event_loop()
+        self.osf_query = OSFQuery(self._loop, 'token', limit=1, transfer_limit=1)
+        self.requested = []
+        self.request_headers = []
+        self.responses = []
+        self.osf_query.request_session.request = self.request
+
+    def tearDown(self):
+        self.osf_query.close()
+        self._loop.close()
+
+    @asyncio.coroutine
+    def request(self, url, headers=None, **kwargs):
+        self.requested.append(url)
+        self.request_headers.append(headers or {})
+        return self.responses.pop(0) if self.responses else FakeResponse()
+
+    def complete(self, coroutine, timeout=1):
+        return self._loop.run_until_complete(asyncio.wait_for(coroutine, timeout, loop=self._loop))
+
+
+class TestRequestLimits(FakeSessionTestCase):
+
+    def test_metadata_requests_do_not_wait_for_transfers(self):
+        self.complete(self.osf_query.transfer_throttler.acquire())
+        self.complete(self.osf_query.make_request(self.METADATA_URL))
+        self.assertEqual(self.requested, [self.METADATA_URL])
+
+    def test_downloads_wait_for_a_transfer_slot(self):
+        self.complete(self.osf_query.transfer_throttler.acquire())
+        with self.assertRaises(asyncio.TimeoutError):
+            self.complete(self.osf_query.make_request(self.DOWNLOAD_URL), timeout=0.05)
+        self.assertEqual(self.requested, [])
+
+        self.osf_query.transfer_throttler.release()
+        self.complete(self.osf_query.make_request(self.DOWNLOAD_URL))
+        self.assertEqual(self.requested, [self.DOWNLOAD_URL])
+
+    def test_transfer_slot_is_held_until_released_by_the_caller(self):
+        @asyncio.coroutine
+        def download():
+            with (yield from self.osf_query.transfer_slot()):
+                yield from self.osf_query.make_request(self.DOWNLOAD_URL, slot_held=True)
+                # the body is still to be read, no other transfer may start
+                self.assertTrue(self.osf_query.transfer_throttler.locked())
+        self.complete(download())
+        self.assertFalse(self.osf_query.transfer_throttler.locked())
+
+    def test_folder_creation_waits_for_a_metadata_slot(self):
+        self.complete(self.osf_query.transfer_throttler.acquire())
+        url = 'http://localhost:7777/v1/resources/abcde/providers/osfstorage/'
+        with mock.patch.object(self.osf_query, '_read_json', return_value=None):
+            self.complete(self.osf_query.make_request(url, method='PUT', params={'kind': 'folder', 'name': 'new'}))
+        self.assertEqual(self.requested, [url])
+
+
+class TestConnectionReuse(FakeSessionTestCase):
+
+    def test_requests_share_one_session_and_connector(self):
+        with mock.patch('osfoffline.polling_osf_manager.osf_query.aiohttp.ClientSession') as client_session:
+            osf_query = OSFQuery(self._loop, 'token')
+        client_session.assert_called_once_with(connector=osf_query.connector, loop=self._loop,
+                                               headers=osf_query.headers)
+
+        self.complete(self.osf_query.make_request(self.METADATA_URL))
+        self.complete(self.osf_query.make_request(self.DOWNLOAD_URL))
+        self.assertEqual(self.requested, [self.METADATA_URL, self.DOWNLOAD_URL])
+
+    def test_error_response_keeps_the_pool_open(self):
+        self.osf_query.request_session.close = mock.Mock()
+        self.responses.append(FakeResponse(status=404, body=b'not found'))
+        with self.assertRaises(aiohttp.errors.HttpBadRequest):
+            self.complete(self.osf_query.make_request(self.METADATA_URL))
+        self.assertFalse(self.osf_query.request_session.close.called)
+
+        # the next request goes out on the same session
+        self.complete(self.osf_query.make_request(self.METADATA_URL))
+        self.assertEqual(self.requested, [self.METADATA_URL, self.METADATA_URL])
+
+
+class TestCompressedMetadata(FakeSessionTestCase):
+
+    BODY = json.dumps({'data': [{'id': str(i), 'type': 'files'} for i in range(200)]}).encode('utf-8')
+
+    def counters(self, before):
+        return metrics.difference(before, metrics.snapshot())['counters']
+
+    def test_metadata_is_requested_compressed(self):
+        self.complete(self.osf_query.make_request(self.METADATA_URL))
+        self.assertEqual(self.request_headers[0]['Accept-Encoding'], METADATA_ACCEPT_ENCODING)
+
+    def test_compressed_response_records_bytes_on_the_wire(self):
+        wire_length = len(gzip.compress(self.BODY))
+        self.responses.append(FakeResponse(body=self.BODY, headers={
+            'CONTENT-ENCODING': 'gzip',
+            'CONTENT-LENGTH': str(wire_length),
+        }))
+        before = metrics.snapshot()
+        self.complete(self.osf_query.make_request(self.METADATA_URL, get_json=True))
+        counters = self.counters(before)
+
+        self.assertEqual(counters['bytes.compressed.files'], wire_length)
+        self.assertEqual(counters['bytes.uncompressed.files'], len(self.BODY))
+        # a listing compresses to a fraction of its size, the ratio in the poll report shows what was saved
+        self.assertLess(wire_length, len(self.BODY) / 4)
+
+    def test_uncompressed_response_records_no_compression(self):
+        self.responses.append(FakeResponse(body=self.BODY, headers={'CONTENT-LENGTH': str(len(self.BODY))}))
+        before = metrics.snapshot()
+        self.complete(self.osf_query.make_request(self.METADATA_URL, get_json=True))
+        counters = self.counters(before)
+
+        self.assertEqual(counters['bytes.files'], len(self.BODY))
+        self.assertNotIn('bytes.compressed.files', counters)
@@ -0,0 +1,70 @@
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from osfoffline.database_manager.models import Base, User, Node, File, PendingOperation
+
+
+class TestPendingOperation(TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+
+        self.user = User(full_name='Tester', osf_local_folder_path='/osf')
+        self.project = Node(title='project', user=self.user)
+        self.user.nodes.append(self.project)
+        self.provider = File(name=File.DEFAULT_PROVIDER, type=File.FOLDER, user=self.user, node=self.project)
+        self.session.add(self.user)
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_entry_records_the_new_file_folder(self):
+        new_file = File(name='new.txt', type=File.FILE, user=self.user, node=self.project, locally_created=True)
+        self.provider.files.append(new_file)
+        self.session.add(PendingOperation.for_file_folder(PendingOperation.CREATED, new_file))
+        self.session.commit()
+
+        entry = self.session.query(PendingOperation).one()
+        self.assertEqual(entry.operation, PendingOperation.CREATED)
+        self.assertEqual(entry.file_id, new_file.id)
+        self.assertEqual(entry.node_id, self.project.id)
+        self.assertEqual(entry.user_id, self.user.id)
+        self.assertEqual(entry.path, new_file.path)
+
+    def test_entry_outlives_its_file_folder(self):
+        new_file = File(name='new.txt', type=File.FILE, user=self.user, node=self.project)
+        self.provider.files.append(new_file)
+        self.session.add(PendingOperation.for_file_folder(PendingOperation.DELETED, new_file))
+        self.session.commit()
+
+        self.session.delete(new_file)
+        self.session.commit()
+
+        entry = self.session.query(PendingOperation).one()
+        self.assertEqual(entry.operation, PendingOperation.DELETED)
+        self.assertIsNone(entry.file)
+
+    def test_entries_of_a_user_are_read_from_the_index(self):
+        query = self.session.query(PendingOperation.id, PendingOperation.node_id).filter(
+            PendingOperation.user_id == self.user.id
+        ).order_by(PendingOperation.id)
+        statement = str(query.statement.compile(compile_kwargs={'literal_binds': True}))
+        plan = ' '.join(str(row) for row in self.engine.execute('EXPLAIN QUERY PLAN ' + statement))
+
+        self.assertIn('ix_pending_operation_user_id_id', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_entries_of_a_file_are_found_from_the_index(self):
+        query = self.session.query(PendingOperation.id).filter(
+            PendingOperation.file_id == 1,
+            PendingOperation.operation == PendingOperation.MODIFIED
+        )
+        statement = str(query.statement.compile(compile_kwargs={'literal_binds': True}))
+        plan = ' '.join(str(row) for row in self.engine.execute('EXPLAIN QUERY PLAN ' + statement))
+
+        self.assertIn('ix_pending_operation_file_id_operation', plan)
@@ -0,0 +1,52 @@
+from unittest import TestCase
+
+from osfoffline.polling_osf_manager.poll_scheduler import PollScheduler
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestPollScheduler(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = PollScheduler(min_delay=60, max_delay=3600, jitter=0, clock=self.clock)
+
+    def test_new_project_is_due(self):
+        self.assertTrue(self.scheduler.is_due('abcde'))
+        self.assertIsNone(self.scheduler.next_due('abcde'))
+
+    def test_not_due_until_interval_passed(self):
+        self.scheduler.record_poll('abcde', 'modified-1')
+        self.assertFalse(self.scheduler.is_due('abcde'))
+        self.clock.now += 60
+        self.assertTrue(self.scheduler.is_due('abcde'))
+
+    def test_dormant_project_backs_off(self):
+        for _ in range(10):
+            self.scheduler.record_poll('abcde', 'modified-1')
+        self.assertEqual(self.scheduler._get('abcde').interval, 3600)
+
+    def test_busy_project_speeds_up(self):
+        for _ in range(10):
+            self.scheduler.record_poll('abcde', 'modified-1')
+        for version in range(10):
+            self.scheduler.record_poll('abcde', 'modified-{}'.format(version + 2))
+        self.assertEqual(self.scheduler._get('abcde').interval, 60)
+
+    def test_seconds_until_next_due(self):
+        self.scheduler.record_poll('abcde', 'modified-1')
+        self.clock.now += 20
+        self.assertEqual(self.scheduler.seconds_until_next_due(['abcde']), 40)
+        self.assertEqual(self.scheduler.seconds_until_next_due(['abcde', 'fghij']), 0)
+
+    def test_jitter_stays_within_bounds(self):
+        scheduler = PollScheduler(min_delay=100, max_delay=1000, jitter=0.1, clock=self.clock)
+        scheduler.record_poll('abcde', 'modified-1')
+        next_due = scheduler._get('abcde').next_due - self.clock.now
+        self.assertTrue(90 <= next_due <= 110)
@@ -0,0 +1,496 @@
+import asyncio
+import datetime
+import hashlib
+import os
+import tempfile
+from unittest import TestCase, mock
+
+import aiohttp
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import osfoffline.alerts as AlertHandler
+from osfoffline.database_manager.models import Base, User, Node, File, PendingOperation
+from osfoffline.database_manager.utils import UnitOfWork
+from osfoffline.polling_osf_manager import polling, polling_events
+from osfoffline.polling_osf_manager.event_queue import EventQueue
+from osfoffline.polling_osf_manager.polling import Poll, to_naive_utc
+from osfoffline.polling_osf_manager.poll_checkpoint import node_key
+from osfoffline.polling_osf_manager.polling_events import CreateFile, PollingEvent
+from osfoffline.polling_osf_manager.remote_objects import RemoteFile, RemoteNode
+
+
+class RecordingEvent(PollingEvent):
+    """Event on a single path that counts its runs. Its first run blocks until it is cancelled if slow is set."""
+
+    def __init__(self, path, slow=False, error=None):
+        super().__init__()
+        self.path = path
+        self.slow = slow
+        self.error = error
+        self.runs = 0
+
+    @property
+    def paths(self):
+        return (self.path,)
+
+    @asyncio.coroutine
+    def run(self):
+        self.runs += 1
+        if self.error is not None:
+            raise self.error
+        if self.slow and self.runs == 1:
+            yield from asyncio.sleep(60)
+
+
+class PollTestCase(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.folder = tempfile.TemporaryDirectory()
+        self.user = User(
+            full_name='Tester',
+            osf_id='abcde',
+            oauth_token='token',
+            osf_local_folder_path=self.folder.name
+        )
+        self.poll = Poll(self.user, self.loop, workers=2, restart_delay=0)
+        # keep the objects of the tests out of the application's database
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+        self.poll.unit_of_work = UnitOfWork(self.session, on_rollback=self.poll.discard_batch)
+
+    def tearDown(self):
+        self.session.close()
+        self.poll.osf_query.close()
+        self.loop.close()
+        self.folder.cleanup()
+
+    def run_until(self, condition, timeout=5):
+        @asyncio.coroutine
+        def wait():
+            while not condition():
+                yield from asyncio.sleep(0.01)
+        self.loop.run_until_complete(asyncio.wait_for(wait(), timeout))
+
+
+class TestEventWorkers(PollTestCase):
+
+    def test_failing_event_does_not_block_the_queue(self):
+        self.poll.queue = EventQueue(self.loop)
+        failing = RecordingEvent('/osf/a', error=PermissionError('no access'))
+        later = RecordingEvent('/osf/a/b')
+        worker = asyncio.ensure_future(self.poll.process_queue(), loop=self.loop)
+
+        self.loop.run_until_complete(self.poll.queue.put(failing))
+        self.loop.run_until_complete(self.poll.queue.put(later))
+        self.loop.run_until_complete(asyncio.wait_for(self.poll.queue.join(), 5))
+
+        self.assertEqual(failing.runs, 1)
+        self.assertEqual(later.runs, 1)
+        self.assertFalse(worker.done())
+        worker.cancel()
+        self.loop.run_until_complete(asyncio.wait([worker]))
+
+    def test_event_interrupted_by_a_failed_poll_runs_after_the_restart(self):
+        event = RecordingEvent('/osf/a', slow=True)
+        polls = []
+
+        @asyncio.coroutine
+        def get_remote_user():
+            return {'id': 'abcde', 'type': 'users'}
+
+        @asyncio.coroutine
+        def check_osf(remote_user):
+            polls.append(remote_user)
+            if len(polls) == 1:
+                yield from self.poll.queue.put(event)
+                while event.runs == 0:
+                    yield from asyncio.sleep(0.01)
+                raise aiohttp.ClientError('connection lost')
+            yield from self.poll.queue.join()
+            yield from asyncio.sleep(60)
+
+        self.poll.get_remote_user = get_remote_user
+        self.poll.check_osf = check_osf
+
+        self.assertTrue(self.poll.start())
+        self.run_until(lambda: len(polls) == 2 and event.runs == 2 and not self.poll.queue.unfinished())
+
+        self.poll.stop()
+        self.loop.run_until_complete(asyncio.wait([self.poll.poll_job] + self.poll.process_jobs))
+
+    def test_events_of_the_rolled_back_batch_are_dropped(self):
+        committed = RecordingEvent('/osf/a', slow=True)
+        rolled_back = [RecordingEvent('/osf/a/b'), RecordingEvent('/osf/a/c')]
+        polls = []
+
+        @asyncio.coroutine
+        def get_remote_user():
+            return {'id': 'abcde', 'type': 'users'}
+
+        @asyncio.coroutine
+        def check_osf(remote_user):
+            polls.append(remote_user)
+            if len(polls) == 1:
+                yield from self.poll.enqueue(committed)
+                self.poll.unit_of_work.commit()
+                # both wait for the slow event, one of them is already held by the second worker
+                for event in rolled_back:
+                    yield from self.poll.enqueue(event)
+                while committed.runs == 0:
+                    yield from asyncio.sleep(0.01)
+                raise aiohttp.ClientError('connection lost')
+            yield from self.poll.queue.join()
+            yield from asyncio.sleep(60)
+
+        self.poll.get_remote_user = get_remote_user
+        self.poll.check_osf = check_osf
+
+        self.assertTrue(self.poll.start())
+        self.run_until(lambda: len(polls) == 2 and committed.runs == 2 and not self.poll.queue.unfinished())
+        self.assertEqual([event.runs for event in rolled_back], [0, 0])
+
+        self.poll.stop()
+        self.loop.run_until_complete(asyncio.wait([self.poll.poll_job] + self.poll.process_jobs))
+
+
+class TestCheckSiblings(PollTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.use_fan_out(3)
+        self.running = 0
+        self.most_running = 0
+        self.checked = []
+        self.failing = None
+
+    @asyncio.coroutine
+    def check(self, local, remote):
+        self.running += 1
+        self.most_running = max(self.most_running, self.running)
+        try:
+            yield from asyncio.sleep(0.01)
+            if remote is not None and remote == self.failing:
+                raise ValueError(remote)
+            self.checked.append(remote if remote is not None else local)
+        finally:
+            self.running -= 1
+
+    def use_fan_out(self, fan_out):
+        self.poll.osf_query.close()
+        self.poll = Poll(self.user, self.loop, fan_out=fan_out)
+
+    def check_siblings(self, pairs):
+        self.loop.run_until_complete(self.poll._check_siblings(self.check, pairs))
+
+    def test_siblings_are_checked_at_most_fan_out_at_a_time(self):
+        self.check_siblings([('local{}'.format(i), 'remote{}'.format(i)) for i in range(10)])
+        self.assertEqual(self.most_running, 3)
+        self.assertEqual(sorted(self.checked), sorted('remote{}'.format(i) for i in range(10)))
+
+    def test_local_only_siblings_go_first_one_at_a_time(self):
+        self.check_siblings([('local0', 'remote0'), ('gone0', None), ('local1', 'remote1'), ('gone1', None)])
+        self.assertEqual(self.checked[:2], ['gone0', 'gone1'])
+
+    def test_without_fan_out_siblings_are_checked_in_turn(self):
+        self.use_fan_out(1)
+        self.check_siblings([('local{}'.format(i), 'remote{}'.format(i)) for i in range(4)])
+        self.assertEqual(self.most_running, 1)
+        self.assertEqual(self.checked, ['remote0', 'remote1', 'remote2', 'remote3'])
+
+    def test_fan_out_covers_every_level_of_the_tree(self):
+        @asyncio.coroutine
+        def check(local, remote, depth):
+            yield from self.check(local, remote)
+            if depth < 3:
+                children = [(None, '{}.{}'.format(remote, i)) for i in range(4)]
+                yield from self.poll._check_siblings(check, children, depth=depth + 1)
+
+        self.loop.run_until_complete(
+            self.poll._check_siblings(check, [(None, str(i)) for i in range(4)], depth=1)
+        )
+        self.assertEqual(len(self.checked), 4 + 4 ** 2 + 4 ** 3)
+        self.assertEqual(self.most_running, 3)
+
+    def test_failing_sibling_cancels_the_others(self):
+        self.failing = 'remote0'
+        with self.assertRaises(ValueError):
+            self.check_siblings([('local{}'.format(i), 'remote{}'.format(i)) for i in range(10)])
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+        self.assertEqual(self.running, 0)
+        self.assertLess(len(self.checked), 9)
+
+
+def remote_node(osf_id, date_modified, parent=None):
+    url = 'http://localhost:8000/v2/nodes/{}/'.format(osf_id)
+    relationships = {
+        'files': {'links': {'related': {'href': url + 'files/'}}},
+        'children': {'links': {'related': {'href': url + 'children/'}}},
+    }
+    if parent is not None:
+        relationships['parent'] = {'links': {'related': {'href': parent}}}
+    return RemoteNode({
+        'id': osf_id,
+        'type': 'nodes',
+        'attributes': {'title': osf_id, 'category': 'project', 'date_modified': date_modified.isoformat()},
+        'relationships': relationships,
+    })
+
+
+class TestCheckNode(PollTestCase):
+    """The watermark of a node only covers its own files, its components are always checked"""
+
+    SYNCED = datetime.datetime(2015, 10, 10, 12, 0, 0, tzinfo=datetime.timezone.utc)
+    MODIFIED = datetime.datetime(2015, 10, 11, 12, 0, 0, tzinfo=datetime.timezone.utc)
+
+    def setUp(self):
+        super().setUp()
+        self.poll.queue = EventQueue(self.loop)
+        self.project = Node(title='project', osf_id='project', user=self.user, category=Node.PROJECT,
+                            sync_watermark=to_naive_utc(self.SYNCED))
+        self.component = Node(title='component', osf_id='component', user=self.user, category=Node.COMPONENT,
+                              sync_watermark=to_naive_utc(self.SYNCED))
+        self.project.child_nodes.append(self.component)
+        self.session.add(self.user)
+        self.session.commit()
+
+        self.files_checked = []
+        self.children_listed = []
+        self.remote_children = {}
+
+        @asyncio.coroutine
+        def check_file_folder(local_node, remote_node):
+            self.files_checked.append(local_node.osf_id)
+
+        @asyncio.coroutine
+        def get_child_nodes(remote_node):
+            self.children_listed.append(remote_node.id)
+            return self.remote_children.get(remote_node.id, [])
+
+        self.poll.check_file_folder = check_file_folder
+        self.poll.osf_query.get_child_nodes = get_child_nodes
+        # a cycle has finished since startup
+        self.poll._startup_cycle = False
+
+    def check(self, project_modified, component_modified):
+        remote_project = remote_node('project', project_modified)
+        self.remote_children['project'] = [remote_node('component', component_modified, parent='project')]
+        self.loop.run_until_complete(self.poll.check_node(self.project, remote_project, None))
+        self.finish_cycle()
+
+    def finish_cycle(self):
+        """Run the queued events and move the watermarks, as check_osf does at the end of a cycle"""
+        worker = asyncio.ensure_future(self.poll.process_queue(), loop=self.loop)
+        with mock.patch.object(AlertHandler, 'info'):
+            self.loop.run_until_complete(asyncio.wait_for(self.poll.queue.join(), 5))
+        worker.cancel()
+        self.loop.run_until_complete(asyncio.wait([worker]))
+        self.poll.record_synced_nodes()
+
+    def test_unchanged_node_still_checks_its_components(self):
+        self.check(self.SYNCED, self.MODIFIED)
+        self.assertEqual(self.files_checked, ['component'])
+        self.assertEqual(self.children_listed, ['project', 'component'])
+        self.assertEqual(self.component.sync_watermark, to_naive_utc(self.MODIFIED))
+
+    def test_nothing_unchanged_lists_no_files(self):
+        self.check(self.SYNCED, self.SYNCED)
+        self.assertEqual(self.files_checked, [])
+        self.assertEqual(self.children_listed, ['project', 'component'])
+
+    def test_modified_node_is_checked(self):
+        self.check(self.MODIFIED, self.SYNCED)
+        self.assertEqual(self.files_checked, ['project'])
+        self.assertEqual(self.project.sync_watermark, to_naive_utc(self.MODIFIED))
+
+    def test_local_changes_are_checked_in_their_own_node_only(self):
+        self.poll._pending_node_ids = {self.component.id}
+        self.check(self.SYNCED, self.SYNCED)
+        self.assertEqual(self.files_checked, ['component'])
+
+    def test_first_cycle_after_startup_checks_every_node(self):
+        self.poll._startup_cycle = True
+        self.check(self.SYNCED, self.SYNCED)
+        self.assertEqual(self.files_checked, ['project', 'component'])
+
+    def test_node_skipped_by_a_resumed_checkpoint_keeps_its_journal_entries(self):
+        self.session.add(PendingOperation(operation=PendingOperation.CREATED, path=self.project.path, user=self.user,
+                                          node=self.project))
+        self.session.commit()
+        # checked before the poll was restarted, the entry was recorded after that
+        self.poll.checkpoint.begin_cycle()
+        self.poll.checkpoint.mark_completed(node_key(self.project))
+        self.poll.checkpoint.save()
+        self.addCleanup(self.poll.checkpoint.clear)
+
+        with mock.patch.object(polling, 'session', self.session):
+            self.poll.read_pending_operations()
+            self.check(self.MODIFIED, self.MODIFIED)
+            self.poll.discard_pending_operations([self.project.osf_id])
+
+        self.assertEqual(self.files_checked, [])
+        self.assertEqual(self.session.query(PendingOperation).count(), 1)
+
+    def test_node_without_watermark_is_checked(self):
+        self.component.sync_watermark = None
+        self.check(self.SYNCED, self.SYNCED)
+        self.assertEqual(self.files_checked, ['component'])
+        self.assertEqual(self.component.sync_watermark, to_naive_utc(self.SYNCED))
+
+    def test_node_with_a_failed_download_is_checked_again(self):
+        downloads = []
+
+        @asyncio.coroutine
+        def check_file_folder(local_node, remote_node):
+            self.files_checked.append(local_node.osf_id)
+            event = CreateFile(os.path.join(local_node.path, 'a.txt'), 'http://localhost/a', self.poll.osf_query)
+            yield from self.poll.enqueue(event, local_node)
+
+        @asyncio.coroutine
+        def download_file(path, url, osf_query, size=None, md5=None):
+            downloads.append(path.full_path)
+            # the first attempt fails
+            return len(downloads) > 1 or None
+
+        self.poll.check_file_folder = check_file_folder
+        with mock.patch.object(polling_events, '_download_file', download_file):
+            self.check(self.MODIFIED, self.SYNCED)
+            self.assertEqual(self.project.sync_watermark, to_naive_utc(self.SYNCED))
+            self.assertNotIn(self.project.id, self.poll._synced_node_ids)
+            self.assertIn(self.component.id, self.poll._synced_node_ids)
+
+            self.poll._failed_nodes = set()
+            self.check(self.MODIFIED, self.SYNCED)
+        self.assertEqual(self.files_checked, ['project', 'project'])
+        self.assertEqual(len(downloads), 2)
+        self.assertEqual(self.project.sync_watermark, to_naive_utc(self.MODIFIED))
+        self.assertIn(self.project.id, self.poll._synced_node_ids)
+
+
+def md5(content):
+    return hashlib.md5(content).hexdigest()
+
+
+class TestFileTransferDirection(PollTestCase):
+
+    REMOTE_MODIFIED = datetime.datetime(2015, 10, 10, 12, 0, 0, tzinfo=datetime.timezone.utc)
+
+    def setUp(self):
+        super().setUp()
+        node = Node(title='project', osf_id='nid', user=self.user)
+        self.user.nodes.append(node)
+        self.local_file = File(name='a.txt', type=File.FILE, user=self.user, node=node, osf_path='/2')
+        node.files.append(self.local_file)
+        os.makedirs(os.path.dirname(self.local_file.path))
+
+    def write_local(self, content, newer_than_remote=True, synced_hash=None):
+        """Write the local file and record its stat and hash as the watcher would"""
+        with open(self.local_file.path, 'wb') as fp:
+            fp.write(content)
+        offset = datetime.timedelta(hours=1 if newer_than_remote else -1)
+        mtime = (self.REMOTE_MODIFIED + offset).timestamp()
+        os.utime(self.local_file.path, (mtime, mtime))
+        self.local_file.update_hash()
+        self.local_file.update_stat()
+        self.local_file.synced_hash = synced_hash
+
+    def edit_unwatched(self, content, newer_than_remote=True):
+        """
+        Change the local file without updating its row, like an edit made while the app was closed. The first cycle
+        after startup finds it.
+        """
+        hash_, size, mtime_ns, inode = (self.local_file.hash, self.local_file.cached_size,
+                                        self.local_file.mtime_ns, self.local_file.inode)
+        synced_hash = self.local_file.synced_hash
+        self.write_local(content, newer_than_remote, synced_hash)
+        self.local_file.hash, self.local_file.cached_size = hash_, size
+        self.local_file.mtime_ns, self.local_file.inode = mtime_ns, inode
+
+    def remote(self, content, with_md5=True):
+        extra = {'hashes': {'md5': md5(content)}} if with_md5 else {}
+        url = 'http://localhost:5000/v1/resources/nid/providers/osfstorage/2/'
+        return RemoteFile({
+            'id': '/2',
+            'type': 'files',
+            'attributes': {
+                'name': 'a.txt',
+                'kind': 'file',
+                'provider': 'osfstorage',
+                'path': '/2',
+                'size': len(content),
+                'date_modified': self.REMOTE_MODIFIED.isoformat(),
+                'extra': extra,
+            },
+            'links': {'download': url, 'delete': url, 'move': url, 'upload': url}
+        })
+
+    def direction(self, remote):
+        return self.loop.run_until_complete(self.poll.file_transfer_direction(self.local_file, remote))
+
+    def test_equal_contents_need_no_transfer(self):
+        self.write_local(b'same')
+        self.assertIsNone(self.direction(self.remote(b'same')))
+        self.assertEqual(self.local_file.synced_hash, md5(b'same'))
+
+    def test_local_change_is_uploaded(self):
+        self.write_local(b'local edit', newer_than_remote=False, synced_hash=md5(b'base'))
+        self.assertEqual(self.direction(self.remote(b'base')), AlertHandler.UPLOAD)
+
+    def test_remote_change_is_downloaded(self):
+        self.write_local(b'base', newer_than_remote=True, synced_hash=md5(b'base'))
+        self.assertEqual(self.direction(self.remote(b'remote edit')), AlertHandler.DOWNLOAD)
+
+    def test_both_changed_newer_side_wins(self):
+        self.write_local(b'local edit', newer_than_remote=True, synced_hash=md5(b'base'))
+        self.assertEqual(self.direction(self.remote(b'remote edit')), AlertHandler.UPLOAD)
+        self.write_local(b'local edit', newer_than_remote=False, synced_hash=md5(b'base'))
+        self.assertEqual(self.direction(self.remote(b'remote edit')), AlertHandler.DOWNLOAD)
+
+    def test_without_history_newer_side_wins(self):
+        self.write_local(b'local', newer_than_remote=True)
+        self.assertEqual(self.direction(self.remote(b'remote')), AlertHandler.UPLOAD)
+        self.write_local(b'local', newer_than_remote=False)
+        self.assertEqual(self.direction(self.remote(b'remote')), AlertHandler.DOWNLOAD)
+
+    def test_updating_the_row_does_not_make_the_local_file_newer(self):
+        self.write_local(b'local', newer_than_remote=False)
+        self.local_file.date_modified = datetime.datetime.utcnow()
+        self.assertEqual(self.direction(self.remote(b'remote')), AlertHandler.DOWNLOAD)
+
+    def test_without_md5_sizes_and_timestamps_decide(self):
+        self.write_local(b'four', newer_than_remote=True)
+        self.assertIsNone(self.direction(self.remote(b'FOUR', with_md5=False)))
+        self.write_local(b'longer', newer_than_remote=True)
+        self.assertEqual(self.direction(self.remote(b'four', with_md5=False)), AlertHandler.UPLOAD)
+        self.write_local(b'longer', newer_than_remote=False)
+        self.assertEqual(self.direction(self.remote(b'four', with_md5=False)), AlertHandler.DOWNLOAD)
+
+    def test_edit_made_while_unwatched_is_uploaded_not_overwritten(self):
+        self.write_local(b'base', synced_hash=md5(b'base'))
+        self.edit_unwatched(b'edited offline')
+        self.assertEqual(self.direction(self.remote(b'base')), AlertHandler.UPLOAD)
+        self.assertEqual(self.local_file.hash, md5(b'edited offline'))
+
+    def test_edit_made_while_unwatched_is_not_overwritten_by_a_remote_change(self):
+        self.write_local(b'base', synced_hash=md5(b'base'))
+        self.edit_unwatched(b'edited offline', newer_than_remote=True)
+        self.assertEqual(self.direction(self.remote(b'remote edit')), AlertHandler.UPLOAD)
+
+    def test_stored_stat_is_trusted_after_the_startup_cycle(self):
+        self.poll._startup_cycle = False
+        self.write_local(b'base', synced_hash=md5(b'base'))
+        with mock.patch('os.stat', side_effect=AssertionError('stat called')):
+            self.assertIsNone(self.direction(self.remote(b'base')))
+
+    def test_file_without_stored_stat_is_stat_ed_after_the_startup_cycle(self):
+        self.poll._startup_cycle = False
+        self.write_local(b'downloaded', synced_hash=md5(b'base'))
+        # as left by update_local_file
+        self.local_file.hash = None
+        self.local_file.forget_stat()
+        self.assertIsNone(self.direction(self.remote(b'downloaded')))
+        self.assertEqual(self.local_file.hash, md5(b'downloaded'))
+        self.assertIsNotNone(self.local_file.mtime_ns)
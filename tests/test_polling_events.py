@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from osfoffline.polling_osf_manager.osf_query import OK, PARTIAL_CONTENT, RANGE_NOT_SATISFIABLE
+from osfoffline.polling_osf_manager import polling_events
+from osfoffline.polling_osf_manager.polling_events import _download_file, _part_path, PART_LENGTH_SUFFIX
+from osfoffline.settings import DOWNLOAD_PART_SUFFIX
+from osfoffline.utils.path import ProperPath
+
+
+class FakeContent(object):
+
+    def __init__(self, data, stall_after=None, read_size=None, delay=0):
+        self.data = data
+        self.stall_after = stall_after
+        self.read_size = read_size
+        self.delay = delay
+        self.position = 0
+
+    @asyncio.coroutine
+    def read(self, n):
+        if self.delay:
+            yield from asyncio.sleep(self.delay)
+        end = self.position + min(n, self.read_size or n)
+        if self.stall_after is not None:
+            if self.position >= self.stall_after:
+                yield from asyncio.sleep(60)
+            end = min(end, self.stall_after)
+        chunk = self.data[self.position:end]
+        self.position += len(chunk)
+        return chunk
+
+
+class FakeResponse(object):
+
+    def __init__(self, status, data=b'', **content_options):
+        self.status = status
+        self.content = FakeContent(data, **content_options)
+        self.released = False
+
+    @asyncio.coroutine
+    def release(self):
+        self.released = True
+
+    def close(self):
+        pass
+
+
+class FakeOSFQuery(object):
+    """Serves data, honouring Range headers unless told otherwise"""
+
+    def __init__(self, data, honour_range=True, reject_range=False, **content_options):
+        self.data = data
+        self.honour_range = honour_range
+        self.reject_range = reject_range
+        self.content_options = content_options
+        self.requests = []
+        self.slot = asyncio.Semaphore(1)
+
+    @asyncio.coroutine
+    def transfer_slot(self):
+        return (yield from self.slot)
+
+    @asyncio.coroutine
+    def make_request(self, url, headers=None, expects=None, slot_held=False):
+        assert slot_held and self.slot.locked()
+        self.requests.append(dict(headers or {}))
+        range_header = (headers or {}).get('Range')
+        if range_header and self.reject_range:
+            return FakeResponse(RANGE_NOT_SATISFIABLE)
+        if range_header and self.honour_range:
+            offset = int(range_header[len('bytes='):-1])
+            return FakeResponse(PARTIAL_CONTENT, self.data[offset:], **self.content_options)
+        return FakeResponse(OK, self.data, **self.content_options)
+
+
+class TestDownloadFile(TestCase):
+
+    DATA = bytes(range(256)) * 64
+
+    def setUp(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = ProperPath(os.path.join(self.folder.name, 'file.bin'), is_dir=False)
+        self.md5 = hashlib.md5(self.DATA).hexdigest()
+
+    def tearDown(self):
+        self._loop.close()
+        self.folder.cleanup()
+
+    def download(self, osf_query, size=None, md5=None):
+        return self._loop.run_until_complete(
+            _download_file(self.path, 'http://localhost/file', osf_query, size=size, md5=md5)
+        )
+
+    def write_part(self, data, md5):
+        with open(_part_path(self.path.full_path, md5), 'wb') as fd:
+            fd.write(data)
+
+    def read_file(self):
+        with open(self.path.full_path, 'rb') as fd:
+            return fd.read()
+
+    def part_files(self):
+        return [name for name in os.listdir(self.folder.name)
+                if name.endswith(DOWNLOAD_PART_SUFFIX) or name.endswith(PART_LENGTH_SUFFIX)]
+
+    def test_download_is_moved_into_place(self):
+        osf_query = FakeOSFQuery(self.DATA)
+        self.assertTrue(self.download(osf_query, size=len(self.DATA), md5=self.md5))
+        self.assertEqual(self.read_file(), self.DATA)
+        self.assertEqual(self.part_files(), [])
+        self.assertNotIn('Range', osf_query.requests[0])
+
+    def test_partial_download_of_the_same_version_is_resumed(self):
+        self.write_part(self.DATA[:1000], self.md5)
+        osf_query = FakeOSFQuery(self.DATA)
+        self.assertTrue(self.download(osf_query, size=len(self.DATA), md5=self.md5))
+        self.assertEqual(osf_query.requests[0]['Range'], 'bytes=1000-')
+        self.assertEqual(self.read_file(), self.DATA)
+        self.assertEqual(self.part_files(), [])
+
+    def test_preallocated_part_of_a_killed_download_is_resumed_where_the_data_ends(self):
+        self.write_part(self.DATA[:1000] + bytes(len(self.DATA) - 1000), self.md5)
+        with open(_part_path(self.path.full_path, self.md5) + PART_LENGTH_SUFFIX, 'w') as fd:
+            fd.write('1000')
+        osf_query = FakeOSFQuery(self.DATA)
+        self.assertTrue(self.download(osf_query, size=len(self.DATA), md5=self.md5))
+        self.assertEqual(osf_query.requests[0]['Range'], 'bytes=1000-')
+        self.assertEqual(self.read_file(), self.DATA)
+        self.assertEqual(self.part_files(), [])
+
+    def test_partial_download_is_discarded_when_the_server_ignores_the_range(self):
+        self.write_part(b'x' * 1000, self.md5)
+        osf_query = FakeOSFQuery(self.DATA, honour_range=False)
+        self.assertTrue(self.download(osf_query, size=len(self.DATA), md5=self.md5))
+        self.assertEqual(self.read_file(), self.DATA)
+
+    def test_partial_download_is_discarded_when_the_range_is_rejected(self):
+        self.write_part(self.DATA[:1000], self.md5)
+        osf_query = FakeOSFQuery(self.DATA, reject_range=True)
+        self.assertTrue(self.download(osf_query, size=len(self.DATA), md5=self.md5))
+        self.assertEqual(len(osf_query.requests), 2)
+        self.assertNotIn('Range', osf_query.requests[1])
+        self.assertEqual(self.read_file(), self.DATA)
+
+    def test_partial_download_of_another_version_is_never_resumed(self):
+        old_md5 = hashlib.md5(b'old version').hexdigest()
+        self.write_part(b'old version'[:5], old_md5)
+        osf_query = FakeOSFQuery(self.DATA)
+        self.assertTrue(self.download(osf_query, size=len(self.DATA), md5=self.md5))
+        self.assertNotIn('Range', osf_query.requests[0])
+        self.assertEqual(self.read_file(), self.DATA)
+        self.assertEqual(self.part_files(), [])
+
+    def test_without_md5_nothing_is_resumed(self):
+        self.write_part(self.DATA[:1000], None)
+        osf_query = FakeOSFQuery(self.DATA)
+        self.assertTrue(self.download(osf_query, size=len(self.DATA)))
+        self.assertNotIn('Range', osf_query.requests[0])
+        self.assertEqual(self.read_file(), self.DATA)
+
+    def test_size_mismatch_keeps_the_partial_file(self):
+        osf_query = FakeOSFQuery(self.DATA[:1000])
+        self.assertIsNone(self.download(osf_query, size=len(self.DATA), md5=self.md5))
+        self.assertFalse(os.path.exists(self.path.full_path))
+        self.assertEqual(self.part_files(), [os.path.basename(_part_path(self.path.full_path, self.md5))])
+
+    def test_checksum_mismatch_discards_the_download(self):
+        osf_query = FakeOSFQuery(b'y' * len(self.DATA))
+        self.assertIsNone(self.download(osf_query, size=len(self.DATA), md5=self.md5))
+        self.assertFalse(os.path.exists(self.path.full_path))
+        self.assertEqual(self.part_files(), [])
+
+    def test_stalled_body_times_out_and_releases_the_transfer_slot(self):
+        osf_query = FakeOSFQuery(self.DATA, stall_after=4096)
+        with mock.patch.object(polling_events, 'TRANSFER_READ_TIMEOUT', 0.05):
+            self.assertIsNone(self.download(osf_query, size=len(self.DATA), md5=self.md5))
+        self.assertFalse(osf_query.slot.locked())
+        self.assertFalse(os.path.exists(self.path.full_path))
+        # what arrived is kept for the next attempt
+        self.assertEqual(os.path.getsize(_part_path(self.path.full_path, self.md5)), 4096)
+
+    def test_slow_download_that_keeps_receiving_data_is_not_cut_off(self):
+        # 16 reads of 0.02 seconds, far longer than the read timeout all together
+        osf_query = FakeOSFQuery(self.DATA, read_size=1024, delay=0.02)
+        with mock.patch.object(polling_events, 'TRANSFER_READ_TIMEOUT', 0.05):
+            self.assertTrue(self.download(osf_query, size=len(self.DATA), md5=self.md5))
+        self.assertEqual(self.read_file(), self.DATA)
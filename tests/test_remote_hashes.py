@@ -0,0 +1,27 @@
+from unittest import TestCase
+
+from osfoffline.polling_osf_manager.remote_objects import RemoteFile
+
+
+class TestRemoteFileHashes(TestCase):
+
+    def file_dict(self, extra=None):
+        attributes = {'name': 'a.txt', 'kind': 'file', 'provider': 'osfstorage', 'size': 3}
+        if extra is not None:
+            attributes['extra'] = extra
+        url = 'http://localhost:5000/v1/resources/1/providers/osfstorage/2/'
+        return {
+            'id': '2',
+            'type': 'files',
+            'attributes': attributes,
+            'links': {'download': url, 'delete': url, 'move': url, 'upload': url}
+        }
+
+    def test_hashes_are_parsed(self):
+        remote = RemoteFile(self.file_dict({'hashes': {'md5': 'abc', 'sha256': 'def'}}))
+        self.assertEqual(remote.md5, 'abc')
+        self.assertEqual(remote.hashes['sha256'], 'def')
+
+    def test_missing_hashes(self):
+        self.assertIsNone(RemoteFile(self.file_dict()).md5)
+        self.assertIsNone(RemoteFile(self.file_dict({'hashes': None})).md5)
@@ -0,0 +1,56 @@
+import os
+from unittest import TestCase
+
+from osfoffline.filesystem_manager.self_writes import SelfWriteRegistry, CREATED, DELETED, MODIFIED, MOVED
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestSelfWriteRegistry(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.registry = SelfWriteRegistry(expiry=5, clock=self.clock)
+        self.folder = os.path.join(os.path.sep, 'osf', 'project', 'folder')
+
+    def test_matches_path_and_operation(self):
+        entry = self.registry.begin(self.folder, CREATED)
+        self.registry.finish(entry)
+        self.assertTrue(self.registry.is_echo(self.folder, CREATED))
+        self.assertFalse(self.registry.is_echo(self.folder, DELETED))
+        self.assertFalse(self.registry.is_echo(self.folder + '2', CREATED))
+
+    def test_covers_contents(self):
+        self.registry.begin(self.folder, DELETED)
+        self.registry.begin(self.folder, MOVED)
+        self.assertTrue(self.registry.is_echo(os.path.join(self.folder, 'a.txt'), DELETED))
+        self.assertTrue(self.registry.is_echo(os.path.join(self.folder, 'a.txt'), MOVED))
+
+    def test_file_created_by_the_user_in_a_folder_just_created_is_not_an_echo(self):
+        entry = self.registry.begin(self.folder, CREATED)
+        self.registry.finish(entry)
+        self.assertTrue(self.registry.is_echo(self.folder, CREATED))
+        self.assertFalse(self.registry.is_echo(os.path.join(self.folder, 'a.txt'), CREATED))
+        self.assertFalse(self.registry.is_echo(os.path.join(self.folder, 'a.txt'), MODIFIED))
+
+    def test_modification_only_covers_its_own_file(self):
+        self.registry.begin(self.folder, MODIFIED)
+        self.assertTrue(self.registry.is_echo(self.folder + os.path.sep, MODIFIED))
+        self.assertFalse(self.registry.is_echo(os.path.join(self.folder, 'a.txt'), MODIFIED))
+
+    def test_in_progress_writes_do_not_expire(self):
+        entry = self.registry.begin(self.folder, MODIFIED)
+        self.clock.now = 60
+        self.assertTrue(self.registry.is_echo(self.folder, MODIFIED))
+        self.registry.finish(entry)
+        self.clock.now = 64
+        self.assertTrue(self.registry.is_echo(self.folder, MODIFIED))
+        self.clock.now = 66
+        self.assertFalse(self.registry.is_echo(self.folder, MODIFIED))
@@ -0,0 +1,100 @@
+import asyncio
+import io
+import os
+import tempfile
+from unittest import TestCase
+
+from osfoffline.polling_osf_manager.transfer import TransferProgress, preallocate, stream_to_file
+import osfoffline.alerts as AlertHandler
+
+
+class FakeContent(object):
+
+    def __init__(self, data, read_size, fail_after=None):
+        self.data = data
+        self.read_size = read_size
+        self.fail_after = fail_after
+        self.position = 0
+
+    @asyncio.coroutine
+    def read(self, n):
+        if self.fail_after is not None and self.position >= self.fail_after:
+            raise asyncio.TimeoutError()
+        chunk = self.data[self.position:self.position + min(n, self.read_size)]
+        self.position += len(chunk)
+        return chunk
+
+
+class CountingFile(io.BytesIO):
+
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def write(self, b):
+        self.writes += 1
+        return super().write(b)
+
+
+class TestStreamToFile(TestCase):
+
+    def setUp(self):
+        self._loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self._loop.close()
+
+    def test_small_reads_are_written_in_full_buffers(self):
+        data = bytes(range(256)) * 40
+        file = CountingFile()
+        written = self._loop.run_until_complete(stream_to_file(FakeContent(data, 100), file, buffer_size=4096))
+        self.assertEqual(written, len(data))
+        self.assertEqual(file.getvalue(), data)
+        self.assertEqual(file.writes, 3)
+
+    def test_every_full_buffer_written_is_reported(self):
+        written = []
+        self._loop.run_until_complete(
+            stream_to_file(FakeContent(b'z' * 10000, 100), io.BytesIO(), buffer_size=4096, on_write=written.append)
+        )
+        self.assertEqual(written, [4096, 8192])
+
+    def test_buffered_bytes_are_written_when_interrupted(self):
+        data = b'x' * 1000
+        file = CountingFile()
+        with self.assertRaises(asyncio.TimeoutError):
+            self._loop.run_until_complete(
+                stream_to_file(FakeContent(data, 100, fail_after=300), file, buffer_size=4096)
+            )
+        self.assertEqual(file.getvalue(), b'x' * 300)
+
+    def test_read_waiting_longer_than_the_read_timeout_fails(self):
+        class StallingContent(FakeContent):
+            @asyncio.coroutine
+            def read(self, n):
+                if self.position >= 300:
+                    yield from asyncio.sleep(60)
+                return (yield from super().read(n))
+
+        file = io.BytesIO()
+        with self.assertRaises(asyncio.TimeoutError):
+            self._loop.run_until_complete(
+                stream_to_file(StallingContent(b'x' * 1000, 100), file, buffer_size=4096, read_timeout=0.05)
+            )
+        self.assertEqual(file.getvalue(), b'x' * 300)
+
+    def test_progress_counts_resumed_bytes(self):
+        progress = TransferProgress('a.txt', AlertHandler.DOWNLOAD, total=2000, offset=1000)
+        self._loop.run_until_complete(stream_to_file(FakeContent(b'y' * 1000, 100), io.BytesIO(), progress=progress))
+        self.assertEqual(progress.transferred, 2000)
+        self.assertEqual(progress.percent, 100)
+
+
+class TestPreallocate(TestCase):
+
+    def test_file_is_extended(self):
+        with tempfile.TemporaryFile() as file:
+            file.write(b'abc')
+            preallocate(file, 10)
+            self.assertEqual(os.fstat(file.fileno()).st_size, 10)
+            self.assertEqual(file.tell(), 3)
@@ -0,0 +1,75 @@
+from unittest import TestCase
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from osfoffline.database_manager.models import Base, User, Node, File
+from osfoffline.database_manager.tree_loader import load_local_tree
+
+
+class TestLoadLocalTree(TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+
+        user = User(full_name='Tester', osf_local_folder_path='/osf')
+        for project_number in range(3):
+            project = Node(title='project {}'.format(project_number), user=user)
+            user.nodes.append(project)
+            component = Node(title='component', user=user)
+            project.child_nodes.append(component)
+            provider = File(name=File.DEFAULT_PROVIDER, type=File.FOLDER, user=user, node=component)
+            folder = File(name='folder', type=File.FOLDER, user=user, node=component)
+            provider.files.append(folder)
+            for file_number in range(3):
+                folder.files.append(File(name='{}.txt'.format(file_number), type=File.FILE, user=user, node=component))
+        self.session.add(user)
+        self.session.commit()
+        self.session.close()
+
+        self.queries = []
+        event.listen(self.engine, 'before_cursor_execute', self.count_query)
+
+    def tearDown(self):
+        event.remove(self.engine, 'before_cursor_execute', self.count_query)
+        self.session.close()
+
+    def count_query(self, conn, cursor, statement, parameters, context, executemany):
+        self.queries.append(statement)
+
+    def walk(self, node):
+        names = [node.title]
+        for file_folder in node.top_level_file_folders:
+            names.extend(self.walk_files(file_folder))
+        for child in node.child_nodes:
+            assert child.parent is node
+            names.extend(self.walk(child))
+        return names
+
+    def walk_files(self, file_folder):
+        names = [file_folder.path]
+        for child in file_folder.files:
+            assert child.parent is file_folder and child.node is file_folder.node
+            names.extend(self.walk_files(child))
+        return names
+
+    def test_walking_the_loaded_tree_needs_no_queries(self):
+        user = self.session.query(User).one()
+        tree = load_local_tree(self.session, user)
+        loading_queries = len(self.queries)
+
+        names = []
+        for project in user.top_level_nodes:
+            names.extend(self.walk(project))
+
+        self.assertEqual(loading_queries, 3)
+        self.assertEqual(len(self.queries), loading_queries)
+        self.assertEqual(len(names), 3 * (2 + 5))
+        self.assertEqual(len(tree.top_level_nodes), 3)
+
+    def test_loaded_relationships_are_not_changes(self):
+        user = self.session.query(User).one()
+        load_local_tree(self.session, user)
+        self.assertFalse(self.session.dirty)
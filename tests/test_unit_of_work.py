@@ -0,0 +1,57 @@
+from unittest import TestCase
+from unittest import mock
+
+from osfoffline.database_manager.utils import UnitOfWork
+
+
+class TestUnitOfWork(TestCase):
+
+    def setUp(self):
+        self.session = mock.Mock()
+        self.unit_of_work = UnitOfWork(self.session, batch_size=3)
+
+    def test_checkpoint_waits_for_a_full_batch(self):
+        self.unit_of_work.save(object())
+        self.unit_of_work.delete(object())
+        self.unit_of_work.checkpoint()
+        self.assertFalse(self.session.commit.called)
+
+        self.unit_of_work.save(object())
+        self.unit_of_work.checkpoint()
+        self.assertEqual(self.session.commit.call_count, 1)
+        self.assertEqual(self.unit_of_work.pending, 0)
+
+    def test_failed_commit_rolls_back_the_batch(self):
+        self.session.commit.side_effect = ValueError
+        self.unit_of_work.save(object())
+        with self.assertRaises(ValueError):
+            self.unit_of_work.commit()
+        self.assertTrue(self.session.rollback.called)
+        self.assertEqual(self.unit_of_work.pending, 0)
+
+    def test_interrupted_commit_runs_no_rollback_hooks(self):
+        self.unit_of_work.on_rollback = mock.Mock()
+        self.session.commit.side_effect = KeyboardInterrupt
+        with self.assertRaises(KeyboardInterrupt):
+            self.unit_of_work.commit()
+        self.assertFalse(self.unit_of_work.on_rollback.called)
+
+    def test_context_manager_rolls_back_on_error(self):
+        with self.assertRaises(KeyError):
+            with self.unit_of_work as unit_of_work:
+                unit_of_work.save(object())
+                raise KeyError
+        self.assertTrue(self.session.rollback.called)
+        self.assertFalse(self.session.commit.called)
+
+    def test_batch_advances_after_the_callbacks(self):
+        batches = []
+        self.unit_of_work.on_commit = lambda: batches.append(('commit', self.unit_of_work.batch))
+        self.unit_of_work.on_rollback = lambda: batches.append(('rollback', self.unit_of_work.batch))
+        self.unit_of_work.commit()
+        self.unit_of_work.rollback()
+        self.assertEqual(batches, [('commit', 0), ('rollback', 1)])
+        self.assertEqual(self.unit_of_work.batch, 2)
+
+    def test_changes_are_not_flushed_before_the_commit(self):
+        self.assertFalse(self.session.autoflush)